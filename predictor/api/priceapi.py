@@ -2,16 +2,56 @@ import logging
 import sys
 import os
 import asyncio
-from typing import Dict
+import contextlib
+import hashlib
+import hmac
+import json
+import random
+import time
+import urllib.parse
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, AsyncGenerator, Dict, List, Set, Tuple
 from enum import Enum
 
 from pydantic import BaseModel
+import numpy as np
 import pytz
-from fastapi import FastAPI, Query
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 import datetime
 
-from predictor.model.pricepredictor import Country
+from predictor.model import schedule
+from predictor.model.countries import RESOLUTIONS, Country
+from predictor.model.priceseries import PriceSeries
+from predictor.model.httpclient import HttpClient
+from predictor.model.metrics import REGISTRY, CONTENT_TYPE, Counter, Gauge, Histogram
+from predictor.model.profiling import ProfileSession
+from predictor.model.snapshots import LeaderLock, SnapshotMeta, SnapshotStore
+from predictor.model.statestore import StateStore
+
+# The model (pandas, sklearn, ...) is imported when the first country is initialized, not when the API is imported
+if TYPE_CHECKING:
+    from predictor.model.pricepredictor import PricePredictor
+    from predictor.model.weather import WeatherFetcher
+
+# One pooled HTTP client for all upstream requests (SMARD, Open-Meteo, ENTSO-E), shared by all countries
+httpClient = HttpClient()
+
+@contextlib.asynccontextmanager
+async def lifespan(app : FastAPI):
+    await httpClient.start()
+    await pricesHandler.restore_state()
+    pricesHandler.prewarm()
+    scheduler = RefreshScheduler(pricesHandler)
+    scheduler.start()
+    monitor = asyncio.create_task(monitor_event_loop(LOOP_MONITOR_SECONDS)) if LOOP_MONITOR_SECONDS > 0 else None
+    yield
+    if monitor is not None:
+        monitor.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await monitor
+    await scheduler.stop()
+    await httpClient.close()
 
 app = FastAPI(title="EPEX day-ahead prediction API", description="""
 API can be used free of charge on a fair use premise.
@@ -22,7 +62,7 @@ This is an open source project, feel free to host it yourself. [Source code and
 Electricity prices provided by [Bundesnetzagentur | SMARD.de](https://smard.de)
 
 [Weather data by Open-Meteo.com](https://open-meteo.com/)
-""")
+""", lifespan=lifespan)
 
 
 logging.basicConfig(
@@ -38,14 +78,135 @@ logging.getLogger("uvicorn.access").handlers.extend(logging.getLogger().handlers
 
 log = logging.getLogger(__name__)
 
+REQUEST_SECONDS = Histogram("epex_request_duration_seconds", "Request latency including serialization, by route and query shape",
+                            ["route", "status", "country", "unit", "evaluation", "window", "start"])
+SELECT_SECONDS = Histogram("epex_prices_select_seconds", "Time /prices spends selecting and converting prices, before serialization", ["country"])
+UPDATE_SECONDS = Histogram("epex_update_duration_seconds", "Duration of background updates (fetch, train, predict)", ["country"])
+UPDATE_FAILURES = Counter("epex_update_failures_total", "Background updates that failed with an exception", ["country"])
+UPDATES_IN_PROGRESS = Gauge("epex_updates_in_progress", "Currently running background updates", ["country"])
+LAST_PRICE_UPDATE = Gauge("epex_last_price_update_timestamp_seconds", "Time of the last successful price update", ["country"])
+LAST_WEATHER_UPDATE = Gauge("epex_last_weather_update_timestamp_seconds", "Time of the last successful weather update", ["country"])
+RESPONSE_CACHE = Counter("epex_response_cache_total", "Lookups in the /prices response cache by result (hit, miss, not_modified)", ["country", "result"])
+STREAM_SUBSCRIBERS = Gauge("epex_stream_subscribers", "Open /prices/stream connections", ["country"])
+KNOWN_UNTIL = Gauge("epex_known_until_timestamp_seconds", "Start of the last known (not predicted) price that is served", ["country"])
+LOOP_LAG = Histogram("epex_event_loop_lag_seconds", "How late the event loop woke up from a timer, i.e. how long it was blocked by other work")
+
+
+async def monitor_event_loop(interval : float) -> None:
+    """
+    Sleeps for interval in a loop and observes how much later than that the loop got back to it
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
+
+
+def query_shape(queryString : bytes) -> Tuple[str, str, str, str, str]:
+    """
+    Classifies a /prices query into a few label values, so the number of label combinations stays small
+    """
+    params = urllib.parse.parse_qs(queryString.decode("latin-1"))
+    country = params.get("country", ["DE"])[0]
+    unit = params.get("unit", ["CT_PER_KWH"])[0]
+    evaluation = params.get("evaluation", ["false"])[0].lower() in ("yes", "true", "t", "1", "on")
+    try:
+        hours = int(params.get("hours", ["-1"])[0])
+    except ValueError:
+        hours = -2
+    window = "all" if hours == -1 else "invalid" if hours < 0 else "24h" if hours <= 24 else "48h" if hours <= 48 else "7d" if hours <= 168 else "more"
+    return (country if country in Country.__members__ else "invalid",
+            unit if unit in PriceUnit.__members__ else "invalid",
+            str(evaluation).lower(),
+            window,
+            "explicit" if "startTs" in params else "now")
+
+
+class RequestMetrics:
+    """
+    ASGI middleware recording the latency of every request, including response serialization
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = [500]
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            shape = query_shape(scope["query_string"]) if path == "/prices" else ("", "", "", "", "")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, path, str(status[0]), *shape)
+
+app.add_middleware(RequestMetrics)
+
+
 @app.get("/",  include_in_schema=False)
 def api_docs():
     return RedirectResponse("/docs")
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
 
-USE_PERSISTENT_TESTDATA = os.getenv("USE_PERSISTENT_TEST_DATA", "false").lower() in ("yes", "true", "t", "1")
 
-import predictor.model.pricepredictor as pp
+USE_PERSISTENT_TESTDATA = os.getenv("USE_PERSISTENT_TEST_DATA", "false").lower() in ("yes", "true", "t", "1")
+# If set, all fetched weather and prices are recorded to this directory. Test data mode replays from it (default: "history")
+HISTORY_DIR = os.getenv("HISTORY_DIR")
+
+historyStore = None
+if HISTORY_DIR:
+    from predictor.model.historystore import HistoryStore
+    historyStore = HistoryStore(HISTORY_DIR)
+# Nearest neighbour search implementation, see predictor.model.neighbors. All backends give the same predictions, unless distances tie at the k-th neighbour
+NEIGHBOR_BACKEND = os.getenv("NEIGHBOR_BACKEND", "bucketed")
+
+# Countries served by this instance (default: all). Others are rejected with 404.
+# A country is initialized on its first request, or at startup if it is in PREWARM_COUNTRIES. The scheduler then starts its first update right away
+ENABLED_COUNTRIES = [Country(c.strip().upper()) for c in os.getenv("ENABLED_COUNTRIES", ",".join(c.value for c in Country)).split(",") if c.strip()]
+PREWARM_COUNTRIES = [Country(c.strip().upper()) for c in os.getenv("PREWARM_COUNTRIES", "").split(",") if c.strip()]
+# Countries predicted and served in 15 minute intervals instead of hours. Others use the resolution of their country config
+QUARTERHOUR_COUNTRIES = [Country(c.strip().upper()) for c in os.getenv("QUARTERHOUR_COUNTRIES", "").split(",") if c.strip()]
+
+# Profiling: POST /admin/profile is only available if ADMIN_TOKEN is set. PROFILE_COUNTRIES (e.g. "DE,AT") profiles the first update cycle after startup
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_COUNTRIES = [c.strip().upper() for c in os.getenv("PROFILE_COUNTRIES", "").split(",") if c.strip()]
+# Encoded /prices responses kept per country, until the next model is published
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+# Maximum number of tariffs in one /prices/batch request
+MAX_BATCH_TARIFFS = int(os.getenv("MAX_BATCH_TARIFFS", "10000"))
+# Scheduled refreshes (see predictor.model.schedule) are delayed by a random 0..REFRESH_JITTER_SECONDS, so instances spread their upstream requests
+REFRESH_JITTER_SECONDS = float(os.getenv("REFRESH_JITTER_SECONDS", "120"))
+# Seconds between heartbeats on idle /prices/stream connections
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+# Interval of the timer that measures event loop stalls (epex_event_loop_lag_seconds), 0 disables it
+LOOP_MONITOR_SECONDS = float(os.getenv("LOOP_MONITOR_SECONDS", "0.05"))
+
+# Multi-process serving (e.g. uvicorn --workers): if SNAPSHOT_DIR is set, only the process holding the trainer lock
+# fetches and trains. It writes each published prediction to a snapshot file, all other processes map it and poll for new versions
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
+SNAPSHOT_POLL_SECONDS = float(os.getenv("SNAPSHOT_POLL_SECONDS", "5"))
+# A serving process without a snapshot yet (trainer still on its first update) lets requests wait this long, then answers 503
+SNAPSHOT_WAIT_SECONDS = float(os.getenv("SNAPSHOT_WAIT_SECONDS", "60"))
+snapshotStore = SnapshotStore(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+leaderLock = LeaderLock(os.path.join(SNAPSHOT_DIR, "trainer.lock")) if SNAPSHOT_DIR else None
+
+# If set, the trained state of each country is saved here after every update and loaded at startup, so a restarted
+# process serves the last prediction right away and only refreshes what is stale, in the background
+STATE_DIR = os.getenv("STATE_DIR")
+stateStore = StateStore(STATE_DIR) if STATE_DIR else None
 
 class PriceUnit(str, Enum):
     CT_PER_KWH = "CT_PER_KWH" #1.0
@@ -59,108 +220,466 @@ class PriceUnit(str, Enum):
             return ct_per_kwh / 100.0 * 1000
         return ct_per_kwh
 
+    def totals(self, values : np.ndarray, fixedPrice : float | np.ndarray, taxPercent : float | np.ndarray) -> np.ndarray:
+        """
+        Prices (ct/kWh) with tariff applied, in this unit, rounded as served. fixedPrice and taxPercent may be arrays broadcasting against values.
+        All endpoints use this, so they return the same totals
+        """
+        totals = np.asarray(self.convert((values + fixedPrice) * (1 + taxPercent / 100.0)))
+        # round() per value, not np.round: that rounds the value times 10^4 half to even, which differs in the last digit
+        # for some values (e.g. 29.3038 instead of 29.3037)
+        return np.array([round(total, 4) for total in totals.ravel().tolist()]).reshape(totals.shape)
+
     
 
+class CachedResponse:
+    """
+    Encoded JSON body of a /prices response and its ETag (hash of the body)
+    """
+    body : bytes
+    etag : str
+
+    def __init__(self, body : bytes):
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+    def matches(self, ifNoneMatch : str | None) -> bool:
+        if ifNoneMatch is None:
+            return False
+        tags = [t.strip().removeprefix("W/") for t in ifNoneMatch.split(",")]
+        return "*" in tags or self.etag in tags
+
+
 class CountryPrices:
-    predictor : pp.PricePredictor
+    predictor : "PricePredictor"
+    # length of one price interval in seconds, see countries.RESOLUTIONS
+    interval : int = 3600
 
     last_weather_update : datetime.datetime = datetime.datetime(1980, 1, 1)
     last_price_update : datetime.datetime = datetime.datetime(1980, 1, 1)
 
-    last_known_price : tuple[datetime.datetime, float] = (datetime.datetime.now(), 0)
-
-    cachedprices : Dict[datetime.datetime, float] = {}
-    cachedeval : Dict[datetime.datetime, float] = {}
+    # known and estimated prices of the last training run. Serves both normal and evaluation requests.
+    # Replaced as a whole after each training run (see publish), so requests always see one consistent version
+    cachedprices : PriceSeries | None = None
+    # encoded responses for cachedprices by normalized query
+    responseCache : OrderedDict[Tuple, CachedResponse]
 
+    # next refreshes by the RefreshScheduler. A new country is due right away
+    nextPriceRefresh : datetime.datetime = datetime.datetime(1980, 1, 1, tzinfo=datetime.timezone.utc)
+    nextWeatherRefresh : datetime.datetime = datetime.datetime(1980, 1, 1, tzinfo=datetime.timezone.utc)
+    # the running update. All callers share it (single-flight), see start_update
     updateTask : asyncio.Task | None = None
-
-    def __init__(self, country : Country):
-        self.predictor =  pp.PricePredictor(country, testdata=USE_PERSISTENT_TESTDATA)
+    # the last update started by force_update
+    forcedTask : asyncio.Task | None = None
+
+    # one queue per /prices/stream connection. publish puts the new series in, keeping only the latest one
+    subscribers : Set[asyncio.Queue]
+
+    # False in serving-only processes in snapshot mode: predictions are loaded from the snapshot store instead of trained
+    trainer : bool = True
+    snapshotVersion : int = -1
+    # the last snapshot write of the trainer, see write_snapshot
+    snapshotWrite : asyncio.Future | None = None
+
+    # profile the next update cycle, see profile_update
+    profileNext : bool = False
+    lastProfile : Dict[str, Any] | None = None
+
+    def __init__(self, country : Country, weatherFetcher : "WeatherFetcher | None" = None):
+        from predictor.model.pricepredictor import PricePredictor
+        self.predictor =  PricePredictor(country, testdata=USE_PERSISTENT_TESTDATA, http=httpClient, store=historyStore, neighborBackend=NEIGHBOR_BACKEND,
+                                         weatherFetcher=weatherFetcher, resolution="quarterhour" if country in QUARTERHOUR_COUNTRIES else None)
+        self.interval = RESOLUTIONS[self.predictor.resolution]
+        self.profileNext = country.value in PROFILE_COUNTRIES
+        self.responseCache = OrderedDict()
+        self.subscribers = set()
+        # countries initialized after the trainer election are trained by the trainer as well
+        self.trainer = snapshotStore is None or (leaderLock is not None and leaderLock.held)
 
     async def prices(self, hours : int = -1, fixedPrice : float = 0.0, taxPercent : float = 0.0, startTs : datetime.datetime|None = None,
                     unit : PriceUnit = PriceUnit.CT_PER_KWH, evaluation : bool = False):
 
-        await self.update_in_background()
-
+        await self.ensure_prices()
+        return self.build_prices(self.cachedprices, hours, fixedPrice, taxPercent, self.normalize_start(startTs), unit, evaluation)
+
+    async def prices_response(self, hours : int = -1, fixedPrice : float = 0.0, taxPercent : float = 0.0, startTs : datetime.datetime|None = None,
+                    unit : PriceUnit = PriceUnit.CT_PER_KWH, evaluation : bool = False) -> CachedResponse:
+        """
+        Same as prices(), but encoded. Repeated queries are served from the cache until the next model is published
+        """
+        await self.ensure_prices()
+
+        series = self.cachedprices
+        start = self.normalize_start(startTs)
+        key = (unit.value, fixedPrice, taxPercent, start.timestamp(), max(hours, -1), evaluation)
+        cache = self.responseCache
+        response = cache.get(key)
+        if response is not None:
+            cache.move_to_end(key)
+            RESPONSE_CACHE.inc(self.predictor.config.COUNTRY_CODE, "hit")
+            return response
+
+        RESPONSE_CACHE.inc(self.predictor.config.COUNTRY_CODE, "miss")
+        response = CachedResponse(self.encode_prices(series, hours, fixedPrice, taxPercent, start, unit, evaluation))
+        # without a model, knownUntil is the current time, so the response must not be cached
+        if series is not None:
+            cache[key] = response
+            if len(cache) > RESPONSE_CACHE_SIZE:
+                cache.popitem(last=False)
+        return response
+
+    def normalize_start(self, startTs : datetime.datetime | None) -> datetime.datetime:
         tzgerman = pytz.timezone("Europe/Berlin")
-
         if startTs is None:
             startTs = datetime.datetime.now(tz=tzgerman)
-            startTs = startTs.replace(minute=0, second=0, microsecond=0)
+            # start of the current price interval
+            minutes = self.interval // 60
+            startTs = startTs.replace(minute=startTs.minute - startTs.minute % minutes, second=0, microsecond=0)
         else:
             if startTs.tzinfo is None:
                 startTs = startTs.astimezone(tzgerman)
-        
-        endTs = datetime.datetime(2999, 1, 1, tzinfo=tzgerman)
-        if hours >= 0:
-            endTs = startTs + datetime.timedelta(hours=hours)
-
-        prediction = self.cachedprices if evaluation is False else self.cachedeval
-
-        prices : list[PriceModel] = []
-        for dt in sorted(prediction.keys()):
-            if dt < startTs:
-                continue
-            if dt > endTs:
-                continue
-            price = prediction[dt]
-            total = (price + fixedPrice) * (1 + taxPercent / 100.0)
-            total = unit.convert(total)
-            dt = dt.astimezone(tzgerman)
-
-            prices.append(PriceModel(startsAt=dt, total=round(total, 4)))
+        return startTs
 
+    def build_prices(self, series : PriceSeries | None, hours : int, fixedPrice : float, taxPercent : float, startTs : datetime.datetime,
+                     unit : PriceUnit, evaluation : bool) -> "PricesModel":
+        startsAt, totals = self.price_rows(series, hours, fixedPrice, taxPercent, startTs, unit, evaluation)
         return PricesModel(
-            prices = prices,
-            knownUntil = self.last_known_price[0].astimezone(tzgerman)
+            prices = [PriceModel(startsAt=datetime.datetime.fromisoformat(dt), total=total) for dt, total in zip(startsAt, totals)],
+            knownUntil = self.known_until(series)
         )
 
-
-    async def update_in_background(self):
+    def encode_prices(self, series : PriceSeries | None, hours : int, fixedPrice : float, taxPercent : float, startTs : datetime.datetime,
+                      unit : PriceUnit, evaluation : bool) -> bytes:
+        """
+        build_prices encoded as JSON, without building a model per price
+        """
+        startsAt, totals = self.price_rows(series, hours, fixedPrice, taxPercent, startTs, unit, evaluation)
+        data = {
+            "prices": [{"startsAt": dt, "total": total} for dt, total in zip(startsAt, totals)],
+            "knownUntil": self.known_until(series).isoformat(),
+        }
+        return json.dumps(data, separators=(",", ":"), allow_nan=False).encode()
+
+    def price_rows(self, series : PriceSeries | None, hours : int, fixedPrice : float, taxPercent : float, startTs : datetime.datetime,
+                   unit : PriceUnit, evaluation : bool) -> Tuple[List[str], List[float]]:
+        """
+        Start times (ISO 8601, German time) and totals in unit of the selected prices
+        """
+        startsAt : List[str] = []
+        totals : List[float] = []
+        selectStart = time.perf_counter()
+        if series is not None:
+            _, values, localTimes = self.select(series, startTs, hours, evaluation)
+            startsAt = localTimes.tolist()
+            totals = unit.totals(values, fixedPrice, taxPercent).tolist()
+        SELECT_SECONDS.observe(time.perf_counter() - selectStart, self.predictor.config.COUNTRY_CODE)
+        return startsAt, totals
+
+    @staticmethod
+    def select(series : PriceSeries, startTs : datetime.datetime, hours : int, evaluation : bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Timestamps, prices (ct/kWh) and local start times (see PriceSeries.local_times) from startTs to startTs + hours (inclusive),
+        or to the end if hours < 0
+        """
+        end = (startTs + datetime.timedelta(hours=hours)).timestamp() if hours >= 0 else None
+        span = series.span(startTs.timestamp(), end)
+        timestamps, values, localTimes = series.timestamps[span], series.values(estimateAll=evaluation)[span], series.local_times("Europe/Berlin")[span]
+        valid = ~np.isnan(values)
+        if not valid.all():
+            timestamps, values, localTimes = timestamps[valid], values[valid], localTimes[valid]
+        return timestamps, values, localTimes
+
+    @staticmethod
+    def known_until(series : PriceSeries | None) -> datetime.datetime:
+        lastKnown = series.last_known_price() if series is not None else None
+        return (lastKnown[0] if lastKnown is not None else datetime.datetime.now()).astimezone(pytz.timezone("Europe/Berlin"))
+
+    def publish(self, series : PriceSeries) -> None:
+        """
+        Makes a new prediction visible to requests. Drops all cached responses of the previous one
+        """
+        if self.trainer and snapshotStore is not None:
+            meta = SnapshotMeta(time.time_ns(), self.last_price_update.timestamp(), self.last_weather_update.timestamp())
+            self.snapshotWrite = asyncio.ensure_future(self.write_snapshot(series, meta, self.snapshotWrite))
+
+        # localized once here instead of per request
+        series.local_times("Europe/Berlin")
+        self.cachedprices = series
+        self.responseCache = OrderedDict()
+        lastKnown = series.last_known_price()
+        if lastKnown is not None:
+            KNOWN_UNTIL.set(lastKnown[0].timestamp(), self.predictor.config.COUNTRY_CODE)
+
+        for queue in self.subscribers:
+            # a slow subscriber only needs the latest series, since it computes its delta against what it has sent
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(series)
+
+    async def write_snapshot(self, series : PriceSeries, meta : SnapshotMeta, previous : asyncio.Future | None) -> None:
+        """
+        Writes series for the serving processes. Serializing and fsync take a while, so this runs in the executor,
+        after the previous write, so snapshots are written in publish order
+        """
+        assert snapshotStore is not None
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, snapshotStore.write, self.predictor.config.COUNTRY_CODE, series, meta)
+            self.snapshotVersion = meta.version
+        except OSError as e:
+            log.warning(f"Failed to write snapshot for {self.predictor.config.COUNTRY_CODE}: {str(e)}")
+
+    async def stream(self, fixedPrice : float = 0.0, taxPercent : float = 0.0, unit : PriceUnit = PriceUnit.CT_PER_KWH,
+                     evaluation : bool = False) -> AsyncGenerator[str, None]:
+        """
+        Server-sent events: a "snapshot" with all prices from the current interval on, then an "update" with the changed intervals and
+        knownUntil whenever a new prediction is published. Comments are sent as heartbeat while idle.
+        Callers await ensure_prices() first: once the stream started, errors can no longer be answered with a status code
+        """
+        country = self.predictor.config.COUNTRY_CODE
+        queue : asyncio.Queue = asyncio.Queue(maxsize=1)
+        self.subscribers.add(queue)
+        STREAM_SUBSCRIBERS.inc(country)
+        try:
+            yield f"retry: {int(STREAM_HEARTBEAT_SECONDS * 1000)}\n\n"
+            series = self.cachedprices
+            sent = None
+            while True:
+                if series is not None:
+                    event, sent = self.stream_event(series, sent, fixedPrice, taxPercent, unit, evaluation)
+                    if event is not None:
+                        yield event
+                try:
+                    series = await asyncio.wait_for(queue.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    series = None
+                    yield ": heartbeat\n\n"
+        finally:
+            self.subscribers.discard(queue)
+            STREAM_SUBSCRIBERS.dec(country)
+
+    def stream_event(self, series : PriceSeries, sent : Tuple[np.ndarray, np.ndarray, datetime.datetime] | None, fixedPrice : float,
+                     taxPercent : float, unit : PriceUnit, evaluation : bool) -> Tuple[str | None, Tuple[np.ndarray, np.ndarray, datetime.datetime]]:
+        """
+        Returns the event for series (None if nothing changed since sent) and the new state (timestamps, totals, knownUntil) of the subscriber
+        """
+        timestamps, values, localTimes = self.select(series, self.normalize_start(None), -1, evaluation)
+        totals = unit.totals(values, fixedPrice, taxPercent)
+        knownUntil = self.known_until(series)
+        state = (timestamps, totals, knownUntil)
+
+        if sent is None:
+            event = "snapshot"
+            changed = np.ones(len(timestamps), dtype=bool)
+        else:
+            event = "update"
+            sentTimestamps, sentTotals, sentKnownUntil = sent
+            changed = np.ones(len(timestamps), dtype=bool)
+            if len(sentTimestamps) > 0:
+                pos = np.minimum(np.searchsorted(sentTimestamps, timestamps), len(sentTimestamps) - 1)
+                changed = (sentTimestamps[pos] != timestamps) | (sentTotals[pos] != totals)
+            if not changed.any() and knownUntil == sentKnownUntil:
+                return None, state
+
+        data = {
+            "prices": [{"startsAt": dt, "total": total} for dt, total in zip(localTimes[changed].tolist(), totals[changed].tolist())],
+            "knownUntil": knownUntil.isoformat(),
+        }
+        return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n", state
+
+    def next_refresh(self) -> datetime.datetime:
+        return min(self.nextPriceRefresh, self.nextWeatherRefresh)
+
+    def reschedule(self, jitter : bool = True) -> None:
+        """
+        Schedules the next refreshes after the last successful ones, e.g. after loading a state or snapshot
+        """
+        lastKnown = self.cachedprices.last_known_price() if self.cachedprices is not None else None
+        self.nextPriceRefresh = self.scheduled(schedule.next_price_refresh(self.last_price_update.astimezone(), lastKnown[0] if lastKnown is not None else None), jitter)
+        self.nextWeatherRefresh = self.scheduled(schedule.next_weather_refresh(self.last_weather_update.astimezone()), jitter)
+
+    @staticmethod
+    def scheduled(ts : datetime.datetime, jitter : bool = True) -> datetime.datetime:
+        return ts + datetime.timedelta(seconds=random.uniform(0, REFRESH_JITTER_SECONDS) if jitter else 0)
+
+    def max_age(self, defaultStart : bool) -> int:
+        """
+        Seconds until responses may change: the next scheduled refresh, or for queries starting at the current interval, the start of the next one
+        """
+        now = datetime.datetime.now()
+        maxAge = (self.next_refresh() - now.astimezone()).total_seconds()
+        if defaultStart:
+            maxAge = min(maxAge, self.interval - (now.minute * 60 + now.second) % self.interval)
+        return max(0, int(maxAge))
+
+
+    def load_snapshot(self) -> bool:
+        """
+        Publishes the trainer's latest snapshot, if it is newer than the current one
+        """
+        assert snapshotStore is not None
+        snapshot = snapshotStore.read(self.predictor.config.COUNTRY_CODE, newerThan=self.snapshotVersion)
+        if snapshot is None:
+            return False
+        series, meta = snapshot
+        self.snapshotVersion = meta.version
+        self.last_price_update = datetime.datetime.fromtimestamp(meta.lastPriceUpdate)
+        self.last_weather_update = datetime.datetime.fromtimestamp(meta.lastWeatherUpdate)
+        self.publish(series)
+        # only used for max_age, which should be the same in all processes
+        self.reschedule(jitter=False)
+        return True
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "predictor": self.predictor.state(),
+            "cachedprices": self.cachedprices,
+            "last_price_update": self.last_price_update,
+            "last_weather_update": self.last_weather_update,
+        }
+
+    def restore(self, state : Dict[str, Any]) -> None:
+        """
+        Continues from a saved state: publishes its prices, and the next update only refreshes data that is stale by then
+        """
+        country = self.predictor.config.COUNTRY_CODE
+        self.predictor.restore(state["predictor"])
+        self.last_price_update = state["last_price_update"]
+        self.last_weather_update = state["last_weather_update"]
+        LAST_PRICE_UPDATE.set(self.last_price_update.timestamp(), country)
+        LAST_WEATHER_UPDATE.set(self.last_weather_update.timestamp(), country)
+        if state["cachedprices"] is not None:
+            self.publish(state["cachedprices"])
+        self.reschedule()
+
+    async def save_state(self) -> None:
+        assert stateStore is not None
+        try:
+            # pickling the frames takes a while, keep it off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, stateStore.save, self.predictor.config.COUNTRY_CODE, self.state())
+        except Exception as e:
+            log.warning(f"Failed to save state for {self.predictor.config.COUNTRY_CODE}: {str(e)}")
+
+    def start_update(self) -> asyncio.Task:
+        """
+        Starts an update, or returns the one already running
+        """
         if self.updateTask is None:
             self.updateTask = asyncio.create_task(self.update_data_if_needed())
-        
-        if len(self.cachedprices) == 0:
-            await self.updateTask # sync refresh on first call
-
-
-    async def update_data_if_needed(self):
+            self.updateTask.add_done_callback(self.update_done)
+        return self.updateTask
+
+    def update_done(self, task : asyncio.Task) -> None:
+        """
+        Logs a failed update. The scheduler does not await its updates, so their exceptions would go unnoticed otherwise
+        """
+        if task.cancelled() or task.exception() is None:
+            return
+        country = self.predictor.config.COUNTRY_CODE
+        UPDATE_FAILURES.inc(country)
+        log.error(f"Update for {country} failed, retrying at {self.next_refresh().isoformat()}", exc_info=task.exception())
+
+    async def ensure_prices(self):
+        """
+        Cold start: waits for the first update if nothing has been published yet.
+        Otherwise requests never trigger or wait for a refresh, that is the RefreshScheduler's job
+        """
+        if not self.trainer:
+            # serving only, the trainer process publishes through the snapshot store. Before its first snapshot, wait for it (bounded)
+            deadline = time.monotonic() + SNAPSHOT_WAIT_SECONDS
+            while self.cachedprices is None and not self.load_snapshot():
+                if time.monotonic() >= deadline:
+                    raise HTTPException(status_code=503, detail="No prediction available yet, the trainer is still preparing it",
+                                        headers={"Retry-After": str(max(1, int(SNAPSHOT_POLL_SECONDS)))})
+                await asyncio.sleep(0.5)
+            return
+
+        if self.cachedprices is None or len(self.cachedprices) == 0:
+            # shielded, so a cancelled request does not cancel the update the other requests wait for
+            await asyncio.shield(self.start_update())
+
+
+    async def update_data_if_needed(self, force : bool = False):
+        country = self.predictor.config.COUNTRY_CODE
+        session = None
+        if self.profileNext:
+            self.profileNext = False
+            session = ProfileSession(country)
+            self.predictor.profile = session
         try:
-            currts = datetime.datetime.now()
-
-            price_age = currts - self.last_price_update
-            weather_age = currts - self.last_weather_update
-
-            self.is_currently_updating = True
-
-            # Update prices every 12 hours. If it's after 13:00 local, and we don't have prices for the next day yet, update every 5 minutes
-            latest_price = self.predictor.get_last_known_price()
-            price_update_frequency = 12 * 60 * 60
-            if latest_price is None or (latest_price[0] - datetime.datetime.now(pytz.UTC)).total_seconds() <= 60 * 60 * 10:
-                price_update_frequency = 5 * 60
-
-            retrain = False
-            if price_age.total_seconds() > price_update_frequency:
-                await self.predictor.refresh_prices()
+            with UPDATES_IN_PROGRESS.track_inprogress(country), UPDATE_SECONDS.time(country):
+                if session is None:
+                    await self._update(country, force)
+                else:
+                    with session.profile_loop(), session.span("update"):
+                        await self._update(country, force)
+        finally:
+            self.updateTask = None
+            if session is not None:
+                self.predictor.profile = None
+                self.lastProfile = await asyncio.get_running_loop().run_in_executor(None, session.save, PROFILE_DIR)
+
+    async def profile_update(self) -> Dict[str, Any] | None:
+        """
+        Runs a full update cycle (fetch, train, predict) under the profiler, and returns its summary
+        """
+        if self.updateTask is not None:
+            await asyncio.wait([self.updateTask])
+        self.profileNext = True
+        self.lastProfile = None
+        await self.force_update()
+        return self.lastProfile
+
+    async def force_update(self) -> None:
+        """
+        Runs a full update cycle (fetch, train, predict) now, regardless of the schedule. Waits for a running update first,
+        since that might have fetched before the call. Concurrent calls share the forced update started after all of them
+        """
+        running = self.updateTask
+        while self.updateTask is not None:
+            task = self.updateTask
+            await asyncio.wait([task])
+            if task is not running and task is self.forcedTask:
+                # a forced update started after this call, join it
+                return
+        self.updateTask = self.forcedTask = asyncio.create_task(self.update_data_if_needed(force=True))
+        self.updateTask.add_done_callback(self.update_done)
+        await asyncio.wait([self.updateTask])
+
+    async def _update(self, country : str, force : bool = False):
+        currts = datetime.datetime.now()
+        now = currts.astimezone()
+
+        # Due refreshes retry soon, unless the update gets as far as publishing. A failed fetch, training or prediction
+        # must not postpone them to the next publication
+        nextPriceRefresh = nextWeatherRefresh = None
+        if force or now >= self.nextPriceRefresh:
+            self.nextPriceRefresh = now + schedule.RETRY
+            if await self.predictor.refresh_prices():
                 self.last_price_update = currts
-                retrain = True
+                LAST_PRICE_UPDATE.set(currts.timestamp(), country)
+                lastKnown = self.predictor.get_last_known_price()
+                nextPriceRefresh = self.scheduled(schedule.next_price_refresh(now, lastKnown[0] if lastKnown is not None else None))
 
-            if weather_age.total_seconds() > 60 * 60 * 6: # update weather every 6 hours
-                await self.predictor.refresh_forecasts()
+        if force or now >= self.nextWeatherRefresh:
+            self.nextWeatherRefresh = now + schedule.RETRY
+            if await self.predictor.refresh_forecasts():
                 self.last_weather_update = currts
-                retrain = True
-
-            if retrain:
-                await self.predictor.train()
-                newprices, neweval = await self.predictor.predict(), await self.predictor.predict(estimateAll=True)
-                self.cachedprices = newprices
-                self.cachedeval = neweval
-                lastknown = self.predictor.get_last_known_price()
-                if lastknown is not None:
-                    self.last_known_price = lastknown
-
-        finally:
-            self.updateTask = None
+                LAST_WEATHER_UPDATE.set(currts.timestamp(), country)
+                nextWeatherRefresh = self.scheduled(schedule.next_weather_refresh(now))
+
+        if nextPriceRefresh is not None or nextWeatherRefresh is not None:
+            # incremental: only rows with new or changed data are processed. The predictor does a full rebuild once a day
+            await self.predictor.train(incremental=True)
+            # training and prediction run in the predictor's executor. The finished result is published with one assignment
+            self.publish(await self.predictor.predict_series())
+            if nextPriceRefresh is not None:
+                self.nextPriceRefresh = nextPriceRefresh
+            if nextWeatherRefresh is not None:
+                self.nextWeatherRefresh = nextWeatherRefresh
+            if stateStore is not None:
+                await self.save_state()
 
 
 class PriceModel(BaseModel):
@@ -171,15 +690,169 @@ class PricesModel(BaseModel):
     prices : list[PriceModel]
     knownUntil: datetime.datetime
 
+class BatchFormat(str, Enum):
+    ROWS = "rows"
+    COLUMNAR = "columnar"
+
+class TariffModel(BaseModel):
+    country : Country = Country.DE
+    fixedPrice : float = 0.0
+    taxPercent : float = 0.0
+    unit : PriceUnit = PriceUnit.CT_PER_KWH
+    startTs : datetime.datetime | None = None
+    hours : int = -1
+    evaluation : bool = False
+
+class BatchRequestModel(BaseModel):
+    tariffs : list[TariffModel]
+    format : BatchFormat = BatchFormat.ROWS
+
+class BatchPricesModel(BaseModel):
+    """
+    format=rows: one entry per tariff, in request order
+    """
+    results : list[PricesModel]
+
+class WindowModel(BaseModel):
+    country : Country
+    evaluation : bool
+    knownUntil : datetime.datetime
+    startsAt : list[datetime.datetime]
+
+class TariffPricesModel(BaseModel):
+    window : int
+    total : list[float]
+
+class ColumnarPricesModel(BaseModel):
+    """
+    format=columnar: tariffs with the same country, start, hours and evaluation share one window of timestamps.
+    results has one entry per tariff in request order, with the index of its window and one total per timestamp
+    """
+    windows : list[WindowModel]
+    results : list[TariffPricesModel]
+
+
 class Prices:
-    countryPrices : Dict[Country, CountryPrices] = {Country.DE: CountryPrices(Country.DE), Country.AT: CountryPrices(Country.AT), Country.SE: CountryPrices(Country.SE)}
+    # initialized countries, see get
+    countryPrices : Dict[Country, CountryPrices]
+    # the weather of all initialized countries is downloaded together. Created with the first country
+    weatherFetcher : "WeatherFetcher | None" = None
 
     def __init__(self):
-        pass
+        self.countryPrices = {}
+
+    def get(self, country : Country) -> CountryPrices:
+        """
+        The prices of an enabled country, initialized on first use
+        """
+        countryPrices = self.countryPrices.get(country)
+        if countryPrices is None:
+            if country not in ENABLED_COUNTRIES:
+                raise HTTPException(status_code=404, detail=f"Country {country.value} is not enabled on this instance")
+            if self.weatherFetcher is None:
+                from predictor.model.weather import WeatherFetcher
+                self.weatherFetcher = WeatherFetcher(httpClient)
+            countryPrices = self.countryPrices[country] = CountryPrices(country, self.weatherFetcher)
+        return countryPrices
+
+    def prewarm(self) -> None:
+        """
+        Initializes the countries in PREWARM_COUNTRIES, so the scheduler updates them without waiting for a request
+        """
+        for country in PREWARM_COUNTRIES:
+            self.get(country)
 
     async def prices(self, hours : int = -1, fixedPrice : float = 0.0, taxPercent : float = 0.0, startTs : datetime.datetime|None = None,
                     country : Country = Country.DE, unit : PriceUnit = PriceUnit.CT_PER_KWH, evaluation : bool = False):
-        return await self.countryPrices[country].prices(hours,fixedPrice, taxPercent, startTs, unit, evaluation)
+        return await self.get(country).prices(hours,fixedPrice, taxPercent, startTs, unit, evaluation)
+
+    async def prices_response(self, hours : int = -1, fixedPrice : float = 0.0, taxPercent : float = 0.0, startTs : datetime.datetime|None = None,
+                    country : Country = Country.DE, unit : PriceUnit = PriceUnit.CT_PER_KWH, evaluation : bool = False, ifNoneMatch : str | None = None) -> Response:
+        countryPrices = self.get(country)
+        cached = await countryPrices.prices_response(hours, fixedPrice, taxPercent, startTs, unit, evaluation)
+        headers = {"ETag": cached.etag, "Cache-Control": f"public, max-age={countryPrices.max_age(startTs is None)}"}
+        if cached.matches(ifNoneMatch):
+            RESPONSE_CACHE.inc(country.value, "not_modified")
+            return Response(status_code=304, headers=headers)
+        return Response(cached.body, media_type="application/json", headers=headers)
+
+    async def restore_state(self) -> None:
+        """
+        Loads the saved state of all countries (see STATE_DIR). The scheduler refreshes the stale ones
+        """
+        if stateStore is None:
+            return
+        loop = asyncio.get_running_loop()
+        for country in ENABLED_COUNTRIES:
+            state = await loop.run_in_executor(None, stateStore.load, country.value)
+            if state is None:
+                continue
+            countryPrices = self.get(country)
+            try:
+                countryPrices.restore(state)
+            except Exception as e:
+                log.warning(f"Failed to restore state for {country.value}: {str(e)}")
+                continue
+            log.info(f"Restored state for {country.value}, prices from {countryPrices.last_price_update.isoformat()}, next refresh {countryPrices.next_refresh().isoformat()}")
+
+    async def batch(self, tariffs : List[TariffModel], format : BatchFormat) -> bytes:
+        """
+        Tariffs are grouped by price window (country, start, hours, evaluation). Each window is selected once,
+        and the totals of all its tariffs are computed as one (tariffs x hours) array operation per unit, see PriceUnit.totals
+        """
+        # rejects disabled countries before any work is done
+        countries = [self.get(country) for country in {t.country for t in tariffs}]
+        for countryPrices in countries:
+            await countryPrices.ensure_prices()
+
+        groups : Dict[Tuple, List[int]] = {}
+        starts : Dict[Tuple, datetime.datetime] = {}
+        for i, t in enumerate(tariffs):
+            start = self.get(t.country).normalize_start(t.startTs)
+            key = (t.country, start.timestamp(), max(t.hours, -1), t.evaluation)
+            groups.setdefault(key, []).append(i)
+            starts[key] = start
+
+        windows : List[Dict[str, Any]] = []
+        totals : List[List[float]] = [[] for _ in tariffs]
+        windowOf : List[int] = [0] * len(tariffs)
+        for key, indices in groups.items():
+            country, _, hours, evaluation = key
+            series = self.get(country).cachedprices
+            _, values, localTimes = CountryPrices.select(series, starts[key], hours, evaluation) if series is not None else (None, np.empty(0), np.empty(0, dtype=str))
+
+            fixedPrice = np.array([tariffs[i].fixedPrice for i in indices])[:, None]
+            taxPercent = np.array([tariffs[i].taxPercent for i in indices])[:, None]
+            units = [tariffs[i].unit for i in indices]
+            matrix = np.empty((len(indices), len(values)))
+            for unit in set(units):
+                rows = np.array([u == unit for u in units])
+                matrix[rows] = unit.totals(values[None, :], fixedPrice[rows], taxPercent[rows])
+
+            for row, i in enumerate(indices):
+                totals[i] = matrix[row].tolist()
+                windowOf[i] = len(windows)
+            windows.append({
+                "country": country.value,
+                "evaluation": evaluation,
+                "knownUntil": CountryPrices.known_until(series).isoformat(),
+                "startsAt": localTimes.tolist(),
+            })
+
+        if format == BatchFormat.COLUMNAR:
+            result : Dict[str, Any] = {
+                "windows": windows,
+                "results": [{"window": w, "total": t} for w, t in zip(windowOf, totals)],
+            }
+        else:
+            result = {"results": [
+                {
+                    "prices": [{"startsAt": ts, "total": total} for ts, total in zip(windows[w]["startsAt"], t)],
+                    "knownUntil": windows[w]["knownUntil"],
+                }
+                for w, t in zip(windowOf, totals)
+            ]}
+        return json.dumps(result, separators=(",", ":"), allow_nan=False).encode()
 
 
 pricesHandler = Prices()
@@ -191,11 +864,135 @@ async def get_prices(
     startTs : datetime.datetime | None = Query(None, description="Start output from this time. At most ~90 days"),
     country : Country = Query(Country.DE, description="Country Code"),
     evaluation : bool = Query(False, description="Switches to evaluation mode. All values will be generated by the model, instead of only future values. Useful to evaluate model performance."),
-    unit : PriceUnit = Query(PriceUnit.CT_PER_KWH, description="Unit of output", )):
+    unit : PriceUnit = Query(PriceUnit.CT_PER_KWH, description="Unit of output", ),
+    if_none_match : str | None = Header(None, include_in_schema=False)):
     """
     Get price prediction
     """
-    return await pricesHandler.prices(hours, fixedPrice, taxPercent, startTs, country, unit, evaluation)
+    return await pricesHandler.prices_response(hours, fixedPrice, taxPercent, startTs, country, unit, evaluation, if_none_match)
 
 
-    
+@app.post("/prices/batch", response_model=BatchPricesModel | ColumnarPricesModel)
+async def get_prices_batch(request : BatchRequestModel):
+    """
+    Get prices for many tariffs (country, fixedPrice, taxPercent, unit, startTs, hours, evaluation) in one call.
+    Parameters have the same meaning and defaults as for /prices
+    """
+    if len(request.tariffs) > MAX_BATCH_TARIFFS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_TARIFFS} tariffs per request")
+    return Response(await pricesHandler.batch(request.tariffs, request.format), media_type="application/json")
+
+
+@app.get("/prices/stream")
+async def stream_prices(
+    fixedPrice : float = Query(0.0, description="Add this fixed amount to all prices (ct/kWh)"),
+    taxPercent : float = Query(0.0, description="Tax % to add to the final price"),
+    country : Country = Query(Country.DE, description="Country Code"),
+    evaluation : bool = Query(False, description="Switches to evaluation mode, see /prices"),
+    unit : PriceUnit = Query(PriceUnit.CT_PER_KWH, description="Unit of output")):
+    """
+    Subscribe to price updates (server-sent events). The first "snapshot" event contains all prices from the current hour
+    (or quarter hour) on, in the format of /prices. Whenever a new prediction is published, an "update" event contains only the intervals whose price changed
+    and the new knownUntil. Idle connections get a heartbeat comment.
+    """
+    countryPrices = pricesHandler.get(country)
+    # before the response starts, so e.g. a follower without a snapshot yet still answers 503
+    await countryPrices.ensure_prices()
+    return StreamingResponse(countryPrices.stream(fixedPrice, taxPercent, unit, evaluation), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/admin/profile", include_in_schema=False)
+async def profile_update(country : Country = Query(Country.DE), x_admin_token : str | None = Header(None)):
+    """
+    Profiles a full update cycle of the given country. The profile is also written to PROFILE_DIR
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404)
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403)
+    if not pricesHandler.get(country).trainer:
+        raise HTTPException(status_code=409, detail="This process only serves snapshots, profile the trainer process instead")
+    return await pricesHandler.get(country).profile_update()
+
+
+@app.post("/admin/refresh", include_in_schema=False)
+async def refresh_now(country : Country = Query(Country.DE), x_admin_token : str | None = Header(None)):
+    """
+    Runs a full update cycle of the given country now, e.g. after upstream corrections or to load-test refreshes
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404)
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403)
+    countryPrices = pricesHandler.get(country)
+    if not countryPrices.trainer:
+        raise HTTPException(status_code=409, detail="This process only serves snapshots, refresh the trainer process instead")
+    start = time.perf_counter()
+    await countryPrices.force_update()
+    return {"seconds": time.perf_counter() - start, "knownUntil": CountryPrices.known_until(countryPrices.cachedprices).isoformat()}
+
+
+class RefreshScheduler:
+    """
+    Refreshes every initialized country when its next refresh is due (see predictor.model.schedule), so refreshes follow
+    the upstream publications instead of traffic. Each country has at most one update running, see CountryPrices.start_update.
+    In snapshot mode, it also runs the trainer election: followers load new snapshots instead of refreshing,
+    and take over as trainer if the lock becomes free.
+    """
+    MAX_SLEEP_SECONDS = 60.0
+
+    prices : Prices
+    task : asyncio.Task | None = None
+
+    def __init__(self, prices : Prices):
+        self.prices = prices
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                sleep = self.tick()
+            except Exception as e:
+                log.warning(f"Scheduled refresh failed: {str(e)}")
+                sleep = self.MAX_SLEEP_SECONDS
+            await asyncio.sleep(sleep)
+
+    def tick(self) -> float:
+        """
+        Starts all due updates. Returns the seconds until the next tick
+        """
+        if leaderLock is not None and not leaderLock.held and leaderLock.try_acquire():
+            log.info(f"Process {os.getpid()} is now the trainer")
+            for countryPrices in self.prices.countryPrices.values():
+                countryPrices.load_snapshot() # serve the previous trainer's result until the first own update
+                countryPrices.trainer = True
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        nextTick = now + datetime.timedelta(seconds=self.MAX_SLEEP_SECONDS)
+        # the trainer keeps all enabled countries up to date, since followers may be asked for any of them
+        countries = ENABLED_COUNTRIES if leaderLock is not None and leaderLock.held else list(self.prices.countryPrices)
+        for country in countries:
+            countryPrices = self.prices.get(country)
+            if snapshotStore is not None and (not countryPrices.trainer or countryPrices.cachedprices is None):
+                countryPrices.load_snapshot()
+            if not countryPrices.trainer:
+                continue
+            if now >= countryPrices.next_refresh():
+                countryPrices.start_update()
+            else:
+                nextTick = min(nextTick, countryPrices.next_refresh())
+
+        sleep = (nextTick - now).total_seconds()
+        if snapshotStore is not None:
+            sleep = min(sleep, SNAPSHOT_POLL_SECONDS)
+        return max(1.0, sleep)
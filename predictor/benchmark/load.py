@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+
+"""
+Load test of the API against the local upstream stand-ins (predictor.benchmark.upstream), without any external traffic.
+Starts the stand-ins and the API (uvicorn) as child processes, waits until every country has its first prediction,
+then keeps --concurrency clients sending /prices queries for --duration seconds while a refresh (fetch, train, predict)
+of one country is forced every --refresh-interval seconds through POST /admin/refresh.
+Reports latency percentiles and throughput, separately for requests while a refresh ran, the refresh durations,
+and the event loop stalls of the API process (epex_event_loop_lag_seconds).
+
+Usage: python -m predictor.benchmark.load [--countries DE AT SE] [--concurrency 32] [--duration 60] [--refresh-interval 15]
+                                          [--latency 0.05] [--jitter 0.05] [--error-rate 0.02] [--quarterhour DE] [--output results.json]
+"""
+
+from typing import Dict, List, Tuple
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import random
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+import numpy as np
+
+UNITS = ["CT_PER_KWH", "EUR_PER_KWH", "EUR_PER_MWH"]
+HOURS = [-1, 24, 48, 168]
+
+
+def lag_histogram(metrics : str) -> Tuple[List[Tuple[float, int]], float]:
+    """
+    Cumulative buckets (upper bound, count) and sum of epex_event_loop_lag_seconds from a /metrics page
+    """
+    buckets = []
+    total = 0.0
+    for line in metrics.splitlines():
+        if line.startswith("epex_event_loop_lag_seconds_bucket"):
+            bound = line.split('le="')[1].split('"')[0]
+            buckets.append((float(bound), int(float(line.rsplit(" ", 1)[1]))))
+        elif line.startswith("epex_event_loop_lag_seconds_sum"):
+            total = float(line.rsplit(" ", 1)[1])
+    return buckets, total
+
+
+def lag_report(before : str, after : str, seconds : float) -> Dict[str, float]:
+    """
+    Event loop stalls during the run: total stalled time, share of the run, and the bucket bound of the 99th percentile and worst stall
+    """
+    (start, startSum), (end, endSum) = lag_histogram(before), lag_histogram(after)
+    counts = [(bound, count - dict(start).get(bound, 0)) for bound, count in end]
+    total = counts[-1][1] if len(counts) > 0 else 0
+    p99 = next((bound for bound, count in counts if count >= 0.99 * total), float("nan")) if total > 0 else float("nan")
+    worst = next((bound for bound, count in counts if count >= total), float("nan")) if total > 0 else float("nan")
+    return {
+        "samples": total,
+        "stalledSeconds": endSum - startSum,
+        "stalledShare": (endSum - startSum) / seconds,
+        "p99AtMostSeconds": p99,
+        "maxAtMostSeconds": worst,
+    }
+
+
+def percentiles(latencies : List[float]) -> Dict[str, float]:
+    if len(latencies) == 0:
+        return {"count": 0}
+    values = np.array(latencies) * 1000
+    return {
+        "count": len(values),
+        "p50Ms": float(np.percentile(values, 50)),
+        "p95Ms": float(np.percentile(values, 95)),
+        "p99Ms": float(np.percentile(values, 99)),
+        "maxMs": float(values.max()),
+    }
+
+
+class LoadTest:
+    api : str
+    adminToken : str
+    countries : List[str]
+    # (start, end) of the forced refreshes, in perf_counter seconds
+    refreshes : List[Tuple[float, float]]
+    # (start, latency, status) of all /prices requests
+    requests : List[Tuple[float, float, int]]
+
+    def __init__(self, api : str, adminToken : str, countries : List[str]):
+        self.api = api
+        self.adminToken = adminToken
+        self.countries = countries
+        self.refreshes = []
+        self.requests = []
+
+    def query(self, rng : random.Random) -> str:
+        """
+        A /prices query like the ones of Home Assistant users: a few tariffs, units and windows, mostly from now on
+        """
+        params = [f"country={rng.choice(self.countries)}", f"unit={rng.choice(UNITS)}", f"hours={rng.choice(HOURS)}",
+                  f"fixedPrice={rng.choice([0, 10.5, 13.15, 17.9])}", f"taxPercent={rng.choice([0, 19, 20])}"]
+        if rng.random() < 0.05:
+            params.append("evaluation=true")
+        return "/prices?" + "&".join(params)
+
+    async def client(self, session : aiohttp.ClientSession, seed : int, until : float) -> None:
+        rng = random.Random(seed)
+        while time.perf_counter() < until:
+            start = time.perf_counter()
+            try:
+                async with session.get(self.api + self.query(rng)) as resp:
+                    await resp.read()
+                    status = resp.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = 0
+            self.requests.append((start, time.perf_counter() - start, status))
+
+    async def refresher(self, session : aiohttp.ClientSession, interval : float, until : float) -> None:
+        i = 0
+        while time.perf_counter() + interval < until:
+            await asyncio.sleep(interval)
+            country = self.countries[i % len(self.countries)]
+            i += 1
+            start = time.perf_counter()
+            async with session.post(f"{self.api}/admin/refresh?country={country}", headers={"X-Admin-Token": self.adminToken}) as resp:
+                body = await resp.text()
+                if resp.status != 200:
+                    print(f"refresh of {country} failed: {resp.status} {body}", file=sys.stderr)
+            self.refreshes.append((start, time.perf_counter()))
+
+    def during_refresh(self, start : float, latency : float) -> bool:
+        return any(s < start + latency and start < e for s, e in self.refreshes)
+
+    async def run(self, concurrency : int, duration : float, refreshInterval : float) -> Dict:
+        connector = aiohttp.TCPConnector(limit=concurrency + 1)
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=600)) as session:
+            for country in self.countries:
+                # the first request of a country waits for its first update
+                async with session.get(f"{self.api}/prices?country={country}") as resp:
+                    resp.raise_for_status()
+            async with session.get(f"{self.api}/metrics") as resp:
+                before = await resp.text()
+
+            start = time.perf_counter()
+            until = start + duration
+            tasks = [self.client(session, i, until) for i in range(concurrency)]
+            if refreshInterval > 0:
+                tasks.append(self.refresher(session, refreshInterval, until))
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - start
+
+            async with session.get(f"{self.api}/metrics") as resp:
+                after = await resp.text()
+
+        ok = [r for r in self.requests if r[2] == 200]
+        busy = [latency for s, latency, _ in ok if self.during_refresh(s, latency)]
+        idle = [latency for s, latency, _ in ok if not self.during_refresh(s, latency)]
+        return {
+            "seconds": elapsed,
+            "requests": len(self.requests),
+            "errors": len(self.requests) - len(ok),
+            "throughput": len(ok) / elapsed,
+            "latency": percentiles([latency for _, latency, _ in ok]),
+            "latencyIdle": percentiles(idle),
+            "latencyDuringRefresh": percentiles(busy),
+            "refreshes": percentiles([e - s for s, e in self.refreshes]),
+            "eventLoop": lag_report(before, after, elapsed),
+        }
+
+
+async def wait_for(url : str, process : subprocess.Popen, timeout : float) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"{process.args} exited with {process.returncode}")
+            with contextlib.suppress(aiohttp.ClientError):
+                async with session.get(url) as resp:
+                    if resp.status < 500:
+                        return
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{url} did not come up within {timeout}s")
+            await asyncio.sleep(0.2)
+
+
+def print_report(result : Dict) -> None:
+    print(f"{result['requests']} requests in {result['seconds']:.1f}s, {result['throughput']:.1f}/s, {result['errors']} errors")
+    print(f"{'':<22} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name in ["latency", "latencyIdle", "latencyDuringRefresh", "refreshes"]:
+        p = result[name]
+        if p["count"] == 0:
+            print(f"{name:<22} {0:>7}")
+            continue
+        print(f"{name:<22} {p['count']:>7} {p['p50Ms']:>8.1f} {p['p95Ms']:>8.1f} {p['p99Ms']:>8.1f} {p['maxMs']:>8.1f}")
+    loop = result["eventLoop"]
+    print(f"event loop stalled {loop['stalledSeconds']:.2f}s ({loop['stalledShare'] * 100:.1f}% of the run), "
+          f"p99 stall <= {loop['p99AtMostSeconds'] * 1000:.0f} ms, worst <= {loop['maxAtMostSeconds'] * 1000:.0f} ms")
+    print(f"upstream requests {result['upstream']['requests']}, injected errors {result['upstream']['errors']}")
+
+
+async def main_async(args : argparse.Namespace) -> Dict:
+    upstreamUrl = f"http://127.0.0.1:{args.upstream_port}"
+    apiUrl = f"http://127.0.0.1:{args.port}"
+    adminToken = secrets.token_hex(16)
+    with tempfile.TemporaryDirectory(prefix="epex-loadtest-") as tmp:
+        env = dict(os.environ,
+                   SMARD_BASE_URL=f"{upstreamUrl}/smard",
+                   OPEN_METEO_BASE_URL=f"{upstreamUrl}/openmeteo/v1/forecast",
+                   ENTSOE_ENDPOINT_URL=f"{upstreamUrl}/entsoe/api",
+                   ENTSOE_API_KEY="loadtest",
+                   SMARD_CACHE_DIR=os.path.join(tmp, "smard_cache"),
+                   ADMIN_TOKEN=adminToken,
+                   ENABLED_COUNTRIES=",".join(args.countries),
+                   QUARTERHOUR_COUNTRIES=",".join(args.quarterhour),
+                   USE_PERSISTENT_TEST_DATA="false")
+        for name in ["HISTORY_DIR", "STATE_DIR", "SNAPSHOT_DIR", "PREWARM_COUNTRIES", "PROFILE_COUNTRIES"]:
+            env.pop(name, None)
+
+        output = open(os.path.join(tmp, "processes.log"), "w")
+        upstream = subprocess.Popen([sys.executable, "-m", "predictor.benchmark.upstream", "--port", str(args.upstream_port),
+                                     "--latency", str(args.latency), "--jitter", str(args.jitter), "--error-rate", str(args.error_rate)],
+                                    stdout=output, stderr=subprocess.STDOUT)
+        api = subprocess.Popen([sys.executable, "-m", "uvicorn", "predictor.api.priceapi:app", "--port", str(args.port), "--log-level", "warning"],
+                               env=env, stdout=output, stderr=subprocess.STDOUT)
+        try:
+            await wait_for(f"{upstreamUrl}/stats", upstream, 30)
+            await wait_for(f"{apiUrl}/metrics", api, 60)
+            result = await LoadTest(apiUrl, adminToken, args.countries).run(args.concurrency, args.duration, args.refresh_interval)
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{upstreamUrl}/stats") as resp:
+                    result["upstream"] = await resp.json()
+        except BaseException:
+            output.flush()
+            with open(output.name) as f:
+                print(f.read()[-5000:], file=sys.stderr)
+            raise
+        finally:
+            for process in (api, upstream):
+                process.terminate()
+                with contextlib.suppress(subprocess.TimeoutExpired):
+                    process.wait(10)
+                if process.poll() is None:
+                    process.kill()
+            output.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of /prices during refreshes, against local upstream stand-ins")
+    parser.add_argument("--countries", nargs="+", default=["DE", "AT", "SE"])
+    parser.add_argument("--quarterhour", nargs="*", default=[], help="countries served in 15 minute intervals")
+    parser.add_argument("--concurrency", type=int, default=32, help="clients sending requests back to back")
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--refresh-interval", type=float, default=15, help="seconds between forced refreshes, 0 for none")
+    parser.add_argument("--latency", type=float, default=0.05, help="upstream response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="additional random upstream delay up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="share of upstream requests answered with 503")
+    parser.add_argument("--port", type=int, default=8901, help="port of the API under test")
+    parser.add_argument("--upstream-port", type=int, default=8900)
+    parser.add_argument("--output", help="write results as json to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args))
+    result.update(created=datetime.datetime.now(datetime.timezone.utc).isoformat(), config=vars(args))
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
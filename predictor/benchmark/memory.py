@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+"""
+Memory benchmark of the training pipeline on synthetic data. For each country, learn window and resolution it records
+- peakMB: peak traced memory (tracemalloc) of a full update: prepare, train and predict_series
+- retainedMB: memory still held after the update, i.e. the fetched data and the trained model
+- the size of each part of the trained model
+
+Usage: python -m predictor.benchmark.memory [--days 30 365 730] [--resolutions hour quarterhour] [--countries DE AT SE] [--output results.json]
+"""
+
+from typing import Any, Dict, List
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import logging
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from predictor.benchmark import synthetic
+from predictor.model.pricepredictor import Country, PricePredictor
+
+
+def size_of(value : Any) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, "__dict__"):
+        # neighbor backends: sum of their arrays
+        return sum(size_of(v) for v in vars(value).values())
+    return 0
+
+
+async def run(country : Country, days : int, resolution : str) -> Dict:
+    weather, prices = synthetic.frames(country, days, resolution)
+    predictor = PricePredictor(country, learnDays=days, resolution=resolution)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        predictor.weather, predictor.prices = weather.copy(), prices.copy()
+        await predictor.train()
+        await predictor.predict_series()
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    await predictor.http.close()
+
+    model = predictor.model
+    assert model is not None
+    parts = {name: size_of(value) / 2 ** 20 for name, value in vars(model).items() if size_of(value) > 0}
+    return {
+        "country": country.value, "days": days, "resolution": resolution, "rows": len(model.unscaled),
+        "peakMB": (peak - before) / 2 ** 20, "retainedMB": (retained - before) / 2 ** 20, "modelMB": parts,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Training pipeline memory benchmark on synthetic data")
+    parser.add_argument("--days", type=int, nargs="+", default=[30, 365, 730])
+    parser.add_argument("--resolutions", nargs="+", choices=list(synthetic.RESOLUTIONS.keys()), default=list(synthetic.RESOLUTIONS.keys()))
+    parser.add_argument("--countries", nargs="+", choices=[c.value for c in Country], default=[c.value for c in Country])
+    parser.add_argument("--output", help="write results as json to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    # one-time allocations (module imports, caches) should not count for the first configuration
+    await run(Country(args.countries[0]), 7, "hour")
+    results : List[Dict] = []
+    print(f"{'country':<7} {'resolution':<12} {'days':>5} {'rows':>7} {'peak MB':>9} {'retained MB':>12}  largest parts of the model (MB)")
+    for country in args.countries:
+        for resolution in args.resolutions:
+            for days in args.days:
+                r = await run(Country(country), days, resolution)
+                results.append(r)
+                largest = sorted(r["modelMB"].items(), key=lambda p: -p[1])[:4]
+                print(f"{r['country']:<7} {r['resolution']:<12} {r['days']:>5} {r['rows']:>7} {r['peakMB']:>9.1f} {r['retainedMB']:>12.1f}  "
+                      + ", ".join(f"{name} {mb:.1f}" for name, mb in largest))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created": datetime.datetime.now(datetime.timezone.utc).isoformat(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+"""
+Benchmarks fit and query latency of the nearest neighbour backends on synthetic feature matrices
+shaped like the ones PricePredictor trains on (31 scaled one-hot calendar columns + weathersum).
+Also checks that every backend returns the same predictions as the sklearn default (up to rows at the same distance).
+
+Usage: python -m predictor.benchmark.neighbors [--days 30 90 365 730] [--resolutions hour quarterhour] [--backends ...] [--output results.json]
+"""
+
+from typing import Dict, List, Tuple
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+
+from predictor.model.calendarfeatures import CalendarFeatures
+from predictor.model.neighbors import NEIGHBOR_BACKENDS, create_backend
+
+RESOLUTIONS = {"hour": "h", "quarterhour": "15min"}
+FORECAST_DAYS = 7
+K = 3
+
+
+def feature_matrix(days : int, resolution : str, seed : int = 42) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the feature matrix for all rows, the mask of rows with known prices and the known prices
+    """
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp("2025-03-01", tz="UTC")
+    times = pd.date_range(end - pd.Timedelta(days=days), end + pd.Timedelta(days=FORECAST_DAYS), freq=RESOLUTIONS[resolution], inclusive="left", name="time")
+    calendar = CalendarFeatures("DE").features(times).to_numpy(dtype=np.float64)
+    calendar = calendar * rng.normal(0, 3, calendar.shape[1]) # linreg scaling of the calendar columns
+    weathersum = np.cumsum(rng.normal(0, 0.5, len(times))) + rng.normal(0, 2, len(times))
+    X = np.column_stack([calendar, weathersum])
+    known = np.asarray(times < end)
+    prices = 10 + rng.normal(0, 3, known.sum())
+    return X, known, prices
+
+
+def run(days : int, resolution : str, backends : List[str], repeat : int) -> List[Dict]:
+    X, known, prices = feature_matrix(days, resolution)
+    results = []
+    reference = None
+    for name in backends:
+        fitTimes, queryTimes = [], []
+        neighbors = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            backend = create_backend(name).fit(X[known])
+            fitTimes.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            _, neighbors = backend.kneighbors(X, K)
+            queryTimes.append(time.perf_counter() - start)
+        assert neighbors is not None, "repeat must be at least 1"
+        prediction = np.mean(prices[neighbors], axis=1)
+        if reference is None:
+            reference = prediction
+        results.append({
+            "backend": name,
+            "days": days,
+            "resolution": resolution,
+            "trainRows": int(known.sum()),
+            "queryRows": len(X),
+            "fitSeconds": min(fitTimes),
+            "querySeconds": min(queryTimes),
+            "maxDiffToFirst": float(np.abs(prediction - reference).max()),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nearest neighbour backend benchmark")
+    parser.add_argument("--days", type=int, nargs="+", default=[30, 90, 365, 730])
+    parser.add_argument("--resolutions", nargs="+", choices=list(RESOLUTIONS.keys()), default=list(RESOLUTIONS.keys()))
+    parser.add_argument("--backends", nargs="+", choices=list(NEIGHBOR_BACKENDS.keys()), default=list(NEIGHBOR_BACKENDS.keys()))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write results as json to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'backend':<10} {'days':>5} {'resolution':<12} {'rows':>7} {'fit ms':>9} {'query ms':>10} {'max diff':>9}")
+    for resolution in args.resolutions:
+        for days in args.days:
+            for r in run(days, resolution, args.backends, args.repeat):
+                results.append(r)
+                print(f"{r['backend']:<10} {r['days']:>5} {r['resolution']:<12} {r['trainRows']:>7} {r['fitSeconds'] * 1000:>9.1f} {r['querySeconds'] * 1000:>10.1f} {r['maxDiffToFirst']:>9.2g}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+
+"""
+Benchmarks the stages of the prediction pipeline on synthetic data: preparation, training, prediction,
+result conversion and the API price query. Records the best wall-clock time of several runs and the
+peak memory (tracemalloc) of one extra run per stage.
+train_update is the incremental retrain after a weather refresh that changed the forecast.
+With both resolutions, also prints how much slower each stage is at quarter hours (4x the rows).
+
+Usage: python -m predictor.benchmark.pipeline [--days 30 90 365 730] [--resolutions hour quarterhour] [--countries DE AT SE] [--output results.json]
+       python -m predictor.benchmark.pipeline --compare old.json new.json
+"""
+
+from typing import Any, Awaitable, Callable, Dict, List
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import time
+import tracemalloc
+import pandas as pd
+
+from predictor.benchmark import synthetic
+from predictor.model.countries import RESOLUTIONS
+from predictor.model.pricepredictor import Country, PricePredictor
+
+
+async def measure(stage : Callable[[], Awaitable], repeat : int) -> Dict[str, Any]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await stage()
+        times.append(time.perf_counter() - start)
+
+    # separate run, since tracing slows down allocations. Also traces the executor threads
+    tracemalloc.start()
+    try:
+        await stage()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(times), "peakMB": peak / 2 ** 20}
+
+
+async def run(country : Country, days : int, resolution : str, repeat : int, backend : str) -> List[Dict]:
+    from predictor.api.priceapi import CountryPrices, PriceUnit
+
+    weather, prices = synthetic.frames(country, days, resolution)
+    predictor = PricePredictor(country, learnDays=days, neighborBackend=backend, resolution=resolution)
+    predictor.weather, predictor.prices = weather, prices
+
+    data = await predictor.prepare_dataframe()
+    assert data is not None
+    await predictor.train(data=data)
+    series = await predictor.predict_series()
+    trained = predictor.model
+
+    # a weather refresh: the forecast after the last known price changed
+    updated = data.copy()
+    forecast = updated["price"].isna()
+    for column in predictor._weather_columns():
+        updated.loc[forecast, column] += 0.5
+
+    countryPrices = CountryPrices(country)
+    countryPrices.predictor = predictor
+    countryPrices.interval = RESOLUTIONS[resolution]
+    countryPrices.cachedprices = series
+    start = pd.Timestamp(weather.index[0]).to_pydatetime()
+    lastKnown = pd.Timestamp(prices.index[-1]).to_pydatetime()
+
+    async def encode_48h() -> bytes:
+        # the uncached /prices response path
+        return countryPrices.encode_prices(series, 48, 0.0, 0.0, lastKnown, PriceUnit.CT_PER_KWH, False)
+
+    stages : Dict[str, Callable[[], Awaitable]] = {
+        "prepare": predictor.prepare_dataframe,
+        "train": lambda: predictor.train(data=data),
+        "train_incremental": lambda: predictor.train(data=data, incremental=True),
+        "train_update": lambda: predictor._run(predictor.build_model, updated, None, True, trained),
+        "predict_raw": predictor.predict_raw,
+        "predict_series": predictor.predict_series,
+        "to_dict": predictor.predict,
+        "api_prices_all": lambda: countryPrices.prices(startTs=start),
+        "api_prices_48h": lambda: countryPrices.prices(hours=48, startTs=lastKnown),
+        "api_encode_48h": encode_48h,
+    }
+
+    results = []
+    for stage, func in stages.items():
+        r = await measure(func, repeat)
+        r.update(country=country.value, days=days, resolution=resolution, rows=len(data), stage=stage)
+        results.append(r)
+    await predictor.http.close()
+    return results
+
+
+def key(r : Dict) -> str:
+    return f"{r['country']} {r['resolution']} {r['days']} {r['stage']}"
+
+def resolution_scaling(results : List[Dict]) -> None:
+    byKey = {key(r): r for r in results}
+    rows = [(r, byKey.get(key(dict(r, resolution="hour")))) for r in results if r["resolution"] == "quarterhour"]
+    rows = [(q, h) for q, h in rows if h is not None]
+    if len(rows) == 0:
+        return
+    print(f"\n{'country':<7} {'days':>5} {'stage':<18} {'hour ms':>10} {'15min ms':>10} {'ratio':>6}")
+    for q, h in rows:
+        print(f"{q['country']:<7} {q['days']:>5} {q['stage']:<18} {h['seconds'] * 1000:>10.1f} {q['seconds'] * 1000:>10.1f} {q['seconds'] / max(h['seconds'], 1e-9):>6.2f}")
+
+def compare(oldFn : str, newFn : str) -> None:
+    with open(oldFn) as f:
+        old = {key(r): r for r in json.load(f)["results"]}
+    with open(newFn) as f:
+        new = {key(r): r for r in json.load(f)["results"]}
+
+    print(f"{'country':<7} {'resolution':<12} {'days':>5} {'stage':<18} {'old ms':>10} {'new ms':>10} {'ratio':>6} {'old MB':>8} {'new MB':>8}")
+    for k, n in new.items():
+        if k not in old:
+            continue
+        o = old[k]
+        print(f"{n['country']:<7} {n['resolution']:<12} {n['days']:>5} {n['stage']:<18} {o['seconds'] * 1000:>10.1f} {n['seconds'] * 1000:>10.1f} "
+              f"{n['seconds'] / max(o['seconds'], 1e-9):>6.2f} {o['peakMB']:>8.1f} {n['peakMB']:>8.1f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Prediction pipeline benchmark on synthetic data")
+    parser.add_argument("--days", type=int, nargs="+", default=[30, 90, 365, 730])
+    parser.add_argument("--resolutions", nargs="+", choices=list(synthetic.RESOLUTIONS.keys()), default=list(synthetic.RESOLUTIONS.keys()))
+    parser.add_argument("--countries", nargs="+", choices=[c.value for c in Country], default=[c.value for c in Country])
+    parser.add_argument("--backend", default="bucketed")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write results as json to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    results = []
+    print(f"{'country':<7} {'resolution':<12} {'days':>5} {'rows':>7} {'stage':<18} {'ms':>10} {'peak MB':>8}")
+    for country in args.countries:
+        for resolution in args.resolutions:
+            for days in args.days:
+                for r in await run(Country(country), days, resolution, args.repeat, args.backend):
+                    results.append(r)
+                    print(f"{r['country']:<7} {r['resolution']:<12} {r['days']:>5} {r['rows']:>7} {r['stage']:<18} {r['seconds'] * 1000:>10.1f} {r['peakMB']:>8.1f}")
+    resolution_scaling(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created": datetime.datetime.now(datetime.timezone.utc).isoformat(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+
+"""
+Benchmarks the startup path of the API, each run in a fresh interpreter:
+- import: importing predictor.api.priceapi, and which heavy modules it loaded
+- country_init: initializing the first country (imports the model)
+- first_request: first /prices query of that country, including its first update with synthetic data instead of downloads
+- second_request: the same query again
+With --importtime, also lists the slowest imports of predictor.api.priceapi (python -X importtime).
+
+Usage: python -m predictor.benchmark.startup [--country DE] [--days 30] [--repeat 5] [--importtime] [--output results.json]
+"""
+
+from typing import Dict, List
+import argparse
+import datetime
+import json
+import subprocess
+import sys
+
+HEAVY_MODULES = ["pandas", "sklearn", "scipy", "entsoe", "holidays", "requests"]
+
+# runs in the child interpreter, prints one json line
+CHILD = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import predictor.api.priceapi as api
+imported = time.perf_counter()
+loaded = [m for m in {heavy!r} if m in sys.modules]
+
+from predictor.model.countries import Country
+
+async def main():
+    t0 = time.perf_counter()
+    countryPrices = api.pricesHandler.get(Country({country!r}))
+    t1 = time.perf_counter()
+    from predictor.benchmark import synthetic
+    weather, prices = synthetic.frames(Country({country!r}), {days})
+    async def fetch_weather(): return weather
+    async def fetch_prices(): return prices
+    countryPrices.predictor.fetch_weather, countryPrices.predictor.fetch_prices = fetch_weather, fetch_prices
+    startTs = weather.index[0].to_pydatetime() # synthetic data ends in the past
+    t2 = time.perf_counter()
+    first = await countryPrices.prices_response(startTs=startTs)
+    t3 = time.perf_counter()
+    assert len(json.loads(first.body)["prices"]) > 0
+    await countryPrices.prices_response(startTs=startTs)
+    t4 = time.perf_counter()
+    await api.httpClient.close()
+    return {{"import": imported - start, "country_init": t1 - t0, "first_request": t3 - t2, "second_request": t4 - t3}}
+
+times = asyncio.run(main())
+print(json.dumps({{"seconds": times, "loadedOnImport": loaded}}))
+"""
+
+
+def run_once(country : str, days : int) -> Dict:
+    code = CHILD.format(heavy=HEAVY_MODULES, country=country, days=days)
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Benchmark run failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def import_times(top : int) -> List[Dict]:
+    """
+    Slowest modules (cumulative microseconds) imported by predictor.api.priceapi
+    """
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import predictor.api.priceapi"], capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.removeprefix("import time:").split("|")
+        rows.append({"module": module.strip(), "cumulativeMs": int(cumulative) / 1000})
+    return sorted(rows, key=lambda r: -r["cumulativeMs"])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API import and first request benchmark")
+    parser.add_argument("--country", default="DE")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true", help="also list the slowest imports")
+    parser.add_argument("--output", help="write results as json to this file")
+    args = parser.parse_args()
+
+    runs = [run_once(args.country, args.days) for _ in range(args.repeat)]
+    stages = list(runs[0]["seconds"].keys())
+    result = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "country": args.country,
+        "days": args.days,
+        "loadedOnImport": runs[0]["loadedOnImport"],
+        "seconds": {s: min(r["seconds"][s] for r in runs) for s in stages},
+    }
+
+    print(f"{'stage':<16} {'best ms':>10} {'worst ms':>10}")
+    for s in stages:
+        times = [r["seconds"][s] for r in runs]
+        print(f"{s:<16} {min(times) * 1000:>10.1f} {max(times) * 1000:>10.1f}")
+    print(f"heavy modules loaded by the import: {', '.join(result['loadedOnImport']) or 'none'}")
+
+    if args.importtime:
+        result["imports"] = import_times(15)
+        print(f"\n{'module':<50} {'cumulative ms':>14}")
+        for r in result["imports"]:
+            print(f"{r['module']:<50} {r['cumulativeMs']:>14.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
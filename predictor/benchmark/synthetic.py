@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+"""
+Deterministic synthetic weather and price frames in the layout PricePredictor.fetch_weather and fetch_prices produce,
+so benchmarks run without network access.
+Weather has one wind_i, temp_i and irradiance_i column per location of the country config. Prices (ct/kWh) follow
+a daily shape and drop with wind and solar, so the model has something to learn.
+"""
+
+from typing import Tuple, cast
+import numpy as np
+import pandas as pd
+
+from predictor.model.pricepredictor import COUNTRY_CONFIG, Country
+
+RESOLUTIONS = {"hour": "h", "quarterhour": "15min"}
+END = pd.Timestamp("2025-03-01", tz="UTC")
+
+
+def time_index(days : int, resolution : str = "hour", forecastDays : int = 7, end : pd.Timestamp = END) -> pd.DatetimeIndex:
+    return pd.date_range(end - pd.Timedelta(days=days), end + pd.Timedelta(days=forecastDays), freq=RESOLUTIONS[resolution],
+                         inclusive="left", name="time").as_unit("us")
+
+
+def weather_frame(country : Country, days : int, resolution : str = "hour", forecastDays : int = 7, seed : int = 42, end : pd.Timestamp = END) -> pd.DataFrame:
+    """
+    learnDays of history plus forecastDays of forecast, ending at end
+    """
+    rng = np.random.default_rng([seed, list(Country).index(country)])
+    times = time_index(days, resolution, forecastDays, end)
+    hourOfDay = (times.hour + times.minute / 60).to_numpy()
+    dayOfYear = times.dayofyear.to_numpy()
+    daylight = np.clip(np.sin((hourOfDay - 6) / 12 * np.pi), 0, None)
+    stepsPerHour = len(times) / ((days + forecastDays) * 24)
+
+    columns = {}
+    for i in range(len(COUNTRY_CONFIG[country].LATITUDES)):
+        # wind: slowly varying random walk around a mean, clipped to physical values
+        wind = 15 + np.cumsum(rng.normal(0, 0.8 / np.sqrt(stepsPerHour), len(times)))
+        wind = np.clip(wind - np.linspace(0, wind[-1] - 15, len(times)), 0, 80)
+        season = -np.cos((dayOfYear + 10) / 365 * 2 * np.pi)
+        columns[f"wind_{i}"] = np.round(wind, 1)
+        columns[f"temp_{i}"] = np.round(10 + 10 * season + 4 * daylight + rng.normal(0, 1.5, len(times)), 1)
+        cloud = np.clip(rng.normal(0.6, 0.3, len(times)), 0, 1)
+        columns[f"irradiance_{i}"] = np.round(daylight * (400 + 300 * season) * cloud, 1)
+
+    return pd.DataFrame(columns, index=times)
+
+
+def price_frame(weather : pd.DataFrame, seed : int = 42, end : pd.Timestamp = END) -> pd.DataFrame:
+    """
+    Known prices for all weather rows before end
+    """
+    rng = np.random.default_rng(seed)
+    known = weather[weather.index < end]
+    times = pd.DatetimeIndex(known.index)
+    hourOfDay = (times.hour + times.minute / 60).to_numpy()
+    wind = known.filter(like="wind_").mean(axis=1).to_numpy()
+    irradiance = known.filter(like="irradiance_").mean(axis=1).to_numpy()
+    daily = 3 * np.exp(-((hourOfDay - 8) ** 2) / 4) + 4 * np.exp(-((hourOfDay - 19) ** 2) / 6)
+    weekend = np.where(times.dayofweek.to_numpy() >= 5, -2.0, 0.0)
+    price = 12 + daily + weekend - 0.25 * wind - 0.015 * irradiance + rng.normal(0, 1.5, len(known))
+    return pd.DataFrame({"price": np.round(price, 3)}, index=known.index)
+
+
+def frames(country : Country, days : int, resolution : str = "hour", forecastDays : int = 7, seed : int = 42) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Prices in the given resolution. Weather is hourly like Open-Meteo's, the predictor interpolates it to finer resolutions
+    """
+    weather = weather_frame(country, days, resolution, forecastDays, seed)
+    prices = price_frame(weather, seed)
+    return weather[cast(pd.DatetimeIndex, weather.index).minute == 0], prices
@@ -0,0 +1,292 @@
+#!/usr/bin/python3
+
+"""
+Local stand-ins for the upstream services, so the API can be load-tested without sending traffic to them:
+- SMARD: /smard/{filter}/{region}/index_{resolution}.json and the weekly chunk files it lists
+- Open-Meteo: /openmeteo/v1/forecast, for one or many locations per request
+- ENTSO-E: /entsoe/api, day-ahead price documents (XML) as the transparency platform returns them
+Data is deterministic and generated on request relative to the current time. Prices are known until the end of today,
+or of tomorrow after the auction publication, and follow a daily shape that drops with the stand-in's wind and sun.
+Every response can be delayed (latency + random 0..jitter seconds) and replaced by a 503 with probability errorRate.
+
+Point the API at it with
+    SMARD_BASE_URL=http://127.0.0.1:8900/smard
+    OPEN_METEO_BASE_URL=http://127.0.0.1:8900/openmeteo/v1/forecast
+    ENTSOE_ENDPOINT_URL=http://127.0.0.1:8900/entsoe/api ENTSOE_API_KEY=anything
+
+Usage: python -m predictor.benchmark.upstream [--port 8900] [--latency 0.05] [--jitter 0.05] [--error-rate 0.02]
+"""
+
+from typing import Dict, List
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import logging
+import random
+import zlib
+import numpy as np
+import pandas as pd
+from aiohttp import web
+
+from predictor.model import schedule
+
+log = logging.getLogger(__name__)
+
+# the SDAC auction switched from hourly to 15 minute products
+QUARTERHOUR_GOLIVE = pd.Timestamp("2025-10-01", tz="Europe/Amsterdam")
+STEPS = {"hour": 3600, "quarterhour": 900}
+
+
+def wind_level(seconds : np.ndarray) -> np.ndarray:
+    """
+    Large-scale wind (km/h) shared by all locations: fronts passing every few days, plus a daily cycle
+    """
+    hours = seconds / 3600
+    return np.clip(18 + 9 * np.sin(hours / 79 * 2 * np.pi) + 5 * np.sin(hours / 31 * 2 * np.pi + 1) + 2 * np.sin(hours / 24 * 2 * np.pi), 0, None)
+
+
+def daylight(seconds : np.ndarray) -> np.ndarray:
+    hourOfDay = (seconds % 86400) / 3600
+    return np.clip(np.sin((hourOfDay - 5) / 14 * np.pi), 0, None)
+
+
+def season(seconds : np.ndarray) -> np.ndarray:
+    # -1 in winter, 1 in summer
+    return -np.cos((seconds / 86400 % 365.25 + 10) / 365.25 * 2 * np.pi)
+
+
+def noise(seconds : np.ndarray, key : str) -> np.ndarray:
+    """
+    Uniform -1..1 per timestamp and key, the same in every response
+    """
+    x = np.sin(seconds / 900 * 12.9898 + zlib.crc32(key.encode()) % 10000) * 43758.5453
+    return (x - np.floor(x)) * 2 - 1
+
+
+def prices(region : str, seconds : np.ndarray) -> np.ndarray:
+    """
+    Day-ahead prices in EUR/MWh
+    """
+    local = seconds + 3600
+    hourOfDay = (local % 86400) / 3600
+    weekday = (local // 86400 + 3) % 7  # 1970-01-01 was a Thursday
+    daily = 30 * np.exp(-((hourOfDay - 8) ** 2) / 4) + 40 * np.exp(-((hourOfDay - 19) ** 2) / 6)
+    price = 110 + daily - np.where(weekday >= 5, 20, 0) - 2.5 * wind_level(seconds) - 80 * daylight(seconds) * (0.6 + 0.4 * season(seconds)) + 12 * noise(seconds, region)
+    return np.round(price, 2)
+
+
+class Upstream:
+    """
+    The stand-in server. Counts requests and injected errors per service, see /stats
+    """
+    latency : float
+    jitter : float
+    errorRate : float
+    historyDays : int
+    # requests and injected errors per service
+    requests : Dict[str, int]
+    errors : Dict[str, int]
+
+    def __init__(self, latency : float = 0.0, jitter : float = 0.0, errorRate : float = 0.0, historyDays : int = 400):
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.historyDays = historyDays
+        self.requests = {}
+        self.errors = {}
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.inject])
+        app.router.add_get("/smard/{filter}/{region}/{name}.json", self.smard)
+        app.router.add_get("/openmeteo/v1/forecast", self.open_meteo)
+        app.router.add_get("/entsoe/api", self.entsoe)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+    @web.middleware
+    async def inject(self, request : web.Request, handler) -> web.StreamResponse:
+        service = request.path.split("/")[1]
+        if service == "stats":
+            return await handler(request)
+        self.requests[service] = self.requests.get(service, 0) + 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if random.random() < self.errorRate:
+            self.errors[service] = self.errors.get(service, 0) + 1
+            raise web.HTTPServiceUnavailable(text="injected error")
+        return await handler(request)
+
+    async def stats(self, request : web.Request) -> web.Response:
+        return web.json_response({"requests": self.requests, "errors": self.errors})
+
+    @staticmethod
+    def known_until(now : datetime.datetime) -> int:
+        """
+        End (exclusive, unix seconds) of the published prices: tomorrow's are published at PRICE_PUBLICATION
+        """
+        local = now.astimezone(schedule.PUBLICATION_TZ)
+        days = 2 if local.time() >= schedule.PRICE_PUBLICATION else 1
+        end = schedule.PUBLICATION_TZ.localize(datetime.datetime.combine(local.date() + datetime.timedelta(days=days), datetime.time()))
+        return int(end.timestamp())
+
+    def weeks(self, now : datetime.datetime) -> List[int]:
+        """
+        Starts of the weekly SMARD chunks (Monday 00:00 German time) in unix ms, up to the current week
+        """
+        end = pd.Timestamp(now).tz_convert(schedule.PUBLICATION_TZ.zone) + pd.Timedelta(days=1)
+        starts = pd.date_range(end - pd.Timedelta(days=self.historyDays + 7), end, freq="W-MON", normalize=True)
+        return [int(ts.timestamp()) * 1000 for ts in starts]
+
+    async def smard(self, request : web.Request) -> web.Response:
+        filter, region, name = request.match_info["filter"], request.match_info["region"], request.match_info["name"]
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if name.startswith("index_"):
+            resolution = name.removeprefix("index_")
+            if resolution not in STEPS:
+                raise web.HTTPNotFound()
+            return web.json_response({"timestamps": self.weeks(now)})
+
+        try:
+            chunkFilter, chunkRegion, resolution, week = name.split("_")
+            start = int(week) // 1000
+        except ValueError:
+            raise web.HTTPNotFound()
+        if (chunkFilter, chunkRegion) != (filter, region) or resolution not in STEPS:
+            raise web.HTTPNotFound()
+        # a week is an hour longer or shorter if the clocks change in it
+        end = int((pd.Timestamp(start, unit="s", tz="UTC").tz_convert(schedule.PUBLICATION_TZ.zone) + pd.DateOffset(weeks=1)).timestamp())
+        seconds = np.arange(start, end, STEPS[resolution], dtype=np.int64)
+        values : List = prices(region, seconds).tolist()
+        knownUntil = self.known_until(now)
+        series = [[ts * 1000, value if ts < knownUntil else None] for ts, value in zip(seconds.tolist(), values)]
+        return web.Response(text=json.dumps({"meta_data": {"version": 1, "created": int(now.timestamp() * 1000)}, "series": series}),
+                            content_type="application/json")
+
+    async def open_meteo(self, request : web.Request) -> web.Response:
+        try:
+            latitudes = [float(v) for v in request.query["latitude"].split(",")]
+            longitudes = [float(v) for v in request.query["longitude"].split(",")]
+            pastDays = int(request.query.get("past_days", "0"))
+            forecastDays = int(request.query.get("forecast_days", "7"))
+            variables = request.query["hourly"].split(",")
+        except (KeyError, ValueError):
+            raise web.HTTPBadRequest(text="invalid parameters")
+        if len(latitudes) != len(longitudes):
+            raise web.HTTPBadRequest(text="latitude and longitude must have the same length")
+
+        today = int(datetime.datetime.now(datetime.timezone.utc).timestamp()) // 86400 * 86400
+        seconds = np.arange(today - pastDays * 86400, today + forecastDays * 86400, 3600, dtype=np.int64)
+        times = np.datetime_as_string(seconds.astype("datetime64[s]"), unit="m").tolist()
+        wind, sun, warm = wind_level(seconds), daylight(seconds), season(seconds)
+        forecasts = []
+        for lat, lon in zip(latitudes, longitudes):
+            local = self.location(lat, lon, seconds, wind, sun, warm)
+            hourly : Dict[str, List] = {"time": times}
+            for variable in variables:
+                if variable not in local:
+                    raise web.HTTPBadRequest(text=f"unknown variable {variable}")
+                hourly[variable] = local[variable]
+            forecasts.append({"latitude": lat, "longitude": lon, "utc_offset_seconds": 0, "timezone": "GMT", "hourly": hourly})
+        # like Open-Meteo: a list for several locations, a single object for one
+        body = json.dumps(forecasts if len(forecasts) > 1 else forecasts[0])
+        return web.Response(text=body, content_type="application/json")
+
+    @staticmethod
+    def location(lat : float, lon : float, seconds : np.ndarray, wind : np.ndarray, sun : np.ndarray, warm : np.ndarray) -> Dict[str, List]:
+        """
+        Weather at one location: the shared levels with a local offset and noise, 1 decimal like Open-Meteo
+        """
+        key = f"{lat},{lon}"
+        cloud = np.clip(0.6 + 0.4 * noise(seconds, key + "cloud"), 0, 1)
+        return {
+            "wind_speed_80m": np.round(np.clip(wind * (0.8 + (lat % 1) * 0.4) + 3 * noise(seconds, key + "wind"), 0, None), 1).tolist(),
+            "temperature_2m": np.round(8 + 10 * warm + 5 * sun - (lat - 50) + 2 * noise(seconds, key + "temp"), 1).tolist(),
+            "global_tilted_irradiance": np.round(sun * (450 + 300 * warm) * cloud, 1).tolist(),
+        }
+
+    async def entsoe(self, request : web.Request) -> web.Response:
+        try:
+            domain = request.query["in_Domain"]
+            start = pd.Timestamp(datetime.datetime.strptime(request.query["periodStart"], "%Y%m%d%H%M"), tz="UTC")
+            end = pd.Timestamp(datetime.datetime.strptime(request.query["periodEnd"], "%Y%m%d%H%M"), tz="UTC")
+            offset = int(request.query.get("offset", "0"))
+        except (KeyError, ValueError):
+            raise web.HTTPBadRequest(text="invalid parameters")
+
+        knownUntil = pd.Timestamp(self.known_until(datetime.datetime.now(datetime.timezone.utc)), unit="s", tz="UTC")
+        # one document per delivery day (00:00 to 00:00 CET), all of them fit into the first page
+        days = pd.date_range(start.tz_convert("Europe/Amsterdam").normalize(), min(end, knownUntil).tz_convert("Europe/Amsterdam"),
+                             freq="D", inclusive="left")
+        if offset > 0 or len(days) == 0:
+            return self.xml(self.acknowledgement("No matching data found for Data item Energy Prices"))
+        return self.xml(self.price_document(domain, days))
+
+    @staticmethod
+    def xml(text : str) -> web.Response:
+        # without charset parameter, entsoe-py only recognizes the exact content type
+        return web.Response(body=text.encode(), content_type="text/xml")
+
+    @staticmethod
+    def acknowledgement(reason : str) -> str:
+        return ('<?xml version="1.0" encoding="utf-8"?>\n<Acknowledgement_MarketDocument xmlns="urn:iec62325.351:tc57wg16:451-1:acknowledgementdocument:7:0">'
+                f'<mRID>loadtest</mRID><Reason><code>999</code><text>{reason}</text></Reason></Acknowledgement_MarketDocument>')
+
+    @staticmethod
+    def price_document(domain : str, days : pd.DatetimeIndex) -> str:
+        def utc(ts : pd.Timestamp) -> str:
+            return ts.tz_convert("UTC").strftime("%Y-%m-%dT%H:%MZ")
+
+        series = []
+        for i, day in enumerate(days):
+            nextDay = day + pd.Timedelta(days=1)
+            step, resolution = (900, "PT15M") if day >= QUARTERHOUR_GOLIVE else (3600, "PT60M")
+            seconds = np.arange(int(day.timestamp()), int(nextDay.timestamp()), step, dtype=np.int64)
+            points = "".join(f"<Point><position>{p}</position><price.amount>{v}</price.amount></Point>"
+                             for p, v in enumerate(prices(domain, seconds).tolist(), start=1))
+            series.append(f"<TimeSeries><mRID>{i + 1}</mRID><auction.type>A01</auction.type><businessType>A62</businessType>"
+                          f"<in_Domain.mRID codingScheme=\"A01\">{domain}</in_Domain.mRID><out_Domain.mRID codingScheme=\"A01\">{domain}</out_Domain.mRID>"
+                          f"<currency_Unit.name>EUR</currency_Unit.name><price_Measure_Unit.name>MWH</price_Measure_Unit.name><curveType>A01</curveType>"
+                          f"<Period><timeInterval><start>{utc(day)}</start><end>{utc(nextDay)}</end></timeInterval><resolution>{resolution}</resolution>"
+                          f"{points}</Period></TimeSeries>")
+        return ('<?xml version="1.0" encoding="utf-8"?>\n<Publication_MarketDocument xmlns="urn:iec62325.351:tc57wg16:451-3:publicationdocument:7:3">'
+                f'<mRID>loadtest</mRID><revisionNumber>1</revisionNumber><type>A44</type>'
+                f'<period.timeInterval><start>{utc(days[0])}</start><end>{utc(days[-1] + pd.Timedelta(days=1))}</end></period.timeInterval>'
+                f'{"".join(series)}</Publication_MarketDocument>')
+
+
+async def serve(upstream : Upstream, host : str, port : int) -> web.AppRunner:
+    runner = web.AppRunner(upstream.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def run(args : argparse.Namespace) -> None:
+    upstream = Upstream(args.latency, args.jitter, args.error_rate, args.history_days)
+    runner = await serve(upstream, args.host, args.port)
+    log.info(f"Upstream stand-ins listening on http://{args.host}:{args.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-ins for SMARD, Open-Meteo and ENTSO-E")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random 0..jitter seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--history-days", type=int, default=400, help="days of price history listed in the SMARD index")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(name)s: %(message)s', level=logging.INFO)
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
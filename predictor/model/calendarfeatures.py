@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+
+
+class CalendarFeatures:
+    """
+    Builds the holiday, day_0..5 and h_0..23 one-hot columns for a country.
+    The time index is converted to local time once and all columns are filled in a single vectorized pass.
+    Results are cached by timestamp, so a retrain only computes rows that were not requested before.
+    """
+    TIMEZONE = "Europe/Berlin"
+    COLUMNS : List[str] = ["holiday"] + [f"day_{i}" for i in range(6)] + [f"h_{h}" for h in range(24)]
+
+    countryCode : str
+    holidayDates : Dict[int, np.ndarray]
+    cache : pd.DataFrame | None = None
+
+    def __init__(self, countryCode : str):
+        self.countryCode = countryCode
+        self.holidayDates = {}
+
+    def features(self, times : pd.DatetimeIndex) -> pd.DataFrame:
+        """
+        Returns the calendar columns for the given (UTC) timestamps, indexed by these timestamps.
+        Rows older than the earliest requested timestamp are evicted from the cache.
+        """
+        if len(times) == 0:
+            return pd.DataFrame(np.zeros((0, len(self.COLUMNS)), dtype=np.uint8), index=times, columns=self.COLUMNS)
+
+        cache = self.cache
+        if cache is not None:
+            missing = times[~times.isin(cache.index)].unique()
+        else:
+            missing = times.unique()
+
+        if len(missing) > 0:
+            computed = self._compute(missing)
+            cache = computed if cache is None else pd.concat([cache, computed])
+            cache = cache[cache.index >= times.min()].sort_index()
+            self.cache = cache
+
+        assert cache is not None
+        return cache.reindex(times)
+
+    def _compute(self, times : pd.DatetimeIndex) -> pd.DataFrame:
+        local = times.tz_convert(self.TIMEZONE)
+        weekday = local.weekday.to_numpy()
+        hour = local.hour.to_numpy()
+        dates = local.tz_localize(None).to_numpy().astype("datetime64[D]")
+
+        rows = np.arange(len(times))
+        onehot = np.zeros((len(times), len(self.COLUMNS)), dtype=np.uint8)
+        onehot[:, 0] = (weekday == 6) | np.isin(dates, self._holidays(local.year.unique()))
+        workdays = weekday < 6
+        onehot[rows[workdays], 1 + weekday[workdays]] = 1
+        onehot[rows, 7 + hour] = 1
+
+        return pd.DataFrame(onehot, index=times, columns=self.COLUMNS)
+
+    def _holidays(self, years) -> np.ndarray:
+        import holidays # slow to import, only needed when new years are computed
+        for year in years:
+            if year not in self.holidayDates:
+                holis = holidays.country_holidays(self.countryCode, years=int(year))
+                self.holidayDates[year] = np.array(sorted(holis.keys()), dtype="datetime64[D]")
+        return np.concatenate([self.holidayDates[year] for year in years])
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+"""
+Countries and their configuration. Kept free of heavy imports, so the API can validate and route requests
+without loading the model.
+"""
+
+from enum import Enum
+
+class Country(str, Enum):
+    DE = 'DE'
+    AT = 'AT'
+    SE = 'SE'
+
+# Supported price resolutions (names as in the SMARD API) and the length of one price interval in seconds
+RESOLUTIONS = {"hour": 3600, "quarterhour": 900}
+
+class CountryConfig:
+    COUNTRY_CODE : str
+    FILTER : str
+    LATITUDES : list[float]
+    LONGITUDES : list[float]
+    RESOLUTION : str
+
+    def __init__ (self, COUNTRY_CODE, FILTER, LATITUDES, LONGITUDES, RESOLUTION = "hour"):
+        self.COUNTRY_CODE = COUNTRY_CODE
+        self.FILTER = FILTER
+        self.LATITUDES = LATITUDES
+        self.LONGITUDES = LONGITUDES
+        self.RESOLUTION = RESOLUTION
+
+# We sample these coordinates for solar/wind/temperature
+COUNTRY_CONFIG = {
+        Country.DE:  CountryConfig(
+                COUNTRY_CODE = 'DE',
+                FILTER = '4169',
+                LATITUDES =  [
+                    48.4,
+                    49.7,
+                    51.3,
+                    52.8,
+                    53.8,
+                    54.1
+                ],
+                LONGITUDES = [
+                    9.3,
+                    11.3,
+                    8.6,
+                    12.0,
+                    8.1,
+                    11.6
+                ]
+               ),
+        Country.AT : CountryConfig(
+                COUNTRY_CODE = 'AT',
+                FILTER = '4170',
+                LATITUDES = [
+                    48.36,
+                    48.27,
+                    47.32,
+                    47.00,
+                    47.11
+                ],
+                LONGITUDES = [
+                    16.31,
+                    13.85,
+                    10.82,
+                    13.54,
+                    15.80
+                ],
+               ),
+        Country.SE : CountryConfig(
+                COUNTRY_CODE = 'SE',
+                FILTER = 'SE',
+                LATITUDES = [
+                    67.51,  # Kiruna
+                    63.10,  # Östersund
+                    59.19,  # Stockholm
+                    57.42,  # Gothenburg
+                    55.36   # Malmö
+                ],
+                LONGITUDES = [
+                    20.13,  # Kiruna
+                    14.38,  # Östersund
+                    18.03,  # Stockholm
+                    11.58,  # Gothenburg
+                    13.00   # Malmö
+                ],
+               ),
+        }
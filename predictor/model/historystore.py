@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+
+from typing import Any, Dict, List, Tuple
+import numpy as np
+import pandas as pd
+import datetime
+import json
+import logging
+import os
+import tempfile
+
+log = logging.getLogger(__name__)
+
+
+class HistoryStore:
+    """
+    Persistent, append-only columnar store for time series like weather_DE or prices_DE.
+    Each series is a directory with
+    - meta.json: column names, number of rows and generation of the data files
+    - time.bin: int64 unix seconds (UTC), ascending
+    - values.bin: float64, one row of all columns per timestamp
+    Reads memory-map both files and use binary search on the time column, so a range read only touches the requested rows.
+    meta.json is replaced atomically after the data files are written, so an interrupted write leaves the previous rows:
+    appends write behind the stored rows, rewrites go to new files (time.<generation>.bin, values.<generation>.bin).
+    """
+    baseDir : str
+
+    def __init__(self, baseDir : str):
+        self.baseDir = baseDir
+
+    def columns(self, name : str) -> List[str] | None:
+        meta = self._meta(name)
+        return meta["columns"] if meta is not None else None
+
+    def time_range(self, name : str) -> Tuple[datetime.datetime, datetime.datetime] | None:
+        times, _ = self._open(name)
+        if times is None or len(times) == 0:
+            return None
+        return self._to_datetime(int(times[0])), self._to_datetime(int(times[-1]))
+
+    def read(self, name : str, start : datetime.datetime | None = None, end : datetime.datetime | None = None) -> pd.DataFrame | None:
+        """
+        Returns all rows with start <= time < end, indexed by UTC time. None if the series does not exist
+        """
+        columns = self.columns(name)
+        times, values = self._open(name)
+        if columns is None or times is None or values is None:
+            return None
+
+        first = 0 if start is None else int(np.searchsorted(times, start.timestamp(), side="left"))
+        last = len(times) if end is None else int(np.searchsorted(times, end.timestamp(), side="left"))
+        last = max(first, last)
+
+        index = pd.DatetimeIndex(pd.to_datetime(np.array(times[first:last]), unit="s", utc=True), name="time").as_unit("us")
+        return pd.DataFrame(np.array(values[first:last]), index=index, columns=columns)
+
+    def read_last(self, name : str, duration : datetime.timedelta) -> pd.DataFrame | None:
+        """
+        Returns the newest rows covering the given duration, counted back from the last stored timestamp (for offline replay)
+        """
+        timeRange = self.time_range(name)
+        if timeRange is None:
+            return None
+        return self.read(name, start=timeRange[1] - duration)
+
+    def append(self, name : str, df : pd.DataFrame) -> None:
+        """
+        Adds the rows of df. Rows for already stored timestamps replace the stored ones if their values differ.
+        New rows are written behind the stored ones. If stored rows change (forecasts, new prices), the files are rewritten
+        as a new generation, since changing them in place could leave a mix of old and new rows after a crash.
+        """
+        if len(df) == 0:
+            return
+        columns = [str(c) for c in df.columns]
+        df = df.sort_index()
+        newTimes = self._to_epoch(pd.DatetimeIndex(df.index))
+        newValues = df.to_numpy(dtype=np.float64)
+
+        directory = os.path.join(self.baseDir, name)
+        if self.columns(name) != columns:
+            if os.path.exists(directory):
+                log.warning(f"Columns of history {name} changed, starting a new history")
+            self._reset(name, columns)
+
+        meta = self._meta(name)
+        times, values = self._open(name)
+        assert meta is not None and times is not None and values is not None
+
+        if len(times) > 0 and newTimes[0] <= times[-1]:
+            pos = np.searchsorted(times, newTimes)
+            stored = (pos < len(times)) & (times[np.minimum(pos, len(times) - 1)] == newTimes)
+            unchanged = np.zeros(len(newTimes), dtype=bool)
+            unchanged[stored] = np.all((values[pos[stored]] == newValues[stored]) | (np.isnan(values[pos[stored]]) & np.isnan(newValues[stored])), axis=1)
+            newTimes, newValues = newTimes[~unchanged], newValues[~unchanged]
+            if len(newTimes) == 0:
+                return
+
+            # Rewrite everything from the first changed row on, keeping stored rows that are not replaced.
+            # The stored rows stay valid until the new files are complete
+            cut = int(np.searchsorted(times, newTimes[0], side="left"))
+            tailTimes, tailValues = np.array(times[cut:]), np.array(values[cut:])
+            keep = ~np.isin(tailTimes, newTimes)
+            newTimes = np.concatenate([tailTimes[keep], newTimes])
+            newValues = np.concatenate([tailValues[keep], newValues])
+            order = np.argsort(newTimes, kind="stable")
+            newTimes, newValues = newTimes[order], newValues[order]
+            generation = meta["generation"] + 1
+            self._write(name, generation, 0, np.concatenate([times[:cut], newTimes]), np.concatenate([values[:cut], newValues]))
+            del times, values
+            self._write_meta(name, columns, cut + len(newTimes), generation)
+            for fn in self._files(name, meta["generation"]):
+                os.unlink(fn)
+            return
+
+        rows = len(times)
+        del times, values
+        # behind the stored rows: overwrites what an interrupted append left there
+        self._write(name, meta["generation"], rows, newTimes, newValues)
+        self._write_meta(name, columns, rows + len(newTimes), meta["generation"])
+
+    def _meta(self, name : str) -> Dict[str, Any] | None:
+        metaFn = os.path.join(self.baseDir, name, "meta.json")
+        if not os.path.exists(metaFn):
+            return None
+        with open(metaFn) as f:
+            meta = json.load(f)
+        # stores written before meta.json had rows and generation: time.bin is written last, so the shorter file defines the valid rows
+        meta.setdefault("generation", 0)
+        if "rows" not in meta:
+            timeFn, valuesFn = self._files(name, 0)
+            meta["rows"] = min(os.path.getsize(timeFn) // 8, os.path.getsize(valuesFn) // (8 * len(meta["columns"])))
+        return meta
+
+    def _files(self, name : str, generation : int) -> Tuple[str, str]:
+        directory = os.path.join(self.baseDir, name)
+        suffix = ".bin" if generation == 0 else f".{generation}.bin"
+        return os.path.join(directory, "time" + suffix), os.path.join(directory, "values" + suffix)
+
+    def _open(self, name : str) -> Tuple[np.ndarray | None, np.ndarray | None]:
+        meta = self._meta(name)
+        if meta is None:
+            return None, None
+        columns, rows = meta["columns"], meta["rows"]
+        if rows == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(columns)), dtype=np.float64)
+        timeFn, valuesFn = self._files(name, meta["generation"])
+        times = np.memmap(timeFn, dtype=np.int64, mode="r", shape=(rows,))
+        values = np.memmap(valuesFn, dtype=np.float64, mode="r", shape=(rows, len(columns)))
+        return times, values
+
+    def _write(self, name : str, generation : int, offset : int, times : np.ndarray, values : np.ndarray) -> None:
+        """
+        Writes the rows from row offset on, and cuts off anything behind them
+        """
+        for fn, data in zip(self._files(name, generation), (times, values)):
+            data = np.ascontiguousarray(data)
+            rowBytes = data.itemsize * (data.shape[1] if data.ndim > 1 else 1)
+            with open(fn, "r+b" if offset > 0 else "wb") as f:
+                f.seek(offset * rowBytes)
+                f.write(data.tobytes())
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _write_meta(self, name : str, columns : List[str], rows : int, generation : int) -> None:
+        directory = os.path.join(self.baseDir, name)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".meta.")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"columns": columns, "rows": rows, "generation": generation}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, os.path.join(directory, "meta.json"))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def _reset(self, name : str, columns : List[str]) -> None:
+        directory = os.path.join(self.baseDir, name)
+        os.makedirs(directory, exist_ok=True)
+        for fn in os.listdir(directory):
+            if fn.endswith(".bin"):
+                os.unlink(os.path.join(directory, fn))
+        for fn in self._files(name, 0):
+            open(fn, "wb").close()
+        self._write_meta(name, columns, 0, 0)
+
+    @staticmethod
+    def _to_epoch(index : pd.DatetimeIndex) -> np.ndarray:
+        return index.tz_convert("UTC").tz_localize(None).to_numpy().astype("datetime64[s]").astype(np.int64)
+
+    @staticmethod
+    def _to_datetime(ts : int) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
+
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+
+from typing import TYPE_CHECKING, Any
+import aiohttp
+import asyncio
+import json
+import logging
+import random
+
+# only needed for synchronous clients (ENTSO-E), imported on first use
+if TYPE_CHECKING:
+    import requests
+
+log = logging.getLogger(__name__)
+
+
+class HttpClient:
+    """
+    Long-lived HTTP client shared by all PricePredictor instances.
+    Keeps one pooled aiohttp session (keep-alive, per-host connection limit, timeouts) and retries failed
+    requests with exponential backoff and jitter. A pooled requests session is provided for synchronous
+    clients like EntsoePandasClient.
+    The session is opened on first use or by start(), and must be closed with close() on shutdown.
+    """
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    limit : int
+    limitPerHost : int
+    timeout : float
+    retries : int
+    backoff : float
+    maxBackoff : float
+
+    session : aiohttp.ClientSession | None = None
+    syncSession : "requests.Session | None" = None
+
+    def __init__(self, limit : int = 32, limitPerHost : int = 8, timeout : float = 30.0, retries : int = 3, backoff : float = 0.5, maxBackoff : float = 10.0):
+        self.limit = limit
+        self.limitPerHost = limitPerHost
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.startLock = asyncio.Lock()
+
+    async def start(self) -> aiohttp.ClientSession:
+        async with self.startLock:
+            if self.session is None or self.session.closed:
+                connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limitPerHost, ttl_dns_cache=300, keepalive_timeout=60)
+                self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            return self.session
+
+    async def close(self) -> None:
+        async with self.startLock:
+            if self.session is not None:
+                await self.session.close()
+                self.session = None
+        if self.syncSession is not None:
+            self.syncSession.close()
+            self.syncSession = None
+
+    async def get_text(self, url : str) -> str:
+        session = self.session
+        if session is None or session.closed:
+            session = await self.start()
+
+        attempt = 0
+        while True:
+            try:
+                async with session.get(url) as resp:
+                    if resp.status in self.RETRY_STATUS and attempt < self.retries:
+                        raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status, message=resp.reason or "")
+                    resp.raise_for_status()
+                    return await resp.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.retries or not self._is_retryable(e):
+                    raise
+                delay = self._backoff_delay(attempt)
+                log.info(f"Request to {url.split('?')[0]} failed ({type(e).__name__}: {str(e)}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def get_json(self, url : str) -> Any:
+        return json.loads(await self.get_text(url))
+
+    def requests_session(self) -> "requests.Session":
+        """
+        Pooled session for synchronous clients. Retries use the same policy as the async client.
+        """
+        if self.syncSession is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retry = Retry(total=self.retries, backoff_factor=self.backoff, backoff_max=self.maxBackoff, backoff_jitter=self.backoff,
+                          status_forcelist=self.RETRY_STATUS, allowed_methods=["GET"], raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=self.limit, pool_maxsize=self.limitPerHost, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self.syncSession = session
+        return self.syncSession
+
+    def _backoff_delay(self, attempt : int) -> float:
+        # "full jitter": random delay up to the exponential backoff cap
+        return random.uniform(0, min(self.maxBackoff, self.backoff * 2 ** (attempt + 1)))
+
+    def _is_retryable(self, e : Exception) -> bool:
+        if isinstance(e, aiohttp.ClientResponseError):
+            return e.status in self.RETRY_STATUS
+        return True
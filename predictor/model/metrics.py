@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+
+from typing import Dict, List, Sequence, Tuple
+import bisect
+import contextlib
+import math
+import threading
+import time
+
+
+class Metric:
+    """
+    Base class of the metrics below. Values are kept per tuple of label values (in the order of labelNames)
+    and rendered in the Prometheus text exposition format.
+    Recording takes one lock and a dict lookup, so it is cheap enough for the request path and safe from executor threads.
+    """
+    kind : str = "untyped"
+    name : str
+    help : str
+    labelNames : Tuple[str, ...]
+
+    def __init__(self, name : str, help : str, labelNames : Sequence[str] = (), registry : "Registry | None" = None):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _check(self, labels : Tuple[str, ...]) -> None:
+        if len(labels) != len(self.labelNames):
+            raise ValueError(f"{self.name} expects labels {self.labelNames}, got {labels}")
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name : str, help : str, labelNames : Sequence[str] = (), registry : "Registry | None" = None):
+        super().__init__(name, help, labelNames, registry)
+        self.values : Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels : str, amount : float = 1.0) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    @contextlib.contextmanager
+    def count_exceptions(self, *labels : str):
+        self._check(labels)
+        try:
+            yield
+        except BaseException:
+            self.inc(*labels)
+            raise
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, dict(zip(self.labelNames, labels)), value) for labels, value in self.values.items()]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name : str, help : str, labelNames : Sequence[str] = (), registry : "Registry | None" = None):
+        super().__init__(name, help, labelNames, registry)
+        self.values : Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value : float, *labels : str) -> None:
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, *labels : str, amount : float = 1.0) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def dec(self, *labels : str, amount : float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    @contextlib.contextmanager
+    def track_inprogress(self, *labels : str):
+        self._check(labels)
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, dict(zip(self.labelNames, labels)), value) for labels, value in self.values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    buckets : Tuple[float, ...]
+
+    def __init__(self, name : str, help : str, labelNames : Sequence[str] = (), buckets : Sequence[float] = DEFAULT_BUCKETS, registry : "Registry | None" = None):
+        super().__init__(name, help, labelNames, registry)
+        self.buckets = tuple(sorted(buckets))
+        # per label tuple: [count per bucket (last one is +Inf)], sum
+        self.values : Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value : float, *labels : str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][i] += 1
+            entry[1][0] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels : str):
+        self._check(labels)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for labels, (counts, total) in self.values.items():
+                labelDict = dict(zip(self.labelNames, labels))
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", {**labelDict, "le": _format_value(bound)}, cumulative))
+                samples.append((f"{self.name}_sum", labelDict, total[0]))
+                samples.append((f"{self.name}_count", labelDict, cumulative))
+        return samples
+
+
+class Registry:
+    metrics : Dict[str, Metric]
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric : Metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self.metrics.values()) + "\n"
+
+
+def _format_labels(labels : Dict[str, str]) -> str:
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+def _escape(value : str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_value(value : float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# All metrics of the process, rendered by the /metrics endpoint of the API
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
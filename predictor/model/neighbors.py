@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+
+from typing import TYPE_CHECKING, Callable, Dict, List, Tuple
+import numpy as np
+
+if TYPE_CHECKING:
+    from sklearn.neighbors import NearestNeighbors
+
+
+class NeighborBackend:
+    """
+    Exact k-nearest-neighbour search over the scaled feature matrix of the predictor.
+    Indices returned by kneighbors refer to the rows of the fitted matrix. After update(keep, added),
+    rows are numbered as the kept rows in their previous order, followed by the added rows.
+    """
+    name : str = "base"
+
+    def fit(self, X : np.ndarray) -> "NeighborBackend":
+        raise NotImplementedError()
+
+    def kneighbors(self, Q : np.ndarray, k : int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns distances and indices of the k nearest rows for each query row, both of shape (len(Q), k), nearest first
+        """
+        raise NotImplementedError()
+
+    def update(self, keep : np.ndarray, added : np.ndarray) -> None:
+        """
+        Removes all rows where keep is False and appends the added rows. Default: refit on the new matrix
+        """
+        self.fit(np.concatenate([self.matrix()[keep], added]))
+
+    def matrix(self) -> np.ndarray:
+        raise NotImplementedError()
+
+
+class SklearnBackend(NeighborBackend):
+    """
+    scikit-learn NearestNeighbors. algorithm="auto" is what KNeighborsRegressor uses by default
+    """
+    algorithm : str
+    leafSize : int
+    X : np.ndarray | None = None
+    nn : "NearestNeighbors | None" = None
+
+    def __init__(self, algorithm : str = "auto", leafSize : int = 30):
+        self.algorithm = algorithm
+        self.leafSize = leafSize
+        self.name = "sklearn" if algorithm == "auto" else algorithm
+
+    def fit(self, X : np.ndarray) -> "SklearnBackend":
+        from sklearn.neighbors import NearestNeighbors # imported on first use, sklearn is slow to import
+        self.X = X
+        self.nn = NearestNeighbors(algorithm=self.algorithm, leaf_size=self.leafSize).fit(X)
+        return self
+
+    def kneighbors(self, Q : np.ndarray, k : int) -> Tuple[np.ndarray, np.ndarray]:
+        assert self.nn is not None
+        return self.nn.kneighbors(Q, n_neighbors=k)
+
+    def matrix(self) -> np.ndarray:
+        assert self.X is not None
+        return self.X
+
+
+class CalendarBucketBackend(NeighborBackend):
+    """
+    Exact search for feature matrices that consist of one-hot calendar columns and a single continuous column (weathersum).
+    Training rows are partitioned by their calendar columns (hour/day/holiday bucket) and sorted by the continuous value inside each bucket.
+    The squared distance between a query and a row is then the (constant) squared distance between their buckets plus the squared
+    difference of the continuous values, so the k nearest rows of a bucket can be found by binary search.
+    Buckets are visited in order of their distance to the query bucket, until no remaining bucket can contain a nearer row.
+    Distances are exactly those of sklearn. Which rows are returned among rows at the same distance, and their order, can differ
+    (sklearn does not define it either), so predictions only match sklearn if no distances tie at the k-th neighbour.
+    """
+    name = "bucketed"
+    continuousColumn : int
+
+    keys : np.ndarray # (buckets, calendar columns)
+    offsets : np.ndarray # rows of bucket b are sortedValues[offsets[b]:offsets[b + 1]]
+    sortedValues : np.ndarray
+    sortedRows : np.ndarray
+    calendar : np.ndarray # calendar part of each row, in row order
+    values : np.ndarray # continuous value of each row, in row order
+
+    def __init__(self, continuousColumn : int = -1):
+        self.continuousColumn = continuousColumn
+
+    def fit(self, X : np.ndarray) -> "CalendarBucketBackend":
+        if len(X) == 0:
+            raise ValueError("Cannot fit nearest neighbours on 0 rows")
+        calendar, values = self._split(X)
+        self.calendar, self.values = calendar, values
+        _, first, buckets = np.unique(self._row_keys(calendar), return_index=True, return_inverse=True)
+        self.keys = calendar[first]
+        self._build(buckets.reshape(-1), values)
+        return self
+
+    def update(self, keep : np.ndarray, added : np.ndarray) -> None:
+        # Drop removed rows from the sorted runs and insert the new ones at their sorted position, without re-sorting the whole matrix
+        calendar, values = self._split(added)
+        rowNumbers = np.cumsum(keep) - 1
+        buckets = np.repeat(np.arange(len(self.keys)), np.diff(self.offsets))
+
+        keptSorted = keep[self.sortedRows]
+        sortedValues = self.sortedValues[keptSorted]
+        sortedRows = rowNumbers[self.sortedRows[keptSorted]]
+        buckets = buckets[keptSorted]
+
+        keyIndex = {key.tobytes(): b for b, key in enumerate(self.keys)}
+        addedBuckets = np.empty(len(added), dtype=np.int64)
+        newKeys : List[np.ndarray] = []
+        for i, key in enumerate(calendar):
+            b = keyIndex.get(key.tobytes())
+            if b is None:
+                b = len(self.keys) + len(newKeys)
+                keyIndex[key.tobytes()] = b
+                newKeys.append(key)
+            addedBuckets[i] = b
+        if len(newKeys) > 0:
+            self.keys = np.concatenate([self.keys, np.array(newKeys)])
+
+        # insertion positions in the (bucket, value) order of the kept rows
+        positions = self._segment_search(sortedValues, np.searchsorted(buckets, addedBuckets, side="left"), np.searchsorted(buckets, addedBuckets, side="right"), values)
+
+        firstAdded = int(keep.sum())
+        order = np.lexsort((values, addedBuckets, positions))
+        self.sortedValues = np.insert(sortedValues, positions[order], values[order])
+        self.sortedRows = np.insert(sortedRows, positions[order], firstAdded + order)
+        buckets = np.insert(buckets, positions[order], addedBuckets[order])
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(buckets, minlength=len(self.keys)))])
+        self.calendar = np.concatenate([self.calendar[keep], calendar])
+        self.values = np.concatenate([self.values[keep], values])
+
+    def kneighbors(self, Q : np.ndarray, k : int) -> Tuple[np.ndarray, np.ndarray]:
+        # like sklearn, instead of returning unfilled (-1) neighbours
+        if k <= 0 or k > len(self.values):
+            raise ValueError(f"Expected 0 < k <= number of fitted rows, but k = {k}, fitted rows = {len(self.values)}")
+        calendar, values = self._split(Q)
+        _, first, queryBuckets = np.unique(self._row_keys(calendar), return_index=True, return_inverse=True)
+        queryBuckets = queryBuckets.reshape(-1)
+        queryKeys = calendar[first]
+        bucketDistances = ((queryKeys[:, None, :] - self.keys[None, :, :]) ** 2).sum(axis=2)
+        bucketOrder = np.argsort(bucketDistances, axis=1, kind="stable")
+
+        bestDist = np.full((len(Q), k), np.inf)
+        bestIdx = np.full((len(Q), k), -1, dtype=np.int64)
+        active = np.arange(len(Q))
+        offsets = np.arange(-k, k)
+        # In round r, every query looks at its r-th closest bucket. A query is done once the next bucket is further away than its k-th neighbor
+        for r in range(len(self.keys)):
+            b = bucketOrder[queryBuckets[active], r]
+            d2 = bucketDistances[queryBuckets[active], b]
+            needed = d2 < bestDist[active, -1]
+            active, b, d2 = active[needed], b[needed], d2[needed]
+            if len(active) == 0:
+                break
+
+            # the k nearest values in a sorted run are within k positions around the insertion point
+            start, end = self.offsets[b], self.offsets[b + 1]
+            qv = values[active]
+            pos = self._segment_search(self.sortedValues, start, end, qv)
+            window = pos[:, None] + offsets[None, :]
+            valid = (window >= start[:, None]) & (window < end[:, None])
+            window = np.clip(window, 0, len(self.sortedValues) - 1)
+            dist = d2[:, None] + (self.sortedValues[window] - qv[:, None]) ** 2
+            dist[~valid] = np.inf
+
+            candDist = np.concatenate([bestDist[active], dist], axis=1)
+            candIdx = np.concatenate([bestIdx[active], self.sortedRows[window]], axis=1)
+            order = np.argsort(candDist, axis=1, kind="stable")[:, :k]
+            bestDist[active] = np.take_along_axis(candDist, order, axis=1)
+            bestIdx[active] = np.take_along_axis(candIdx, order, axis=1)
+
+        return np.sqrt(bestDist), bestIdx
+
+    def matrix(self) -> np.ndarray:
+        return np.insert(self.calendar, self._column(self.calendar.shape[1] + 1), self.values, axis=1)
+
+    def _build(self, buckets : np.ndarray, values : np.ndarray) -> None:
+        order = np.lexsort((values, buckets))
+        self.sortedValues = values[order]
+        self.sortedRows = order
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(buckets, minlength=len(self.keys)))])
+
+    @staticmethod
+    def _segment_search(sortedValues : np.ndarray, lo : np.ndarray, hi : np.ndarray, values : np.ndarray) -> np.ndarray:
+        """
+        Vectorized binary search: for each i, the first position in sortedValues[lo[i]:hi[i]] with a value >= values[i]
+        """
+        lo, hi = lo.astype(np.int64), hi.astype(np.int64)
+        while True:
+            searching = lo < hi
+            if not searching.any():
+                return lo
+            mid = (lo + hi) // 2
+            below = searching & (sortedValues[np.minimum(mid, len(sortedValues) - 1)] < values)
+            lo = np.where(below, mid + 1, lo)
+            hi = np.where(searching & ~below, mid, hi)
+
+    @staticmethod
+    def _row_keys(calendar : np.ndarray) -> np.ndarray:
+        # view each row as one opaque value, so rows can be compared and hashed as a whole
+        calendar = np.ascontiguousarray(calendar)
+        return calendar.view(np.dtype((np.void, calendar.dtype.itemsize * calendar.shape[1]))).reshape(-1)
+
+    def _column(self, ncols : int) -> int:
+        return self.continuousColumn % ncols
+
+    def _split(self, X : np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        col = self._column(X.shape[1])
+        return np.delete(X, col, axis=1), np.ascontiguousarray(X[:, col])
+
+
+NEIGHBOR_BACKENDS : Dict[str, Callable[[], NeighborBackend]] = {
+    "sklearn": lambda: SklearnBackend(),
+    "kd_tree": lambda: SklearnBackend("kd_tree", leafSize=40),
+    "ball_tree": lambda: SklearnBackend("ball_tree", leafSize=20),
+    "bucketed": lambda: CalendarBucketBackend(),
+}
+
+def create_backend(name : str) -> NeighborBackend:
+    if name not in NEIGHBOR_BACKENDS:
+        raise ValueError(f"Unknown neighbor backend {name}. Available: {', '.join(NEIGHBOR_BACKENDS.keys())}")
+    return NEIGHBOR_BACKENDS[name]()
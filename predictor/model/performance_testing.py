@@ -1,56 +1,247 @@
 #!/usr/bin/python3
 
+from typing import Any, Dict, List, Tuple
+import argparse
 import asyncio
-from sklearn.metrics import mean_absolute_error, mean_squared_error
-import pricepredictor as pred
+import datetime
+import json
 import logging
-
-logging.basicConfig(
-    format='%(message)s',
-    level=logging.INFO
-)
-
-
-async def main():
-    pp = pred.PricePredictor(testdata=False, country=pred.Country.DE)
-    #pp = pred.PricePredictor(testdata=False, country=pred.Country.AT)
-    fulldata = await pp.prepare_dataframe()
-    #print(fulldata)
-    assert fulldata is not None
-    fulldata.dropna(inplace=True)
-
-    n = 500
-    sqerror = 0
-    abserror = 0
-    for i in range(n):
-        pp.fulldata = fulldata.copy()
-        train = fulldata.sample(frac=0.9) # train only on a random subset of data
-        #train = fulldata[0:int(0.9*len(fulldata))]
-        await pp.train(subset=train, prepare=False)
-
-        test = fulldata.drop(train.index) # but use the remaining data for actual prediction
-        prediction = await pp.predict_raw(estimateAll=True)
-        prediction = prediction.drop(train.index)
-
-        sqerror += mean_squared_error(test[['price']], prediction[['price']])
-        abserror += mean_absolute_error(test[['price']], prediction[['price']])
-
-    print(f"mean squared error={sqerror/n}, mean absolute error = {abserror/n}")
-
-
-
-
-
-        
-
-
-
-
-
-
-
-
-
-
-
-asyncio.run(main())
\ No newline at end of file
+import math
+import multiprocessing
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import predictor.model.pricepredictor as pred
+from predictor.model.calendarfeatures import CalendarFeatures
+
+log = logging.getLogger(__name__)
+
+# hour of day (local time), horizon in days after the training cutoff (-1 for cross validation), prediction error
+Errors = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class SharedFrame:
+    """
+    Prepared dataset of one country in shared memory. Worker processes attach to it by name,
+    so the data is loaded once and never pickled or copied per task.
+    """
+    timesName : str
+    valuesName : str
+    shape : Tuple[int, int]
+    columns : List[str]
+
+    def __init__(self, df : pd.DataFrame):
+        times = pred.PricePredictor._epoch(df.index)
+        values = df.to_numpy(dtype=np.float64)
+        self.shape = values.shape
+        self.columns = [str(c) for c in df.columns]
+        self.blocks = [SharedMemory(create=True, size=max(1, times.nbytes)), SharedMemory(create=True, size=max(1, values.nbytes))]
+        self.timesName, self.valuesName = self.blocks[0].name, self.blocks[1].name
+        np.ndarray(times.shape, dtype=np.int64, buffer=self.blocks[0].buf)[:] = times
+        np.ndarray(values.shape, dtype=np.float64, buffer=self.blocks[1].buf)[:] = values
+
+    def __getstate__(self):
+        return {"timesName": self.timesName, "valuesName": self.valuesName, "shape": self.shape, "columns": self.columns}
+
+    def attach(self) -> pd.DataFrame:
+        self.blocks = [SharedMemory(name=self.timesName), SharedMemory(name=self.valuesName)]
+        times = np.ndarray((self.shape[0],), dtype=np.int64, buffer=self.blocks[0].buf)
+        values = np.ndarray(self.shape, dtype=np.float64, buffer=self.blocks[1].buf)
+        index = pd.DatetimeIndex(pd.to_datetime(times, unit="s", utc=True), name="time").as_unit("us")
+        return pd.DataFrame(values, index=index, columns=self.columns, copy=False)
+
+    def unlink(self) -> None:
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+# per worker process: attached datasets by country code
+_frames : Dict[str, pd.DataFrame] = {}
+_shared : List[SharedFrame] = []
+
+def _attach(frames : Dict[str, SharedFrame]) -> None:
+    for country, frame in frames.items():
+        _frames[country] = frame.attach()
+        _shared.append(frame) # keep the mapping alive
+
+
+def _predictor(country : str, k : int, learnDays : int, backend : str) -> pred.PricePredictor:
+    pp = pred.PricePredictor(country=pred.Country(country), learnDays=learnDays, neighborBackend=backend)
+    pp.neighborCount = k
+    return pp
+
+def _last_days(df : pd.DataFrame, days : int) -> pd.DataFrame:
+    return df[df.index >= df.index[-1] - pd.Timedelta(days=days)]
+
+def _local_hours(index : pd.Index) -> np.ndarray:
+    return pd.DatetimeIndex(index).tz_convert(CalendarFeatures.TIMEZONE).hour.to_numpy()
+
+
+def cross_validation(country : str, k : int, learnDays : int, backend : str, seed : int, splits : List[int], testFraction : float) -> Errors:
+    """
+    Random train/test splits of the last learnDays of data. Each split is seeded with (seed, split number),
+    so results do not depend on how splits are distributed over the workers.
+    """
+    data = _last_days(_frames[country], learnDays)
+    pp = _predictor(country, k, learnDays, backend)
+    hours = _local_hours(data.index)
+    prices = data["price"].to_numpy()
+    result : List[Errors] = []
+    for split in splits:
+        rng = np.random.default_rng([seed, split])
+        test = np.zeros(len(data), dtype=bool)
+        test[rng.choice(len(data), size=max(1, int(round(testFraction * len(data)))), replace=False)] = True
+
+        model = pp.build_model(data, subset=data[~test])
+        result.append((hours[test], np.full(test.sum(), -1), model.predictions[test] - prices[test]))
+    return _concat(result)
+
+def walk_forward(country : str, k : int, learnDays : int, backend : str, forecastDays : int, cutoffs : List[int], incremental : bool) -> Errors:
+    """
+    Replays the daily retrain of production: for each cutoff, the model learns from the learnDays before it
+    and predicts the following forecastDays without knowing their prices.
+    With incremental, each retrain starts from the model of the previous cutoff like the API does.
+    Note that historical weather is used in place of the forecast that was available at the time.
+    """
+    data = _frames[country]
+    pp = _predictor(country, k, learnDays, backend)
+    result : List[Errors] = []
+    previous = None
+    for cutoff in cutoffs:
+        start = pd.Timestamp(cutoff, unit="s", tz="UTC")
+        window = data[(data.index >= start - pd.Timedelta(days=learnDays)) & (data.index < start + pd.Timedelta(days=forecastDays))]
+        future = window.index >= start
+        if not future.any():
+            continue
+        actual = window["price"].to_numpy()[future]
+        masked = window.copy()
+        masked.loc[future, "price"] = np.nan
+
+        model = pp.build_model(masked, incremental=incremental, previous=previous)
+        previous = model if incremental else None
+        horizon = (pred.PricePredictor._epoch(window.index[future]) - cutoff) // 86400
+        result.append((_local_hours(window.index[future]), horizon, model.predictions[future] - actual))
+    return _concat(result)
+
+def _concat(errors : List[Errors]) -> Errors:
+    if len(errors) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    return tuple(np.concatenate([e[i] for e in errors]) for i in range(3)) # type: ignore
+
+
+def summarize(errors : Errors) -> Dict[str, Any]:
+    hours, horizons, err = errors
+    def stats(mask : np.ndarray) -> Dict[str, Any]:
+        e = err[mask]
+        return {"mae": float(np.mean(np.abs(e))), "mse": float(np.mean(e ** 2)), "n": int(len(e))}
+    summary = stats(np.ones(len(err), dtype=bool))
+    summary["byHour"] = {int(h): stats(hours == h) for h in np.unique(hours)}
+    summary["byHorizon"] = {int(h): stats(horizons == h) for h in np.unique(horizons) if h >= 0}
+    return summary
+
+def _chunks(items : List[int], count : int) -> List[List[int]]:
+    size = max(1, math.ceil(len(items) / count))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+async def load(countries : List[str], days : int, testdata : bool) -> Dict[str, pd.DataFrame]:
+    """
+    Prepared data with known prices of the last days for each country
+    """
+    frames = {}
+    for country in countries:
+        pp = pred.PricePredictor(country=pred.Country(country), testdata=testdata, learnDays=days)
+        try:
+            data = await pp.prepare_dataframe()
+        finally:
+            await pp.http.close()
+        assert data is not None
+        frames[country] = data.dropna()
+    return frames
+
+def walk_forward_cutoffs(df : pd.DataFrame, days : int) -> List[int]:
+    # local midnight of each of the last days. The newest one is at least 23 hours before the last row,
+    # so every cutoff has a full day of known prices after it (e.g. not only the first hour, if the data ends at midnight)
+    last = pd.DatetimeIndex(df.index).tz_convert(CalendarFeatures.TIMEZONE)[-1]
+    lastDay = (last - pd.Timedelta(hours=23)).normalize()
+    cutoffs = pd.date_range(end=lastDay, periods=days, freq="D")
+    return [int(c.timestamp()) for c in cutoffs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the price model with seeded cross validation and walk-forward backtests")
+    parser.add_argument("--countries", nargs="+", default=["DE", "AT"], choices=[c.value for c in pred.Country])
+    parser.add_argument("--mode", nargs="+", default=["cv", "walkforward"], choices=["cv", "walkforward"])
+    parser.add_argument("--k", nargs="+", type=int, default=[3], help="neighbor counts to evaluate")
+    parser.add_argument("--learn-days", nargs="+", type=int, default=[30], help="training window sizes to evaluate")
+    parser.add_argument("--backend", default="bucketed")
+    parser.add_argument("--splits", type=int, default=500, help="cross validation: number of random splits")
+    parser.add_argument("--test-fraction", type=float, default=0.1)
+    parser.add_argument("--walk-days", type=int, default=30, help="walk-forward: number of daily retrains to replay")
+    parser.add_argument("--forecast-days", type=int, default=7)
+    parser.add_argument("--incremental", action="store_true", help="walk-forward: retrain incrementally like the API")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--testdata", action="store_true", help="load weather and prices from the persistent history instead of downloading")
+    parser.add_argument("--output", help="write all results as JSON to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+
+    started = time.perf_counter()
+    days = max(args.learn_days) + (args.walk_days + 1 if "walkforward" in args.mode else 0)
+    frames = asyncio.run(load(args.countries, days, args.testdata))
+    log.info(f"Loaded {', '.join(f'{c}: {len(df)} rows' for c, df in frames.items())} in {time.perf_counter() - started:.1f}s")
+
+    logging.getLogger(pred.__name__).setLevel(logging.WARNING)
+    shared = {country: SharedFrame(df) for country, df in frames.items()}
+    results = []
+    try:
+        # spawn: the parent already runs threads (training executor), which do not mix well with fork
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=context, initializer=_attach, initargs=(shared,)) as pool:
+            for country in args.countries:
+                for mode in args.mode:
+                    for k in args.k:
+                        for learnDays in args.learn_days:
+                            configStarted = time.perf_counter()
+                            if mode == "cv":
+                                # several chunks per worker, so slow chunks do not hold up the others
+                                futures = [pool.submit(cross_validation, country, k, learnDays, args.backend, args.seed, chunk, args.test_fraction)
+                                           for chunk in _chunks(list(range(args.splits)), args.workers * 4)]
+                            else:
+                                # contiguous blocks, so incremental retrains can build on the previous day
+                                cutoffs = walk_forward_cutoffs(frames[country], args.walk_days)
+                                futures = [pool.submit(walk_forward, country, k, learnDays, args.backend, args.forecast_days, chunk, args.incremental)
+                                           for chunk in _chunks(cutoffs, args.workers)]
+                            summary = summarize(_concat([f.result() for f in futures]))
+                            summary.update(country=country, mode=mode, k=k, learnDays=learnDays, seconds=time.perf_counter() - configStarted)
+                            results.append(summary)
+                            report(summary)
+    finally:
+        for frame in shared.values():
+            frame.unlink()
+
+    total = time.perf_counter() - started
+    print(f"Total wall-clock time: {total:.1f}s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": results, "seconds": total,
+                       "created": datetime.datetime.now(datetime.timezone.utc).isoformat()}, f, indent=2)
+
+
+def report(summary : Dict) -> None:
+    print(f"{summary['country']} {summary['mode']} k={summary['k']} learnDays={summary['learnDays']}: "
+          f"mean squared error={summary['mse']:.3f}, mean absolute error={summary['mae']:.3f} "
+          f"({summary['n']} predictions, {summary['seconds']:.1f}s)")
+    print("  MAE by hour:    " + " ".join(f"{h:02d}:{s['mae']:.2f}" for h, s in summary["byHour"].items()))
+    if len(summary["byHorizon"]) > 0:
+        print("  MAE by horizon: " + " ".join(f"D+{h + 1}:{s['mae']:.2f}" for h, s in summary["byHorizon"].items()))
+
+
+if __name__ == "__main__":
+    main()
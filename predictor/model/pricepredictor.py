@@ -1,101 +1,96 @@
 #!/usr/bin/python3
 
-import math
-from typing import Dict, List, Tuple, cast
-from enum import Enum
+from typing import TYPE_CHECKING, Dict, List, Tuple, cast
+import numpy as np
 import pandas as pd
 import datetime
-import aiohttp
 import json
 import logging
 import os
 import asyncio
-import holidays
+import contextlib
+import copy
 import time
 import pytz
-
-from entsoe import EntsoePandasClient
-from sklearn.linear_model import LinearRegression
-from sklearn.neighbors import KNeighborsRegressor
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+from predictor.model.calendarfeatures import CalendarFeatures
+from predictor.model.countries import COUNTRY_CONFIG, RESOLUTIONS, Country, CountryConfig
+from predictor.model.httpclient import HttpClient
+from predictor.model.historystore import HistoryStore
+from predictor.model.metrics import Counter, Gauge, Histogram
+from predictor.model.neighbors import NeighborBackend, create_backend
+from predictor.model.priceseries import PriceSeries
+from predictor.model.profiling import ProfileSession
+from predictor.model.smard import SmardClient
+from predictor.model.weather import WeatherFetcher
+
+# sklearn and entsoe take long to import and are only needed for training and for SE prices, so they are imported on first use
+if TYPE_CHECKING:
+    from entsoe import EntsoePandasClient
 
 log = logging.getLogger(__name__)
 
-class Country(str, Enum):
-    DE = 'DE'
-    AT = 'AT'
-    SE = 'SE'
-
-class CountryConfig:
-    COUNTRY_CODE : str
-    FILTER : str
-    LATITUDES : list[float]
-    LONGITUDES : list[float]
-
-    def __init__ (self, COUNTRY_CODE, FILTER, LATITUDES, LONGITUDES):
-        self.COUNTRY_CODE = COUNTRY_CODE
-        self.FILTER = FILTER
-        self.LATITUDES = LATITUDES
-        self.LONGITUDES = LONGITUDES
-
-# We sample these coordinates for solar/wind/temperature
-COUNTRY_CONFIG = {
-        Country.DE:  CountryConfig(
-                COUNTRY_CODE = 'DE',
-                FILTER = '4169',
-                LATITUDES =  [
-                    48.4,
-                    49.7,
-                    51.3,
-                    52.8,
-                    53.8,
-                    54.1
-                ],
-                LONGITUDES = [
-                    9.3,
-                    11.3,
-                    8.6,
-                    12.0,
-                    8.1,
-                    11.6
-                ]
-               ),
-        Country.AT : CountryConfig(
-                COUNTRY_CODE = 'AT',
-                FILTER = '4170',
-                LATITUDES = [
-                    48.36,
-                    48.27,
-                    47.32,
-                    47.00,
-                    47.11
-                ],
-                LONGITUDES = [
-                    16.31,
-                    13.85,
-                    10.82,
-                    13.54,
-                    15.80
-                ],
-               ),
-        Country.SE : CountryConfig(
-                COUNTRY_CODE = 'SE',
-                FILTER = 'SE',
-                LATITUDES = [
-                    67.51,  # Kiruna
-                    63.10,  # Östersund
-                    59.19,  # Stockholm
-                    57.42,  # Gothenburg
-                    55.36   # Malmö
-                ],
-                LONGITUDES = [
-                    20.13,  # Kiruna
-                    14.38,  # Östersund
-                    18.03,  # Stockholm
-                    11.58,  # Gothenburg
-                    13.00   # Malmö
-                ],
-               ),
-        }
+# CPU-bound stages (feature preparation, fitting, prediction) run in this pool instead of on the event loop,
+# so requests are not blocked while training and independent countries can train in parallel
+TRAIN_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("TRAIN_WORKERS", "3")), thread_name_prefix="train")
+
+FETCH_SECONDS = Histogram("epex_fetch_duration_seconds", "Duration of upstream downloads", ["country", "source"])
+FETCH_ERRORS = Counter("epex_fetch_errors_total", "Failed upstream downloads", ["country", "source"])
+TRAIN_SECONDS = Histogram("epex_train_stage_duration_seconds", "Duration of the pipeline stages (fetch, prepare, train, predict)", ["country", "stage"])
+TRAINING_RUNS = Counter("epex_training_runs_total", "Training runs by mode (full or incremental)", ["country", "mode"])
+MODEL_ROWS = Gauge("epex_model_rows", "Rows of the current model: all rows and rows with known prices (training rows)", ["country", "kind"])
+
+
+class TrainedModel:
+    """
+    Result of one training run. It is never modified after creation: training builds a new instance
+    and the predictor swaps it in with a single assignment, so readers always see a consistent state.
+    All arrays are aligned with the rows of unscaled.
+    """
+    unscaled : pd.DataFrame # prepared data the model was trained on, used to find changed rows in incremental training
+    times : np.ndarray # unix seconds of each row
+    features : np.ndarray # float32, C-contiguous: scaled calendar columns and weathersum, see PricePredictor._features
+    featureColumns : List[str]
+    known : np.ndarray # known prices, nan where not published yet
+    scaling : np.ndarray
+    gram : np.ndarray # linreg sums over the training rows, see PricePredictor._gram
+    neighbors : NeighborBackend
+    trainTimes : np.ndarray # timestamps of the rows the neighbor index was fitted on
+    trainPrices : np.ndarray
+    predictions : np.ndarray
+    neighborTimes : np.ndarray # timestamps of the neighborCount nearest training rows
+    neighborDistance : np.ndarray # distance to the furthest of these neighbors
+    lastFullTrain : datetime.datetime
+
+    def __init__(self, unscaled, times, features, featureColumns, known, scaling, gram, neighbors, trainTimes, trainPrices, predictions, neighborTimes,
+                 neighborDistance, lastFullTrain):
+        self.unscaled = unscaled
+        self.times = times
+        self.features = features
+        self.featureColumns = featureColumns
+        self.known = known
+        self.scaling = scaling
+        self.gram = gram
+        self.neighbors = neighbors
+        self.trainTimes = trainTimes
+        self.trainPrices = trainPrices
+        self.predictions = predictions
+        self.neighborTimes = neighborTimes
+        self.neighborDistance = neighborDistance
+        self.lastFullTrain = lastFullTrain
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @property
+    def fulldata(self) -> pd.DataFrame:
+        """
+        Scaled calendar columns, known prices and weathersum as DataFrame. Built on each access, the model only keeps the arrays
+        """
+        df = pd.DataFrame(self.features, index=self.unscaled.index, columns=self.featureColumns)
+        df.insert(len(self.featureColumns) - 1, "price", self.known)
+        return df
 
 
 class PricePredictor:
@@ -103,72 +98,345 @@ class PricePredictor:
     weather : pd.DataFrame | None = None
     prices: pd.DataFrame | None = None
 
-    fulldata : pd.DataFrame | None = None
+    model : TrainedModel | None = None
 
     testdata : bool = False
     learnDays : int = 30
     forecastDays : int
-
-    predictor : KNeighborsRegressor | None = None
-
-    def __init__(self, country: Country = Country.DE, testdata : bool = False, learnDays=30, forecastDays=7):
+    # price interval, see countries.RESOLUTIONS. Weather is always hourly and interpolated to finer resolutions
+    resolution : str = "hour"
+
+    neighborBackend : str = "bucketed"
+    neighborCount : int = 3
+    calendar : CalendarFeatures
+    smard : SmardClient
+    http : HttpClient
+    weatherFetcher : WeatherFetcher
+    entsoe : "EntsoePandasClient | None" = None
+    store : HistoryStore | None = None
+    executor : Executor
+    # set while an update cycle is being profiled, see profiling.ProfileSession
+    profile : ProfileSession | None = None
+
+    # weather refreshes re-download only this many past days and keep older, settled hours from earlier downloads
+    weatherOverlapDays : int = 2
+
+    # incremental training falls back to a full rebuild if the linreg coefficients changed by more than this (relative norm)
+    driftThreshold : float = 0.05
+    fullTrainInterval : datetime.timedelta = datetime.timedelta(hours=24)
+
+    def __init__(self, country: Country = Country.DE, testdata : bool = False, learnDays=30, forecastDays=7, http : HttpClient | None = None,
+                 store : HistoryStore | None = None, neighborBackend : str = "bucketed", executor : Executor = TRAIN_EXECUTOR,
+                 weatherFetcher : WeatherFetcher | None = None, resolution : str | None = None):
+        """
+        http: shared client to use for all downloads. If not given, the predictor creates its own, which has to be closed by the caller
+        weatherFetcher: shared by several predictors, their weather is downloaded together. If not given, the predictor creates its own
+        store: if given, all fetched weather and prices are appended to this history.
+        testdata: replay weather and prices from the history (default directory "history") instead of downloading, if it has data
+        neighborBackend: nearest neighbour search implementation, see neighbors.NEIGHBOR_BACKENDS. All give the same predictions unless distances tie
+        executor: runs the CPU-bound stages
+        resolution: "hour" or "quarterhour" (see countries.RESOLUTIONS). Defaults to the resolution of the country config
+        """
+        create_backend(neighborBackend) # fail early on unknown names
+        self.neighborBackend = neighborBackend
         self.config = COUNTRY_CONFIG[country]
+        self.resolution = resolution if resolution is not None else self.config.RESOLUTION
+        if self.resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {self.resolution}, expected one of {', '.join(RESOLUTIONS.keys())}")
+        self.http = http if http is not None else HttpClient()
+        self.weatherFetcher = weatherFetcher if weatherFetcher is not None else WeatherFetcher(self.http)
+        self.weatherFetcher.register(Country(self.config.COUNTRY_CODE))
+        self.store = store if store is not None or not testdata else HistoryStore(os.getenv("HISTORY_DIR", "history"))
+        self.calendar = CalendarFeatures(self.config.COUNTRY_CODE)
+        self.smard = SmardClient()
+        self.executor = executor
         self.testdata = testdata
         self.learnDays = learnDays
         self.forecastDays = forecastDays
 
+    @property
+    def fulldata(self) -> pd.DataFrame | None:
+        model = self.model
+        return model.fulldata if model is not None else None
+
+    async def _run(self, func, *args):
+        profile = self.profile
+        if profile is not None:
+            func = profile.wrap(func)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    @contextlib.contextmanager
+    def _stage(self, stage : str):
+        """
+        Records the duration of a pipeline stage as metric, and as span if the current cycle is profiled
+        """
+        profile = self.profile
+        with TRAIN_SECONDS.time(self.config.COUNTRY_CODE, stage), (profile.span(stage) if profile is not None else contextlib.nullcontext()):
+            yield
+
     
-    async def train(self, subset=None, prepare=True) -> None:
-        # To determine the importance of each parameter, we first weight them using linreg, because knn is treating difference in each parameter uniformly
-        if prepare:
-            self.fulldata = await self.prepare_dataframe()
-        if self.fulldata is None:
+    async def train(self, subset=None, prepare=True, incremental=False, data : pd.DataFrame | None = None) -> None:
+        """
+        subset: learn only from these (unscaled) rows, e.g. for performance testing. Predictions are still made for all rows.
+        prepare: fetch missing data and prepare it. Otherwise retrain on the data of the current model
+        incremental: keep the scaling of the last run and only scale, learn and re-predict rows that changed since then.
+            Falls back to a full rebuild if the scaling drifted by more than driftThreshold or the last full rebuild is older than fullTrainInterval.
+        data: train on this prepared data instead
+        """
+        previous = self.model
+        if data is None:
+            if prepare:
+                data = await self.prepare_dataframe()
+            elif previous is not None:
+                data = previous.unscaled
+        if data is None:
             return
 
-        if subset is None:
-            learnset = self.fulldata.dropna()
-        else:
-            learnset = subset.dropna()
+        model = await self._run(self.build_model, data, subset, incremental, previous)
+        self.model = model
+        MODEL_ROWS.set(len(model), self.config.COUNTRY_CODE, "total")
+        MODEL_ROWS.set(len(model.trainTimes), self.config.COUNTRY_CODE, "train")
 
-        params = learnset.drop(columns=["price"])
-        output = learnset["price"]
-        linreg = LinearRegression().fit(params, output)
-        param_scaling_factors = linreg.coef_
-        
+    def build_model(self, data : pd.DataFrame, subset : pd.DataFrame | None = None, incremental : bool = False, previous : TrainedModel | None = None) -> TrainedModel:
+        """
+        Synchronous training. Does not modify the predictor or the previous model
+        """
+        if incremental and subset is None and previous is not None and self._can_train_incremental(previous, data):
+            model = self._train_incremental(previous, data)
+            if model is not None:
+                TRAINING_RUNS.inc(self.config.COUNTRY_CODE, "incremental")
+                return model
+
+        # prepared data only has nan in the price column, so these are the rows with known prices
+        learnset = data if subset is None else subset
+        learnset = learnset[learnset["price"].notna()]
+
+        from sklearn.linear_model import LinearRegression
+
+        # To determine the importance of each parameter, we first weight them using linreg, because knn is treating difference in each parameter uniformly
+        with self._stage("linreg"):
+            params = [c for c in learnset.columns if c != "price"]
+            linreg = LinearRegression().fit(learnset[params].to_numpy(dtype=np.float64), learnset["price"].to_numpy(dtype=np.float64))
+            param_scaling_factors = linreg.coef_
+            gram = self._gram(learnset)
+
+        TRAINING_RUNS.inc(self.config.COUNTRY_CODE, "full")
+        return self._train_full(data, learnset if subset is not None else None, param_scaling_factors, gram)
+
+    def _can_train_incremental(self, previous : TrainedModel, data : pd.DataFrame) -> bool:
+        if list(previous.unscaled.columns) != list(data.columns):
+            return False
+        if datetime.datetime.now(datetime.timezone.utc) - previous.lastFullTrain > self.fullTrainInterval:
+            return False
+        # the linreg sums are updated by the changed rows, which requires that the previous model learned from all its known prices
+        return len(previous.trainTimes) == np.count_nonzero(~np.isnan(previous.known))
+
+    def _train_full(self, data : pd.DataFrame, subset : pd.DataFrame | None, scaling : np.ndarray, gram : np.ndarray) -> TrainedModel:
         # Apply same scaling to learning set and full data
-        params *= param_scaling_factors
-        orig_price = self.fulldata["price"]
-        self.fulldata.drop(columns=["price"], inplace=True)
-        self.fulldata *= param_scaling_factors
-        self.fulldata["price"] = orig_price
+        with self._stage("scale"):
+            features = self._features(data, scaling)
+            times = self._epoch(data.index)
+            known = data["price"].to_numpy(dtype=np.float64)
+            if subset is None:
+                isTrain = ~np.isnan(known)
+                trainFeatures, trainTimes, trainPrices = features[isTrain], times[isTrain], known[isTrain]
+            else:
+                trainFeatures = self._features(subset, scaling)
+                trainTimes = self._epoch(subset.index)
+                trainPrices = subset["price"].to_numpy(dtype=np.float64)
+
+        with self._stage("fit"):
+            neighbors = create_backend(self.neighborBackend).fit(trainFeatures)
+        with self._stage("predict"):
+            predictions, neighborTimes, neighborDistance = self._predict_rows(neighbors, trainTimes, trainPrices, features)
+
+        return TrainedModel(data, times, features, self._feature_columns(data), known, scaling, gram, neighbors, trainTimes, trainPrices, predictions,
+                            neighborTimes, neighborDistance, lastFullTrain=datetime.datetime.now(datetime.timezone.utc))
+
+    def _train_incremental(self, previous : TrainedModel, data : pd.DataFrame) -> TrainedModel | None:
+        """
+        Returns None if the scaling drifted by more than driftThreshold, a full retrain is needed then
+        """
+        old = previous.unscaled
+        oldPos = old.index.get_indexer(data.index)
+        kept = oldPos >= 0
+        # the calendar columns only depend on the timestamp
+        compared = [c for c in data.columns if c not in CalendarFeatures.COLUMNS]
+        unchanged = kept & self._equal_rows(old, np.maximum(oldPos, 0), data[compared])
+        changed = ~unchanged
+        isTrain = data["price"].notna().to_numpy()
+
+        # The linreg sums only change by the training rows that are gone or changed, and the new or changed ones.
+        # This keeps the drift check independent of the number of rows, the full linreg only runs on a full retrain
+        with self._stage("linreg"):
+            keptTrain = np.zeros(len(old), dtype=bool)
+            keptTrain[oldPos[unchanged & isTrain]] = True
+            removed = ~np.isnan(previous.known) & ~keptTrain
+            gram = previous.gram - self._gram(old[removed]) + self._gram(data[changed & isTrain])
+            scaling = self._coefficients(gram)
+            drift = np.linalg.norm(scaling - previous.scaling) / max(float(np.linalg.norm(previous.scaling)), 1e-9)
+        if drift > self.driftThreshold:
+            log.info(f"Scaling drifted by {drift:.3f}, doing a full retrain")
+            return None
 
-        # Since all numeric values (wind/solar/temperature) now have the same scaling/relevance to the output variable, we can now just sum them up
-        # Intention: we don't care if we have a lot of production from wind OR from solar
+        # Only scale new and changed rows, the others are taken over from the last run
+        with self._stage("scale"):
+            features = np.empty((len(data), previous.features.shape[1]), dtype=previous.features.dtype)
+            features[unchanged] = previous.features[oldPos[unchanged]]
+            features[changed] = self._features(data[changed], previous.scaling)
+
+        times = self._epoch(data.index)
+        known = data["price"].to_numpy(dtype=np.float64)
+        # the previous model learned from all its known rows (see _can_train_incremental), so these are the training rows that are gone
+        removedTrain = previous.times[removed]
+        addedTrain = changed & isTrain
+
+        predictions = np.empty(len(data))
+        neighborTimes = np.empty((len(data), previous.neighborTimes.shape[1]), dtype=np.int64)
+        neighborDistance = np.empty(len(data))
+        predictions[unchanged] = previous.predictions[oldPos[unchanged]]
+        neighborTimes[unchanged] = previous.neighborTimes[oldPos[unchanged]]
+        neighborDistance[unchanged] = previous.neighborDistance[oldPos[unchanged]]
+
+        # Unchanged rows keep their prediction, unless one of their neighbors is gone or a new training row is closer than their current neighbors
+        with self._stage("update"):
+            affected = changed.copy()
+            affected[unchanged] |= np.isin(neighborTimes[unchanged], removedTrain).any(axis=1)
+            if addedTrain.any() and unchanged.any():
+                nearestAdded = create_backend(self.neighborBackend).fit(features[addedTrain])
+                distance, _ = nearestAdded.kneighbors(features[unchanged], 1)
+                affected[unchanged] |= distance[:, 0] <= neighborDistance[unchanged]
+
+            # Update the neighbor index: drop removed training rows, append the new ones.
+            # Backends replace their arrays on update, so a shallow copy keeps the previous model intact
+            keep = ~np.isin(previous.trainTimes, removedTrain)
+            neighbors = previous.neighbors
+            if not keep.all() or addedTrain.any():
+                neighbors = copy.copy(neighbors)
+                neighbors.update(keep, features[addedTrain])
+            trainTimes = np.concatenate([previous.trainTimes[keep], times[addedTrain]])
+            trainPrices = np.concatenate([previous.trainPrices[keep], known[addedTrain]])
+
+        rows = np.flatnonzero(affected)
+        with self._stage("predict"):
+            predictions[rows], neighborTimes[rows], neighborDistance[rows] = self._predict_rows(neighbors, trainTimes, trainPrices, features[rows])
+        log.info(f"Incremental training: {changed.sum()} of {len(data)} rows changed, {affected.sum()} rows re-predicted")
+
+        return TrainedModel(data, times, features, previous.featureColumns, known, previous.scaling, gram, neighbors, trainTimes, trainPrices, predictions,
+                            neighborTimes, neighborDistance, lastFullTrain=previous.lastFullTrain)
+
+    @staticmethod
+    def _equal_rows(old : pd.DataFrame, oldRows : np.ndarray, new : pd.DataFrame) -> np.ndarray:
+        """
+        For each row of new, whether it equals row oldRows[i] of old in all columns (nan equals nan).
+        Compares column by column, so neither frame is copied as a whole
+        """
+        equal = np.ones(len(new), dtype=bool)
+        for column in new.columns:
+            a, b = old[column].to_numpy()[oldRows], new[column].to_numpy()
+            same = a == b
+            if a.dtype.kind == "f":
+                same |= np.isnan(a) & np.isnan(b)
+            equal &= same
+        return equal
+
+    @staticmethod
+    def _gram(rows : pd.DataFrame) -> np.ndarray:
+        """
+        [X 1]ᵀ [X 1 y] of prepared rows, with X all columns except price and y the price. As a sum over rows, it can be updated
+        by subtracting and adding rows, and gives the linreg coefficients without the rows, see _coefficients
+        """
+        params = [c for c in rows.columns if c != "price"]
+        if len(rows) == 0:
+            return np.zeros((len(params) + 1, len(params) + 2))
+        a = np.empty((len(rows), len(params) + 2))
+        for j, column in enumerate(params):
+            a[:, j] = rows[column].to_numpy()
+        a[:, -2] = 1
+        a[:, -1] = rows["price"].to_numpy()
+        return a[:, :-1].T @ a
+
+    @staticmethod
+    def _coefficients(gram : np.ndarray) -> np.ndarray:
+        """
+        Coefficients of LinearRegression (with intercept, minimum norm solution) from the sums of _gram, up to rounding
+        """
+        count, sumX, sumY = gram[-1, -2], gram[-1, :-2], gram[-1, -1]
+        covX = gram[:-1, :-2] - np.outer(sumX, sumX) / count
+        covXY = gram[:-1, -1] - sumX * sumY / count
+        return np.linalg.pinv(covX, rcond=1e-10, hermitian=True) @ covXY
+
+    def _weather_columns(self) -> List[str]:
         windcols = [f"wind_{i}" for i in range(len(self.config.LATITUDES))]
         irradiancecols = [f"irradiance_{i}" for i in range(len(self.config.LATITUDES))]
         tempcols = [f"temp_{i}" for i in range(len(self.config.LATITUDES))]
-        weathercols = windcols + irradiancecols + tempcols
+        return windcols + irradiancecols + tempcols
+
+    def _feature_columns(self, data : pd.DataFrame) -> List[str]:
+        weathercols = set(self._weather_columns())
+        return [c for c in data.columns if c != "price" and c not in weathercols] + ["weathersum"]
+
+    def _features(self, data : pd.DataFrame, scaling : np.ndarray) -> np.ndarray:
+        """
+        Builds the scaled feature matrix (float32, C-contiguous) directly from the prepared data: all calendar columns times their
+        scaling factor, then weathersum. scaling has one factor per column of data except price, in column order
+        """
+        factors = dict(zip([c for c in data.columns if c != "price"], scaling))
+        featureColumns = self._feature_columns(data)
 
-        params["weathersum"] = params[weathercols].sum(axis=1)
-        params.drop(columns=weathercols, inplace=True)
-        self.fulldata["weathersum"] = self.fulldata[weathercols].sum(axis=1)
-        self.fulldata.drop(columns=weathercols, inplace=True)
+        features = np.empty((len(data), len(featureColumns)), dtype=np.float32)
+        for j, column in enumerate(featureColumns[:-1]):
+            np.multiply(data[column].to_numpy(), factors[column], out=features[:, j], casting="unsafe")
 
-        self.predictor = KNeighborsRegressor(n_neighbors=3).fit(params, output)
+        # Since all numeric values (wind/solar/temperature) now have the same scaling/relevance to the output variable, we can now just sum them up
+        # Intention: we don't care if we have a lot of production from wind OR from solar
+        weathersum = np.zeros(len(data))
+        for column in self._weather_columns():
+            weathersum += data[column].to_numpy(dtype=np.float64) * factors[column]
+        features[:, -1] = weathersum
+        return features
 
-        
+    def _predict_rows(self, neighbors : NeighborBackend, trainTimes : np.ndarray, trainPrices : np.ndarray, features : np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns predictions, neighbor timestamps and distance to the furthest neighbor for the given feature rows.
+        Same as KNeighborsRegressor.predict with uniform weights
+        """
+        if len(features) == 0:
+            return np.empty(0), np.empty((0, self.neighborCount), dtype=np.int64), np.empty(0)
+        distance, idx = neighbors.kneighbors(features, self.neighborCount)
+        return np.mean(trainPrices[idx], axis=1), trainTimes[idx], distance[:, -1]
+
+    @staticmethod
+    def _epoch(index : pd.Index) -> np.ndarray:
+        return cast(pd.DatetimeIndex, index).tz_convert("UTC").tz_localize(None).to_numpy().astype("datetime64[s]").astype(np.int64)
 
     def is_trained(self) -> bool:
-        return self.predictor is not None
+        return self.model is not None
+
+    def state(self) -> Dict:
+        """
+        Fetched data and the current model, for persisting across restarts (see StateStore)
+        """
+        return {"weather": self.weather, "prices": self.prices, "model": self.model, "resolution": self.resolution}
+
+    def restore(self, state : Dict) -> None:
+        if state.get("resolution", "hour") != self.resolution:
+            raise ValueError(f"State has resolution {state.get('resolution', 'hour')}, expected {self.resolution}")
+        self.weather = state["weather"]
+        self.prices = state["prices"]
+        self.model = state["model"]
+        if self.model is not None:
+            MODEL_ROWS.set(len(self.model), self.config.COUNTRY_CODE, "total")
+            MODEL_ROWS.set(len(self.model.trainTimes), self.config.COUNTRY_CODE, "train")
 
     async def predict_raw(self, estimateAll : bool = False) -> pd.DataFrame:
-        if self.predictor is None:
+        if self.model is None:
             await self.train()
-        assert self.fulldata is not None
-        assert self.predictor is not None
+        model = self.model
+        assert model is not None
 
-        predictionDf = self.fulldata.copy()
-        predictionDf["price"] = self.predictor.predict(predictionDf.drop(columns=["price"]))
+        predictionDf = model.fulldata
+        predictionDf["price"] = model.predictions
 
         return predictionDf
 
@@ -177,28 +445,22 @@ class PricePredictor:
         if estimateAll is true, you will get an estimation for the full time range, even if the prices are known already (for performance evaluation).
         if false, you will get known data as is, and only estimations for unknown data
         """
-        assert self.fulldata is not None
+        series = await self.predict_series()
+        return await self._run(series.to_dict, estimateAll)
 
-        predictionDf = await self.predict_raw(estimateAll)
-
-        predDict = self._to_price_dict(predictionDf)
-
-        if not estimateAll:
-            knownDict = self._to_price_dict(self.fulldata)
-            predDict.update(knownDict)
-
-      
-        return predDict
+    async def predict_series(self) -> PriceSeries:
+        """
+        Returns estimations and known prices of the current model side by side
+        """
+        if self.model is None:
+            await self.train()
+        model = self.model
+        assert model is not None
+        return await self._run(self._to_series, model)
 
-    def _to_price_dict(self, df : pd.DataFrame) -> Dict[datetime.datetime, float]:
-        result = {}
-        for time, row in df.iterrows():
-            ts = cast(pd.Timestamp, time).to_pydatetime()
-            price = row["price"]
-            if math.isnan(price):
-                continue
-            result[ts] = row["price"]
-        return result
+    def _to_series(self, model : TrainedModel) -> PriceSeries:
+        with self._stage("series"):
+            return PriceSeries(model.times, model.predictions, model.known)
 
 
     async def prepare_dataframe(self) -> pd.DataFrame | None:
@@ -208,98 +470,145 @@ class PricePredictor:
             await self.refresh_prices()
         assert self.weather is not None
         assert self.prices is not None
-        
-        df = self.weather.copy().dropna()
-        df = pd.concat([df, self.prices], axis=1).reset_index()
-        # allow nan only in price column. All others should be filled with valid data
-        datacols = list(df.columns.values)
-        datacols.remove("price")
-        df = df.dropna(subset=datacols).copy()
-
-        tzlocal = pytz.timezone("Europe/Berlin")
-        holis = holidays.country_holidays(self.config.COUNTRY_CODE)
-        df["holiday"] = df["time"].apply(lambda t: 1 if t.astimezone(tzlocal).weekday() == 6 or t.astimezone(tzlocal).date() in holis else 0)
-        for i in range(6):
-            df[f"day_{i}"] = df["time"].apply(lambda t: 1 if t.astimezone(tzlocal).weekday() == i else 0)
-        #df["saturday"] = df["time"].apply(lambda t: 1 if t.weekday() == 5 else 0)
-        for h in range(0, 24):
-            df[f"h_{h}"] = df["time"].apply(lambda t: 1 if t.astimezone(tzlocal).hour == h else 0)
-        
-        df.set_index("time", inplace=True)
+
+        return await self._run(self._prepare, self.weather, self.prices)
+
+    def _prepare(self, weather : pd.DataFrame, prices : pd.DataFrame) -> pd.DataFrame:
+        with self._stage("prepare"):
+            return self._prepare_frame(weather, prices)
+
+    def _prepare_frame(self, weather : pd.DataFrame, prices : pd.DataFrame) -> pd.DataFrame:
+        # allow nan only in price column. All others should be filled with valid data, so rows without weather are dropped.
+        # float32 is plenty for wind speed, temperature and irradiance and halves the size of the prepared data
+        df = weather.dropna().astype(np.float32)
+        if self.resolution != "hour":
+            df = self._interpolate(df, pd.Timedelta(seconds=RESOLUTIONS[self.resolution]))
+        df["price"] = prices["price"].reindex(df.index).astype(np.float64)
+        df.index.name = "time"
+
+        # holiday/sunday, day_0..5 (monday to saturday) and h_0..23 in local time, as uint8
+        calendar = self.calendar.features(cast(pd.DatetimeIndex, df.index))
+        df = pd.concat([df, calendar], axis=1)
         return df
 
 
-    async def refresh_prices(self) -> None:
+    @staticmethod
+    def _interpolate(weather : pd.DataFrame, step : pd.Timedelta) -> pd.DataFrame:
+        """
+        Hourly weather linearly interpolated to intervals of step, in one vectorized pass over all columns.
+        Only between consecutive hours, so gaps stay gaps. Rows that are not on the hour are kept as they are
+        """
+        index = cast(pd.DatetimeIndex, weather.index)
+        seconds = PricePredictor._epoch(index)
+        stepSeconds = int(step.total_seconds())
+        steps = np.arange(3600 // stepSeconds)
+        values = weather.to_numpy()
+        following = np.concatenate([values[1:], values[-1:]])
+        fractions = (steps / len(steps)).astype(values.dtype)
+        # (hours, steps per hour, columns)
+        interpolated = values[:, None, :] + (following - values)[:, None, :] * fractions[None, :, None]
+        rows = (steps == 0)[None, :] | np.append(np.diff(seconds) == 3600, False)[:, None]
+        times = pd.to_datetime((seconds[:, None] + steps[None, :] * stepSeconds)[rows], unit="s", utc=True)
+        return pd.DataFrame(interpolated[rows], columns=weather.columns, index=pd.DatetimeIndex(times, name=index.name).as_unit(index.unit))
+
+    async def refresh_prices(self) -> bool:
+        """
+        Returns False if the update failed. Previously fetched prices are kept in that case.
+        """
         log.info("Updating prices...")
         try:
-            self.prices = await self.fetch_prices()
+            with self._stage("fetch_prices"):
+                prices = await self.fetch_prices()
+            if prices is None:
+                return False
+            self.prices = prices
             last_price = self.get_last_known_price()
             log.info("Price update done. Prices available until " + last_price[0].isoformat() if last_price is not None else "UNEXPECTED NONE")
+            return True
         except Exception as e:
             log.warning(f"Failed to update prices : {str(e)}")
+            return False
     
-    async def refresh_forecasts(self) -> None:
+    async def refresh_forecasts(self) -> bool:
+        """
+        Returns False if the update failed. The previous forecast is kept in that case.
+        """
         log.info("Updating weather forecast...")
         try:
-            self.weather = await self.fetch_weather()
+            with self._stage("fetch_weather"):
+                weather = await self.fetch_weather()
+            if weather is None:
+                return False
+            self.weather = weather
             log.info("Weather update done")
+            return True
         except Exception as e:
             log.warning(f"Failed to update forecast : {str(e)}")
+            return False
         
     
     async def fetch_weather(self) -> pd.DataFrame | None:
-        cacheFn = f"weather_{self.config.COUNTRY_CODE}.json"
-        if self.testdata and os.path.exists(cacheFn):
-            log.warning("Loading weather from persistent cache!")
-            await asyncio.sleep(0) # simulate async http
-            weather = pd.read_json(cacheFn)
-            weather.index = weather.index.tz_localize("UTC") # type: ignore
-            weather.index.set_names("time", inplace=True)
-            return weather
-
-        lats = ",".join(map(str, self.config.LATITUDES))
-        lons = ",".join(map(str, self.config.LONGITUDES))
-        url = f"https://api.open-meteo.com/v1/forecast?latitude={lats}&longitude={lons}&azimuth=0&tilt=0&past_days={self.learnDays}&forecast_days={self.forecastDays}&hourly=wind_speed_80m,temperature_2m,global_tilted_irradiance&timezone=UTC"
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                data = await resp.text()
-
-                data = json.loads(data)
-                frames = []
-                for i, fc in enumerate(data):
-                    df = pd.DataFrame(columns=["time", f"wind_{i}", f"temp_{i}"]) # type: ignore
-                    times = fc["hourly"]["time"]
-                    winds = fc["hourly"]["wind_speed_80m"]
-                    temps = fc["hourly"]["temperature_2m"]
-                    irradiance = fc["hourly"]["global_tilted_irradiance"]
-                    df["time"] = times
-                    df[f"irradiance_{i}"] = irradiance
-                    df[f"wind_{i}"] = winds
-                    df[f"temp_{i}"] = temps
-                    df.set_index("time", inplace=True)
-                    df.dropna(inplace=True)
-                    frames.append(df)
-
-                df = pd.concat(frames, axis=1).reset_index()
-                df["time"] = pd.to_datetime(df["time"], utc=True)
-                df.set_index("time", inplace=True)
-
-                if self.testdata:
-                    df.to_json(cacheFn)
-                
-                return df
+        historyName = f"weather_{self.config.COUNTRY_CODE}"
+        if self.testdata and self.store is not None:
+            weather = self.store.read_last(historyName, datetime.timedelta(days=self.learnDays + self.forecastDays))
+            if weather is not None:
+                log.warning("Loading weather from persistent history!")
+                await asyncio.sleep(0) # simulate async http
+                return weather
+
+        # Open-Meteo returns whole UTC days, from past_days before today until forecast_days after
+        today = pd.Timestamp.now(tz="UTC").floor("D")
+        windowStart = today - pd.Timedelta(days=self.learnDays)
+        previous = self.weather
+        pastDays = self.learnDays
+        if self._can_fetch_weather_incremental(previous, windowStart, today - pd.Timedelta(days=self.weatherOverlapDays)):
+            pastDays = min(self.weatherOverlapDays, self.learnDays)
+
+        with FETCH_SECONDS.time(self.config.COUNTRY_CODE, "open-meteo"), FETCH_ERRORS.count_exceptions(self.config.COUNTRY_CODE, "open-meteo"):
+            df = await self.weatherFetcher.fetch(Country(self.config.COUNTRY_CODE), pastDays, self.forecastDays)
+
+        if self.store is not None:
+            self.store.append(historyName, df)
+
+        if previous is not None and pastDays < self.learnDays and len(df) > 0:
+            df = self._merge_weather(previous, df, windowStart)
+        return df
+
+    def _can_fetch_weather_incremental(self, previous : pd.DataFrame | None, windowStart : pd.Timestamp, overlapStart : pd.Timestamp) -> bool:
+        """
+        Whether the last weather covers the learning window up to the overlap, so only the overlap and the forecast have to be downloaded
+        """
+        if previous is None or len(previous) == 0 or set(previous.columns) != set(self._weather_columns()):
+            return False
+        return previous.index[0] <= windowStart and previous.index[-1] >= overlapStart
+
+    @staticmethod
+    def _merge_weather(previous : pd.DataFrame, recent : pd.DataFrame, windowStart : pd.Timestamp) -> pd.DataFrame:
+        """
+        Rows of previous from windowStart until the first row of recent, followed by recent.
+        The kept rows are taken over unchanged, so incremental training only sees the downloaded rows that actually differ
+        """
+        settled = previous[(previous.index >= windowStart) & (previous.index < recent.index[0])]
+        merged = pd.concat([settled, recent[previous.columns]])
+        overlap = previous.index.get_indexer(recent.index)
+        kept = overlap >= 0
+        changed = len(recent) - int(kept.sum())
+        if kept.any():
+            old = previous.to_numpy()[overlap[kept]]
+            new = recent[previous.columns].to_numpy()[kept]
+            changed += int((~((old == new) | (np.isnan(old) & np.isnan(new)))).any(axis=1).sum())
+        log.info(f"Weather: kept {len(settled)} settled rows, downloaded {len(recent)}, of which {changed} are new or changed")
+        return merged
 
     async def fetch_prices(self) -> pd.DataFrame | None:
-        cacheFn = f"prices_{self.config.COUNTRY_CODE}.json"
-
-        if self.testdata and os.path.exists(cacheFn):
-            log.warning("Loading prices from persistent cache!")
-            await asyncio.sleep(0) # simulate async http
-            prices = pd.read_json(cacheFn)
-            prices.index = prices.index.tz_localize("UTC") # type: ignore
-            prices.index.set_names("time", inplace=True)
-            return prices
+        historyName = self._price_history_name()
+
+        if self.testdata and self.store is not None:
+            prices = self.store.read_last(historyName, datetime.timedelta(days=self.learnDays + 1))
+            if prices is not None:
+                log.warning("Loading prices from persistent history!")
+                await asyncio.sleep(0) # simulate async http
+                return prices
 
         # Use ENTSO-E for Sweden because SMARD only supports DE and AT
         if self.config.COUNTRY_CODE == 'SE':
@@ -307,75 +616,67 @@ class PricePredictor:
 
         filter = self.config.FILTER # marktpreis
         region = self.config.COUNTRY_CODE 
-        filterCopy = filter
-        regionCopy = region
-        resolution = "hour"
+        resolution = self.resolution
 
-        # Get available timestamps
-        url = f"https://www.smard.de/app/chart_data/{filter}/{region}/index_{resolution}.json"
+        startTs = 1000 * (int(time.time()) - self.learnDays * 24 * 60 * 60)
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                data = await resp.text()
-                timestamps : List[int] = json.loads(data)["timestamps"]
-                timestamps.sort()
+        with FETCH_SECONDS.time(region, "smard"), FETCH_ERRORS.count_exceptions(region, "smard"):
+            data = await self.smard.fetch_prices(self.http, filter, region, resolution, startTs)
 
-            startTs = 1000 * (int(time.time()) - self.learnDays * 24 * 60 * 60)
-        
-            startIndex = len(timestamps) - 1
-            for i, timestamp in enumerate(timestamps):
-                if timestamp > startTs:
-                    startIndex = i - 1
-                    break
-            timestamps = timestamps[startIndex:]
-
-            pricesDict = {}
-
-            for timestamp in timestamps:
-                url = f"https://www.smard.de/app/chart_data/{filter}/{region}/{filterCopy}_{regionCopy}_{resolution}_{timestamp}.json"
-                async with session.get(url) as resp:
-                    data = await resp.text()
-                    series : List = json.loads(data)["series"]
-                    for entry in series:
-                        price = entry[1]
-                        if price is None:
-                            continue
-                        dt = datetime.datetime.fromtimestamp(entry[0] / 1000, tz=pytz.timezone("Europe/Berlin"))
-                        dt = dt.astimezone(pytz.UTC)
-                        pricesDict[dt] = price
-            
-            data = pd.DataFrame.from_dict(pricesDict, orient="index", columns=["price"]).reset_index() # type: ignore
-            data.rename(columns={"index": "time"}, inplace=True)
-            data["time"] = pd.to_datetime(data["time"], utc=True)
-            data["price"] = data["price"] / 10
-            data.set_index("time", inplace=True)
+        if self.store is not None:
+            self.store.append(historyName, data)
 
-            if self.testdata:
-                data.to_json(cacheFn)
+        return data
 
-            return data
+    def _price_history_name(self) -> str:
+        if self.resolution == "hour":
+            return f"prices_{self.config.COUNTRY_CODE}"
+        return f"prices_{self.config.COUNTRY_CODE}_{self.resolution}"
+
+    def _to_resolution(self, prices : pd.DataFrame) -> pd.DataFrame:
+        """
+        Prices of mixed resolutions as prices in self.resolution: finer ones are averaged, hourly ones apply to all intervals of their hour
+        """
+        if len(prices) < 2:
+            return prices
+        step = pd.Timedelta(seconds=RESOLUTIONS[self.resolution])
+        index = cast(pd.DatetimeIndex, prices.index)
+        # a price is valid until the next one, the last one as long as the one before
+        spans = index[1:] - index[:-1]
+        hourly = prices[np.append(spans, spans[-1]) >= pd.Timedelta(hours=1)]
+        repeated = [hourly.set_axis(hourly.index + i * step) for i in range(1, int(pd.Timedelta(hours=1) / step))]
+        if len(repeated) > 0:
+            prices = pd.concat([prices, *repeated])
+            prices = prices[~prices.index.duplicated(keep="first")].sort_index()
+        return prices.resample(step).mean().dropna()
 
     async def fetch_entsoe_prices(self) -> pd.DataFrame | None:
         api_key = os.getenv("ENTSOE_API_KEY")
         if not api_key:
             log.error("ENTSOE_API_KEY environment variable not set. Get your API key from https://transparency.entsoe.eu/")
+            FETCH_ERRORS.inc(self.config.COUNTRY_CODE, "entsoe")
             return None
         
         try:
-            client = EntsoePandasClient(api_key=api_key)
-            
+            if self.entsoe is None:
+                from entsoe import EntsoePandasClient
+                # reuse one client with the shared, pooled session instead of creating a new connection per call
+                self.entsoe = EntsoePandasClient(api_key=api_key, session=self.http.requests_session(), retry_count=1, timeout=int(self.http.timeout))
+            client = self.entsoe
+
             # Calculate the time range
             end = pd.Timestamp.now(tz='Europe/Stockholm')
             start = end - pd.Timedelta(days=self.learnDays)
 
             eic_code = '10Y1001A1001A46L'            
-            prices = await asyncio.get_event_loop().run_in_executor(
-                None,
-                client.query_day_ahead_prices,
-                eic_code,
-                start,
-                end
-            )
+            with FETCH_SECONDS.time(self.config.COUNTRY_CODE, "entsoe"), FETCH_ERRORS.count_exceptions(self.config.COUNTRY_CODE, "entsoe"):
+                prices = await asyncio.get_event_loop().run_in_executor(
+                    None,
+                    client.query_day_ahead_prices,
+                    eic_code,
+                    start,
+                    end
+                )
             
             # Convert from EUR/MWh to ct/kWh
             prices = prices / 10
@@ -383,11 +684,11 @@ class PricePredictor:
             data = pd.DataFrame({'price': prices})
             data.index = pd.to_datetime(data.index, utc=True)
             data.index.name = 'time'
+            # ENTSO-E has hourly prices until 2025-09-30 and 15 minute prices since
+            data = self._to_resolution(data)
             
-            # Cache if in test mode
-            cacheFn = f"prices_{self.config.COUNTRY_CODE}.json"
-            if self.testdata:
-                data.to_json(cacheFn)
+            if self.store is not None:
+                self.store.append(self._price_history_name(), data)
             
             return data
             
@@ -454,6 +755,7 @@ xychart-beta
         k.isoformat(): v for k, v in prices.items()
     }
     print(json.dumps(prices))"""
+    await pred.http.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
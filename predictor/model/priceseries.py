@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+from typing import Any, Dict, Tuple
+import datetime
+import numpy as np
+
+
+class PriceSeries:
+    """
+    Columnar prediction result of a PricePredictor.
+    All arrays share the same length and are ordered by timestamp. Prices are in ct/kWh.
+    - timestamps: int64 unix epoch seconds (UTC)
+    - predicted: model estimation for every timestamp
+    - known: actual price where already published, nan otherwise
+    - merged: known price where available, model estimation otherwise
+    Range queries use binary search on timestamps, so their cost depends on the size of the range, not of the series.
+    """
+    timestamps : np.ndarray
+    predicted : np.ndarray
+    known : np.ndarray
+    merged : np.ndarray
+    lastKnown : Tuple[datetime.datetime, float] | None
+    # ISO 8601 local times of all timestamps by timezone name, see local_times
+    localTimes : Dict[str, np.ndarray]
+
+    def __init__(self, timestamps : np.ndarray, predicted : np.ndarray, known : np.ndarray):
+        order = np.argsort(timestamps, kind="stable")
+        self.timestamps = np.ascontiguousarray(timestamps[order], dtype=np.int64)
+        self.predicted = np.ascontiguousarray(predicted[order], dtype=np.float64)
+        self.known = np.ascontiguousarray(known[order], dtype=np.float64)
+        self.merged = np.where(np.isnan(self.known), self.predicted, self.known)
+        self.localTimes = {}
+        self._find_last_known()
+
+    @classmethod
+    def view(cls, timestamps : np.ndarray, predicted : np.ndarray, known : np.ndarray, merged : np.ndarray) -> "PriceSeries":
+        """
+        Wraps already sorted and merged arrays without copying them, e.g. memory-mapped snapshots
+        """
+        series = cls.__new__(cls)
+        series.timestamps, series.predicted, series.known, series.merged = timestamps, predicted, known, merged
+        series.localTimes = {}
+        series._find_last_known()
+        return series
+
+    def _find_last_known(self) -> None:
+        knownIdx = np.flatnonzero(~np.isnan(self.known))
+        self.lastKnown = None
+        if len(knownIdx) > 0:
+            last = knownIdx[-1]
+            self.lastKnown = datetime.datetime.fromtimestamp(int(self.timestamps[last]), tz=datetime.timezone.utc), float(self.known[last])
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the local times are derived, and recomputed when first needed after loading
+        state = self.__dict__.copy()
+        state.pop("localTimes", None)
+        return state
+
+    def __setstate__(self, state : Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.localTimes = {}
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def span(self, start : float, end : float | None = None) -> slice:
+        """
+        Positions of the timestamps from start to end (both inclusive), or to the last one if end is None
+        """
+        lo = int(np.searchsorted(self.timestamps, start, side="left"))
+        hi = len(self.timestamps) if end is None else int(np.searchsorted(self.timestamps, end, side="right"))
+        return slice(lo, max(lo, hi))
+
+    def local_times(self, timezone : str) -> np.ndarray:
+        """
+        Timestamps as ISO 8601 strings in timezone with UTC offset (as datetime.isoformat()), computed once per series and timezone
+        """
+        localTimes = self.localTimes.get(timezone)
+        if localTimes is None:
+            import pandas as pd
+            utc = pd.DatetimeIndex(self.timestamps.astype("datetime64[s]"), tz="UTC")
+            offsets = (utc.tz_convert(timezone).tz_localize(None) - utc.tz_localize(None)).total_seconds().to_numpy().astype(np.int64)
+            local = (self.timestamps + offsets).astype("datetime64[s]")
+            distinct, inverse = np.unique(offsets, return_inverse=True)
+            suffixes = np.array([f"{'-' if o < 0 else '+'}{abs(o) // 3600:02d}:{abs(o) % 3600 // 60:02d}" for o in distinct.tolist()], dtype=str)
+            localTimes = np.char.add(np.datetime_as_string(local, unit="s"), suffixes[inverse])
+            self.localTimes[timezone] = localTimes
+        return localTimes
+
+    def values(self, estimateAll : bool = False) -> np.ndarray:
+        """
+        if estimateAll is true, returns the model estimation for all timestamps, otherwise known prices take precedence
+        """
+        return self.predicted if estimateAll else self.merged
+
+    def last_known_price(self) -> Tuple[datetime.datetime, float] | None:
+        return self.lastKnown
+
+    def to_dict(self, estimateAll : bool = False) -> Dict[datetime.datetime, float]:
+        """
+        Compatibility adapter for the previous Dict[datetime, float] result format
+        """
+        values = self.values(estimateAll)
+        valid = ~np.isnan(values)
+        return {
+            datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc): price
+            for ts, price in zip(self.timestamps[valid].tolist(), values[valid].tolist())
+        }
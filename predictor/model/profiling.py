@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+
+from typing import Any, Callable, Dict, List
+import contextlib
+import cProfile
+import datetime
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Up to 3.11 cProfile hooks the thread it is enabled in. Since 3.12 it is built on sys.monitoring: one profiler
+# sees all threads, and enabling a second one while it is active raises ValueError
+PER_THREAD_PROFILER = sys.version_info < (3, 12)
+
+
+class ProfileSession:
+    """
+    Profile of one update cycle of a country, attached to a PricePredictor while the cycle runs.
+    Collects
+    - spans: wall and CPU time of the pipeline stages (CPU time is per thread, so it is exact for stages
+      that run in the executor, but includes other tasks for stages on the event loop)
+    - a cProfile of the event loop thread and of every function the predictor runs in its executor.
+      Before 3.12 these are separate profiles, since 3.12 the loop thread's profile covers the executor as well
+    Nothing of this exists unless a session is attached, so the disabled case only costs a None check.
+    """
+    # only one session at a time can profile the event loop thread (since 3.12: profile at all)
+    loopProfileLock = threading.Lock()
+
+    country : str
+    started : datetime.datetime
+    spans : List[Dict[str, Any]]
+    profiles : List[cProfile.Profile]
+
+    def __init__(self, country : str):
+        self.country = country
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        self.spans = []
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name : str):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            span = {
+                "name": name,
+                "thread": threading.current_thread().name,
+                "start": wall,
+                "wallSeconds": time.perf_counter() - wall,
+                "cpuSeconds": time.thread_time() - cpu,
+            }
+            with self.lock:
+                self.spans.append(span)
+
+    def wrap(self, func : Callable) -> Callable:
+        """
+        Returns func, profiled in whatever thread it is called.
+        Since 3.12 func is returned as is: profile_loop already profiles all threads, and a second profiler would fail
+        """
+        if not PER_THREAD_PROFILER:
+            return func
+
+        def profiled(*args):
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(func, *args)
+            finally:
+                with self.lock:
+                    self.profiles.append(profile)
+        return profiled
+
+    @contextlib.contextmanager
+    def profile_loop(self):
+        """
+        Profiles the calling (event loop) thread. Other requests served meanwhile show up in this profile as well
+        """
+        if not self.loopProfileLock.acquire(blocking=False):
+            log.warning(f"Another profile is running, not profiling the event loop for {self.country}")
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # since 3.12, another profiler or debugger outside of this module is active. Keep the spans
+            self.loopProfileLock.release()
+            log.warning(f"Not profiling the event loop for {self.country}: {str(e)}")
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.loopProfileLock.release()
+            with self.lock:
+                self.profiles.append(profile)
+
+    def stats(self) -> pstats.Stats | None:
+        with self.lock:
+            profiles = list(self.profiles)
+        if len(profiles) == 0:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def summary(self, top : int = 30) -> Dict[str, Any]:
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s["start"])
+        first = spans[0]["start"] if len(spans) > 0 else 0
+        result : Dict[str, Any] = {
+            "country": self.country,
+            "started": self.started.isoformat(),
+            "spans": [{**s, "start": s["start"] - first} for s in spans],
+        }
+        stats = self.stats()
+        if stats is not None:
+            out = io.StringIO()
+            stats.stream = out # type: ignore
+            stats.sort_stats("cumulative").print_stats(top)
+            result["topFunctions"] = out.getvalue()
+        return result
+
+    def save(self, directory : str) -> Dict[str, Any]:
+        """
+        Writes <country>_<time>.prof (pstats format, e.g. for snakeviz) and <country>_<time>.json (spans and summary).
+        Returns the summary with the file names
+        """
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"{self.country}_{self.started.strftime('%Y%m%dT%H%M%S')}")
+        summary = self.summary()
+        stats = self.stats()
+        if stats is not None:
+            stats.dump_stats(base + ".prof")
+            summary["profileFile"] = base + ".prof"
+        summary["summaryFile"] = base + ".json"
+        with open(base + ".json", "w") as f:
+            json.dump(summary, f, indent=2)
+        log.info(f"Profile of {self.country} update written to {base}.prof/.json")
+        return summary
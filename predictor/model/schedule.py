@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+
+"""
+When the upstream data changes, so refreshes can be timed to publications instead of polling at fixed intervals.
+All functions take and return timezone-aware datetimes.
+"""
+
+from typing import Tuple
+import datetime
+import pytz
+
+PUBLICATION_TZ = pytz.timezone("Europe/Berlin")
+# Day-ahead auction results (EPEX, Nord Pool) for the next day are published around 12:45 CET, SMARD and ENTSO-E shortly after
+PRICE_PUBLICATION = datetime.time(13, 0)
+# Open-Meteo gets new runs of the main weather models (00, 06, 12, 18 UTC) a few hours after the run
+WEATHER_UPDATE_HOURS_UTC : Tuple[int, ...] = (3, 9, 15, 21)
+# while published data is missing, or after a failed refresh, retry this often
+RETRY = datetime.timedelta(minutes=5)
+
+
+def next_price_refresh(lastUpdate : datetime.datetime, lastKnown : datetime.datetime | None) -> datetime.datetime:
+    """
+    lastUpdate: time of the last successful price refresh
+    lastKnown: start of the last known price after that refresh
+    """
+    if lastKnown is None:
+        return lastUpdate + RETRY
+    local = lastUpdate.astimezone(PUBLICATION_TZ)
+    publication = PUBLICATION_TZ.localize(datetime.datetime.combine(local.date(), PRICE_PUBLICATION))
+    if lastKnown.astimezone(PUBLICATION_TZ).date() > local.date():
+        # the next day is complete, nothing changes until the next auction
+        nextDay = PUBLICATION_TZ.localize(datetime.datetime.combine(local.date() + datetime.timedelta(days=1), PRICE_PUBLICATION))
+        return nextDay.astimezone(datetime.timezone.utc)
+    if local < publication:
+        return publication.astimezone(datetime.timezone.utc)
+    # published, but not available upstream yet
+    return lastUpdate + RETRY
+
+
+def next_weather_refresh(lastUpdate : datetime.datetime) -> datetime.datetime:
+    utc = lastUpdate.astimezone(datetime.timezone.utc)
+    for day in range(2):
+        date = utc.date() + datetime.timedelta(days=day)
+        for hour in WEATHER_UPDATE_HOURS_UTC:
+            candidate = datetime.datetime.combine(date, datetime.time(hour), tzinfo=datetime.timezone.utc)
+            if candidate > utc:
+                return candidate
+    raise AssertionError("WEATHER_UPDATE_HOURS_UTC is empty")
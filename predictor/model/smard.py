@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+import asyncio
+import json
+import logging
+import os
+
+from predictor.model.httpclient import HttpClient
+
+log = logging.getLogger(__name__)
+
+
+class SmardClient:
+    """
+    Downloads price series from SMARD.
+    SMARD publishes one chunk file per week, listed in an index file. All chunks except the newest ones never change,
+    so closed chunks are kept in memory and on disk and are only downloaded once.
+    """
+    # overridable to point at a local stand-in, see predictor.benchmark.upstream
+    BASE_URL = os.getenv("SMARD_BASE_URL", "https://www.smard.de/app/chart_data")
+    OPEN_CHUNKS = 2 # the newest chunks might still receive data and are always downloaded
+
+    cacheDir : str | None
+    maxConcurrency : int
+    closedChunks : Dict[str, np.ndarray]
+
+    def __init__(self, cacheDir : str | None = os.getenv("SMARD_CACHE_DIR", "smard_cache"), maxConcurrency : int = 4):
+        self.cacheDir = cacheDir
+        self.maxConcurrency = maxConcurrency
+        self.closedChunks = {}
+
+    async def fetch_prices(self, http : HttpClient, filter : str, region : str, resolution : str, startTs : int) -> pd.DataFrame:
+        """
+        Returns prices in ct/kWh for all chunks that contain data after startTs (unix ms), indexed by UTC time
+        """
+        url = f"{self.BASE_URL}/{filter}/{region}/index_{resolution}.json"
+        timestamps : List[int] = (await http.get_json(url))["timestamps"]
+        timestamps.sort()
+
+        openChunks = set(timestamps[-self.OPEN_CHUNKS:])
+
+        startIndex = len(timestamps) - 1
+        for i, timestamp in enumerate(timestamps):
+            if timestamp > startTs:
+                startIndex = i - 1
+                break
+        timestamps = timestamps[max(startIndex, 0):]
+
+        semaphore = asyncio.Semaphore(self.maxConcurrency)
+        chunks = await asyncio.gather(*[
+            self._get_chunk(http, semaphore, filter, region, resolution, timestamp, timestamp not in openChunks)
+            for timestamp in timestamps
+        ])
+
+        series = np.concatenate(chunks) if len(chunks) > 0 else np.zeros((0, 2))
+        series = series[~np.isnan(series[:, 1])]
+
+        data = pd.DataFrame(
+            {"price": series[:, 1] / 10},
+            index=pd.DatetimeIndex(pd.to_datetime(series[:, 0].astype(np.int64), unit="ms", utc=True), name="time").as_unit("us")
+        )
+        data = data[~data.index.duplicated(keep="last")].sort_index()
+        return data
+
+    async def _get_chunk(self, http : HttpClient, semaphore : asyncio.Semaphore, filter : str, region : str, resolution : str, timestamp : int, closed : bool) -> np.ndarray:
+        name = f"{filter}_{region}_{resolution}_{timestamp}"
+        if closed:
+            chunk = self._load_closed_chunk(name)
+            if chunk is not None:
+                return chunk
+
+        async with semaphore:
+            url = f"{self.BASE_URL}/{filter}/{region}/{name}.json"
+            data = await http.get_text(url)
+
+        chunk = self._parse_series(json.loads(data)["series"])
+        if closed:
+            self._store_closed_chunk(name, chunk)
+        return chunk
+
+    @staticmethod
+    def _parse_series(series : List) -> np.ndarray:
+        """
+        SMARD series entries are [unix ms, price in EUR/MWh or null]. Returns a (n, 2) float array with nan for missing prices
+        """
+        if len(series) == 0:
+            return np.zeros((0, 2))
+        return np.array(series, dtype=np.float64).reshape(-1, 2)
+
+    def _load_closed_chunk(self, name : str) -> np.ndarray | None:
+        chunk = self.closedChunks.get(name)
+        if chunk is not None or self.cacheDir is None:
+            return chunk
+
+        path = os.path.join(self.cacheDir, f"{name}.npy")
+        if not os.path.exists(path):
+            return None
+        try:
+            chunk = np.load(path)
+        except Exception as e:
+            log.warning(f"Ignoring unreadable SMARD cache file {path}: {str(e)}")
+            return None
+        self.closedChunks[name] = chunk
+        return chunk
+
+    def _store_closed_chunk(self, name : str, chunk : np.ndarray) -> None:
+        self.closedChunks[name] = chunk
+        if self.cacheDir is None:
+            return
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            path = os.path.join(self.cacheDir, f"{name}.npy")
+            tmpPath = f"{path}.{os.getpid()}.tmp"
+            with open(tmpPath, "wb") as f:
+                np.save(f, chunk)
+            os.replace(tmpPath, path)
+        except OSError as e:
+            log.warning(f"Failed to persist SMARD chunk {name}: {str(e)}")
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+
+from typing import Tuple
+import fcntl
+import logging
+import os
+import struct
+import tempfile
+import numpy as np
+
+from predictor.model.priceseries import PriceSeries
+
+log = logging.getLogger(__name__)
+
+
+class SnapshotMeta:
+    version : int # unix time in ns when the snapshot was written, increases across trainer restarts
+    lastPriceUpdate : float # unix time of the trainer's last price/weather update
+    lastWeatherUpdate : float
+
+    def __init__(self, version : int, lastPriceUpdate : float, lastWeatherUpdate : float):
+        self.version = version
+        self.lastPriceUpdate = lastPriceUpdate
+        self.lastWeatherUpdate = lastWeatherUpdate
+
+
+class SnapshotStore:
+    """
+    Shares published predictions between processes: one trainer writes a snapshot file per country,
+    any number of serving processes memory-map it.
+    File layout: 64 byte header (magic, format, version, rows, update times), then the int64 timestamps and the
+    float64 predicted, known and merged prices of a PriceSeries.
+    A new snapshot is written to a temporary file and renamed over the old one, so readers either see the complete
+    old or the complete new file. Mappings of the old file stay valid until the reader drops them.
+    """
+    MAGIC = b"EPXS"
+    FORMAT = 1
+    HEADER = struct.Struct("<4sIqqdd")
+    HEADER_SIZE = 64
+
+    directory : str
+
+    def __init__(self, directory : str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name : str) -> str:
+        return os.path.join(self.directory, f"{name}.snapshot")
+
+    def write(self, name : str, series : PriceSeries, meta : SnapshotMeta) -> None:
+        header = self.HEADER.pack(self.MAGIC, self.FORMAT, meta.version, len(series), meta.lastPriceUpdate, meta.lastWeatherUpdate)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=f".{name}.")
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, "wb") as f:
+                f.write(header.ljust(self.HEADER_SIZE, b"\0"))
+                for array in (series.timestamps, series.predicted, series.known, series.merged):
+                    f.write(np.ascontiguousarray(array).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path(name))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def read_meta(self, name : str) -> SnapshotMeta | None:
+        try:
+            with open(self.path(name), "rb") as f:
+                header = f.read(self.HEADER.size)
+        except FileNotFoundError:
+            return None
+        return self._parse(header)[0]
+
+    def read(self, name : str, newerThan : int = -1) -> Tuple[PriceSeries, SnapshotMeta] | None:
+        """
+        Maps the current snapshot, if there is one with a version > newerThan. The arrays of the returned series are read-only views into the file
+        """
+        # polling reads only the header, the file is mapped once per new version
+        current = self.read_meta(name)
+        if current is None or current.version <= newerThan:
+            return None
+        try:
+            data = np.memmap(self.path(name), dtype=np.uint8, mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+        meta, rows = self._parse(bytes(data[:self.HEADER.size]))
+        if meta is None or meta.version <= newerThan:
+            return None
+        if len(data) != self.HEADER_SIZE + rows * 8 * 4:
+            log.warning(f"Ignoring snapshot {name} of unexpected size")
+            return None
+
+        arrays = []
+        for i, dtype in enumerate((np.int64, np.float64, np.float64, np.float64)):
+            start = self.HEADER_SIZE + i * rows * 8
+            arrays.append(data[start:start + rows * 8].view(dtype))
+        return PriceSeries.view(*arrays), meta
+
+    def _parse(self, header : bytes) -> Tuple[SnapshotMeta | None, int]:
+        if len(header) < self.HEADER.size:
+            return None, 0
+        magic, format, version, rows, lastPriceUpdate, lastWeatherUpdate = self.HEADER.unpack(header)
+        if magic != self.MAGIC or format != self.FORMAT:
+            return None, 0
+        return SnapshotMeta(version, lastPriceUpdate, lastWeatherUpdate), rows
+
+
+class LeaderLock:
+    """
+    Non-blocking exclusive file lock. The process holding it is the trainer. The OS releases it when the process
+    exits, so another process can take over by retrying try_acquire
+    """
+    path : str
+    fd : int | None = None
+
+    def __init__(self, path : str):
+        self.path = path
+
+    @property
+    def held(self) -> bool:
+        return self.fd is not None
+
+    def try_acquire(self) -> bool:
+        if self.fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.fd = fd
+        return True
+
+    def release(self) -> None:
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
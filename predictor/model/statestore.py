@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+
+from typing import Any, Dict
+import logging
+import os
+import pickle
+import tempfile
+
+log = logging.getLogger(__name__)
+
+
+class StateStore:
+    """
+    Persists the last trained state of each country (fetched data, trained model, published prices, update times),
+    so a restarted process can serve immediately instead of fetching and training first.
+    One pickle file per country, replaced atomically. Files of another format or that fail to load are ignored,
+    the process then starts cold as without a store.
+    """
+    # increase whenever the pickled classes change incompatibly
+    FORMAT = 3
+
+    directory : str
+
+    def __init__(self, directory : str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name : str) -> str:
+        return os.path.join(self.directory, f"{name}.state")
+
+    def save(self, name : str, state : Dict[str, Any]) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=f".{name}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump({"format": self.FORMAT, "state": state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path(name))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def load(self, name : str) -> Dict[str, Any] | None:
+        try:
+            with open(self.path(name), "rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning(f"Ignoring unreadable state {name}: {str(e)}")
+            return None
+        if not isinstance(data, dict) or data.get("format") != self.FORMAT:
+            log.warning(f"Ignoring state {name} of another format")
+            return None
+        return data["state"]
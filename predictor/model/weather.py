@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+import asyncio
+import logging
+import os
+import time
+
+from predictor.model.countries import COUNTRY_CONFIG, Country
+from predictor.model.httpclient import HttpClient
+
+log = logging.getLogger(__name__)
+
+
+class WeatherFetcher:
+    """
+    Downloads Open-Meteo weather for the sample points of all registered countries together.
+    A refresh of one country requests the points of all countries without a fresh result in as few requests as possible
+    (at most maxLocations points each), and parses the responses into one array of which every country gets its column slice.
+    The results of the other countries are kept for maxAge, so their own refreshes shortly after do not download again.
+    """
+    # overridable to point at a local stand-in, see predictor.benchmark.upstream
+    BASE_URL = os.getenv("OPEN_METEO_BASE_URL", "https://api.open-meteo.com/v1/forecast")
+    # Open-Meteo variable and column prefix, in the column order of the returned frames
+    VARIABLES = [("wind_speed_80m", "wind"), ("temperature_2m", "temp"), ("global_tilted_irradiance", "irradiance")]
+
+    http : HttpClient
+    maxLocations : int
+    maxAge : float
+    countries : List[Country]
+    # prefetched weather per country: monotonic fetch time, past days, forecast days, frame
+    results : Dict[Country, Tuple[float, int, int, pd.DataFrame]]
+    # running downloads: task, countries (the first one started it), past days, forecast days
+    pending : List[Tuple[asyncio.Future, List[Country], int, int]]
+
+    def __init__(self, http : HttpClient, maxLocations : int = 100, maxAge : float = 600):
+        self.http = http
+        self.maxLocations = maxLocations
+        self.maxAge = maxAge
+        self.countries = []
+        self.results = {}
+        self.pending = []
+
+    def register(self, country : Country) -> None:
+        """
+        Includes the sample points of country in all following downloads
+        """
+        if country not in self.countries:
+            self.countries.append(country)
+
+    async def fetch(self, country : Country, pastDays : int, forecastDays : int) -> pd.DataFrame:
+        """
+        Hourly weather of country from pastDays before today until forecastDays after (whole UTC days), indexed by UTC time.
+        One wind_i, temp_i and irradiance_i column per sample point. Might cover more past days if prefetched for a longer window
+        """
+        self.register(country)
+        for task, countries, past, forecast in list(self.pending):
+            if country in countries[1:] and past >= pastDays and forecast == forecastDays:
+                await asyncio.shield(task)
+                break
+
+        weather = self._prefetched(country, pastDays, forecastDays)
+        if weather is not None:
+            return weather
+
+        batch = [country] + [c for c in self.countries if c != country and self._prefetched(c, pastDays, forecastDays, keep=True) is None]
+        entry = (asyncio.ensure_future(self._fetch_batch(batch, pastDays, forecastDays)), batch, pastDays, forecastDays)
+        self.pending.append(entry)
+        try:
+            frames = await asyncio.shield(entry[0])
+        finally:
+            if entry in self.pending:
+                self.pending.remove(entry)
+        return frames[country]
+
+    def _prefetched(self, country : Country, pastDays : int, forecastDays : int, keep : bool = False) -> pd.DataFrame | None:
+        """
+        A fresh result covering the requested days. It is handed out once, unless keep is set
+        """
+        result = self.results.get(country)
+        if result is None:
+            return None
+        fetched, past, forecast, weather = result
+        if time.monotonic() - fetched > self.maxAge or past < pastDays or forecast != forecastDays:
+            return None
+        if not keep:
+            del self.results[country]
+        return weather
+
+    async def _fetch_batch(self, countries : List[Country], pastDays : int, forecastDays : int) -> Dict[Country, pd.DataFrame]:
+        """
+        Downloads countries together. The result of the first is returned, the others are kept for their next fetch
+        """
+        locations = [(lat, lon) for c in countries for lat, lon in zip(COUNTRY_CONFIG[c].LATITUDES, COUNTRY_CONFIG[c].LONGITUDES)]
+        chunks = [locations[i:i + self.maxLocations] for i in range(0, len(locations), self.maxLocations)]
+        responses = await asyncio.gather(*[self.http.get_json(self._url(chunk, pastDays, forecastDays)) for chunk in chunks])
+        # Open-Meteo answers with a list for several locations, but with a single object for one
+        forecasts = [fc for response in responses for fc in (response if isinstance(response, list) else [response])]
+        if len(forecasts) != len(locations):
+            raise ValueError(f"Open-Meteo returned {len(forecasts)} forecasts for {len(locations)} locations")
+
+        times, block = self._parse(forecasts)
+        fetched = time.monotonic()
+        frames = {}
+        start = 0
+        for country in countries:
+            count = len(COUNTRY_CONFIG[country].LATITUDES)
+            frames[country] = self._country_frame(times, block[:, 3 * start:3 * (start + count)])
+            if country != countries[0]:
+                self.results[country] = (fetched, pastDays, forecastDays, frames[country])
+            start += count
+        log.info(f"Downloaded weather of {len(countries)} countries, {len(locations)} locations in {len(chunks)} requests")
+        return frames
+
+    def _url(self, locations : List[Tuple[float, float]], pastDays : int, forecastDays : int) -> str:
+        lats = ",".join(str(lat) for lat, _ in locations)
+        lons = ",".join(str(lon) for _, lon in locations)
+        variables = ",".join(v for v, _ in self.VARIABLES)
+        return f"{self.BASE_URL}?latitude={lats}&longitude={lons}&azimuth=0&tilt=0&past_days={pastDays}&forecast_days={forecastDays}&hourly={variables}&timezone=UTC"
+
+    def _parse(self, forecasts : List[Dict]) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+        """
+        All forecasts of one download share the time axis. Returns it and a (times, 3 * locations) array,
+        with the columns of location i at 3*i .. 3*i+2 in the order of VARIABLES
+        """
+        timeStrings = forecasts[0]["hourly"]["time"]
+        block = np.empty((len(timeStrings), 3 * len(forecasts)), dtype=np.float64)
+        for i, fc in enumerate(forecasts):
+            hourly = fc["hourly"]
+            if len(hourly["time"]) != len(timeStrings) or hourly["time"][0] != timeStrings[0]:
+                raise ValueError("Open-Meteo returned different time ranges for one request")
+            for j, (variable, _) in enumerate(self.VARIABLES):
+                # missing values are null, which numpy converts to nan
+                block[:, 3 * i + j] = np.array(hourly[variable], dtype=np.float64)
+
+        # an hour with a missing value is dropped for the whole location
+        perLocation = block.reshape(len(timeStrings), len(forecasts), 3)
+        perLocation[np.isnan(perLocation).any(axis=2)] = np.nan
+        times = pd.DatetimeIndex(pd.to_datetime(timeStrings, utc=True), name="time")
+        return times, block
+
+    def _country_frame(self, times : pd.DatetimeIndex, columns : np.ndarray) -> pd.DataFrame:
+        count = columns.shape[1] // 3
+        names = [f"{prefix}_{i}" for i in range(count) for _, prefix in self.VARIABLES]
+        # hours without data for any location of the country are dropped
+        rows = ~np.isnan(columns).all(axis=1)
+        return pd.DataFrame(columns[rows], index=times[rows], columns=names)
@@ -0,0 +1,104 @@
+import datetime
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from predictor.model.historystore import HistoryStore
+
+
+def frame(start : str, hours : int, value : float = 0.0) -> pd.DataFrame:
+    index = pd.date_range(pd.Timestamp(start, tz="UTC"), periods=hours, freq="60min", name="time").as_unit("us")
+    return pd.DataFrame({"a": value + np.arange(hours, dtype=np.float64), "b": np.full(hours, value)}, index=index)
+
+
+def assert_rows(actual : pd.DataFrame | None, expected : pd.DataFrame):
+    assert actual is not None
+    pd.testing.assert_frame_equal(actual, expected, check_freq=False)
+
+
+def utc(text : str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(text).replace(tzinfo=datetime.timezone.utc)
+
+
+def test_append_and_read_ranges(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    assert store.read("prices") is None and store.time_range("prices") is None
+    store.append("prices", frame("2025-01-01", 48))
+    store.append("prices", frame("2025-01-03", 24, 100.0))
+    expected = pd.concat([frame("2025-01-01", 48), frame("2025-01-03", 24, 100.0)])
+
+    assert_rows(store.read("prices"), expected)
+    assert store.time_range("prices") == (utc("2025-01-01"), utc("2025-01-03 23:00"))
+    # start inclusive, end exclusive, and ranges outside of the stored rows
+    assert_rows(store.read("prices", utc("2025-01-02 22:00"), utc("2025-01-03 02:00")), expected.iloc[46:50])
+    assert_rows(store.read("prices", utc("2025-02-01")), expected.iloc[:0])
+    assert_rows(store.read("prices", end=utc("2024-12-01")), expected.iloc[:0])
+    assert_rows(store.read("prices", utc("2025-01-03"), utc("2025-01-02")), expected.iloc[:0])
+    assert_rows(store.read_last("prices", datetime.timedelta(hours=2)), expected.iloc[-3:])
+
+
+def test_overlapping_append_rewrites_the_tail(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("weather", frame("2025-01-01", 72))
+    # the forecast of the last day and a half changed, and one more day was added
+    store.append("weather", frame("2025-01-02 12:00", 60, 500.0))
+    expected = pd.concat([frame("2025-01-01", 36), frame("2025-01-02 12:00", 60, 500.0)])
+    assert_rows(store.read("weather"), expected)
+
+    # unchanged rows do not cause a rewrite
+    meta = json.loads((tmp_path / "weather" / "meta.json").read_text())
+    store.append("weather", frame("2025-01-02 12:00", 12, 500.0))
+    assert json.loads((tmp_path / "weather" / "meta.json").read_text()) == meta
+
+    # replacing rows in the middle keeps the stored rows around them, and the previous generation is removed
+    store.append("weather", frame("2025-01-02", 2, -1.0))
+    expected.iloc[24:26] = frame("2025-01-02", 2, -1.0).to_numpy()
+    assert_rows(store.read("weather"), expected)
+    assert sorted(os.listdir(tmp_path / "weather")) == ["meta.json", f"time.{meta['generation'] + 1}.bin", f"values.{meta['generation'] + 1}.bin"]
+
+
+def test_interrupted_writes_keep_the_previous_rows(tmp_path, monkeypatch):
+    store = HistoryStore(str(tmp_path))
+    store.append("prices", frame("2025-01-01", 48))
+    before = store.read("prices")
+    assert before is not None
+
+    def crash(*args):
+        raise OSError("disk full")
+
+    # the data files are written, but meta.json is not updated
+    monkeypatch.setattr(store, "_write_meta", crash)
+    for df in [frame("2025-01-03", 24, 100.0), frame("2025-01-01 12:00", 48, 100.0)]:
+        try:
+            store.append("prices", df)
+        except OSError:
+            pass
+        assert_rows(HistoryStore(str(tmp_path)).read("prices"), before)
+
+    monkeypatch.undo()
+    store.append("prices", frame("2025-01-03", 24, 100.0))
+    assert_rows(store.read("prices"), pd.concat([before, frame("2025-01-03", 24, 100.0)]))
+
+
+def test_columns_change_starts_a_new_history(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("prices", frame("2025-01-01", 24))
+    store.append("prices", frame("2025-01-02", 24).rename(columns={"b": "c"}))
+    assert store.columns("prices") == ["a", "c"]
+    assert_rows(store.read("prices"), frame("2025-01-02", 24).rename(columns={"b": "c"}))
+
+
+def test_reads_stores_without_row_count(tmp_path):
+    # meta.json of earlier versions only had the columns, and an interrupted append could leave values without times
+    directory = tmp_path / "prices"
+    directory.mkdir()
+    (directory / "meta.json").write_text(json.dumps({"columns": ["a", "b"]}))
+    df = frame("2025-01-01", 24)
+    (directory / "time.bin").write_bytes(HistoryStore._to_epoch(pd.DatetimeIndex(df.index))[:20].tobytes())
+    (directory / "values.bin").write_bytes(df.to_numpy().tobytes())
+
+    store = HistoryStore(str(tmp_path))
+    assert_rows(store.read("prices"), df.iloc[:20])
+    store.append("prices", frame("2025-01-02", 24, 100.0))
+    assert_rows(store.read("prices"), pd.concat([df.iloc[:20], frame("2025-01-02", 24, 100.0)]))
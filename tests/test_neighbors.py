@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from predictor.model.neighbors import NEIGHBOR_BACKENDS, create_backend
+
+
+def features(rows : int, seed : int = 0, decimals : int | None = None) -> np.ndarray:
+    """
+    Like the predictor's matrix: scaled one-hot calendar columns, then the continuous weathersum
+    """
+    rng = np.random.default_rng(seed)
+    hours = rng.integers(0, 4, rows)
+    weekend = rng.integers(0, 2, rows)
+    calendar = np.concatenate([np.eye(4)[hours] * 3.0, weekend[:, None] * 2.0], axis=1)
+    values = rng.normal(0, 5, rows)
+    if decimals is not None:
+        values = np.round(values, decimals)
+    return np.concatenate([calendar, values[:, None]], axis=1)
+
+
+@pytest.mark.parametrize("backend", list(NEIGHBOR_BACKENDS))
+def test_same_neighbours_as_sklearn(backend):
+    X, Q = features(500, seed=1), features(50, seed=2)
+    expectedDist, expectedIdx = create_backend("sklearn").fit(X).kneighbors(Q, 7)
+    dist, idx = create_backend(backend).fit(X).kneighbors(Q, 7)
+    np.testing.assert_allclose(dist, expectedDist, rtol=1e-12, atol=1e-12)
+    np.testing.assert_array_equal(idx, expectedIdx)
+
+
+@pytest.mark.parametrize("backend", list(NEIGHBOR_BACKENDS))
+def test_ties_give_the_same_distances(backend):
+    # few distinct values: many rows at the same distance. Which of them are returned may differ from sklearn
+    X, Q = features(300, seed=3, decimals=0), features(40, seed=4, decimals=0)
+    expectedDist, _ = create_backend("sklearn").fit(X).kneighbors(Q, 5)
+    dist, idx = create_backend(backend).fit(X).kneighbors(Q, 5)
+    np.testing.assert_allclose(dist, expectedDist, rtol=1e-12, atol=1e-12)
+    # every returned row is a distinct row at the reported distance
+    np.testing.assert_allclose(np.linalg.norm(X[idx] - Q[:, None, :], axis=2), dist, rtol=1e-12, atol=1e-12)
+    assert all(len(set(row)) == len(row) for row in idx.tolist())
+
+
+@pytest.mark.parametrize("backend", list(NEIGHBOR_BACKENDS))
+def test_more_neighbours_than_rows(backend):
+    nn = create_backend(backend).fit(features(3))
+    with pytest.raises(ValueError):
+        nn.kneighbors(features(2, seed=1), 4)
+
+
+@pytest.mark.parametrize("backend", list(NEIGHBOR_BACKENDS))
+def test_empty_fit(backend):
+    with pytest.raises(ValueError):
+        create_backend(backend).fit(features(0))
@@ -0,0 +1,24 @@
+import pandas as pd
+import pytest
+
+from predictor.model.performance_testing import walk_forward_cutoffs
+
+
+@pytest.mark.parametrize("end,freq", [
+    ("2025-03-10 00:00", "60min"), # ends with the first hour of a day
+    ("2025-03-10 23:00", "60min"), # ends with a complete day
+    ("2025-03-10 23:45", "15min"),
+    ("2025-03-30 23:00", "60min"), # DST change, a day of 23 hours
+])
+def test_walk_forward_cutoffs_have_a_full_day_after_them(end, freq):
+    index = pd.date_range(end=pd.Timestamp(end, tz="Europe/Berlin"), periods=20 * 24 * 4, freq=freq).tz_convert("UTC")
+    df = pd.DataFrame({"price": 1.0}, index=index)
+    cutoffs = walk_forward_cutoffs(df, 5)
+    assert len(cutoffs) == 5
+    times = pd.to_datetime(cutoffs, unit="s", utc=True).tz_convert("Europe/Berlin")
+    assert all(t.hour == 0 and t.minute == 0 for t in times)
+    # the newest cutoff starts the last day with prices for all of its hours
+    last = times[-1]
+    dayEnd = (last + pd.Timedelta(hours=25)).normalize()
+    assert index[-1] >= dayEnd - pd.Timedelta(freq)
+    assert (index[-1] - last) < pd.Timedelta(days=2)
@@ -0,0 +1,286 @@
+import asyncio
+import datetime
+import json
+import os
+import itertools
+import threading
+import time
+import numpy as np
+import pytest
+import pytz
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from predictor.api import priceapi
+from predictor.api.priceapi import BatchFormat, PriceUnit, Prices, TariffModel
+from predictor.model import schedule
+from predictor.model.countries import Country
+from predictor.model.priceseries import PriceSeries
+from predictor.model.snapshots import SnapshotMeta, SnapshotStore
+
+START = pytz.timezone("Europe/Berlin").localize(datetime.datetime(2025, 3, 1))
+
+
+def series(hours : int = 240, seed : int = 1) -> PriceSeries:
+    rng = np.random.default_rng(seed)
+    timestamps = int(START.timestamp()) + 3600 * np.arange(hours, dtype=np.int64)
+    predicted = np.round(rng.normal(10, 6, hours), 3)
+    known = np.where(np.arange(hours) < hours // 2, np.round(rng.normal(10, 6, hours), 3), np.nan)
+    return PriceSeries(timestamps, predicted, known)
+
+
+def test_batch_matches_prices():
+    handler = Prices()
+    countryPrices = handler.get(Country.DE)
+    countryPrices.publish(series())
+
+    tariffs = [TariffModel(country=Country.DE, fixedPrice=fixedPrice, taxPercent=taxPercent, unit=unit, startTs=START, hours=hours)
+               for fixedPrice, taxPercent, unit, hours in itertools.product([0.0, 10.5, 13.15, 17.9], [0.0, 19.0, 20.0], list(PriceUnit), [-1, 48])]
+    batch = json.loads(asyncio.run(handler.batch(tariffs, BatchFormat.ROWS)))["results"]
+
+    for tariff, result in zip(tariffs, batch):
+        single = json.loads(countryPrices.encode_prices(countryPrices.cachedprices, tariff.hours, tariff.fixedPrice, tariff.taxPercent,
+                                                        START, tariff.unit, False))
+        assert result == single, f"{tariff.unit.value} fixedPrice={tariff.fixedPrice} taxPercent={tariff.taxPercent}"
+
+
+def test_totals_round_like_round():
+    # np.round would give 2.6756 and 10.1234
+    assert PriceUnit.CT_PER_KWH.totals(np.array([2.67565, 10.12345]), 0.0, 0.0).tolist() == [2.6757, 10.1235]
+
+    values = np.round(np.random.default_rng(3).normal(10, 6, 5000), 3)
+    for unit, fixedPrice, taxPercent in itertools.product(list(PriceUnit), [0.0, 13.15], [0.0, 19.0]):
+        expected = [round(unit.convert((value + fixedPrice) * (1 + taxPercent / 100.0)), 4) for value in values.tolist()]
+        assert unit.totals(values, fixedPrice, taxPercent).tolist() == expected
+
+
+def test_force_update_is_single_flight():
+    countryPrices = Prices().get(Country.AT)
+    running = 0
+    started = []
+
+    async def update(country : str, force : bool = False):
+        nonlocal running
+        running += 1
+        started.append(force)
+        assert running == 1, "updates of one country overlap"
+        await asyncio.sleep(0.05)
+        running -= 1
+
+    countryPrices._update = update
+
+    async def main():
+        scheduled = countryPrices.start_update()
+        await asyncio.gather(*[countryPrices.force_update() for _ in range(3)], scheduled)
+        # a scheduled update requested while the forced one runs joins it
+        forced = asyncio.ensure_future(countryPrices.force_update())
+        await asyncio.sleep(0.01)
+        await asyncio.gather(forced, countryPrices.start_update())
+
+    asyncio.run(main())
+    # the scheduled update, one forced update shared by the three concurrent calls, then the last forced one
+    assert started == [False, True, True]
+
+
+def test_follower_waits_for_first_snapshot(tmp_path, monkeypatch):
+    store = SnapshotStore(str(tmp_path))
+    monkeypatch.setattr(priceapi, "snapshotStore", store)
+    monkeypatch.setattr(priceapi, "SNAPSHOT_WAIT_SECONDS", 0.2)
+    countryPrices = Prices().get(Country.DE)
+    countryPrices.trainer = False
+
+    # no snapshot yet: 503 instead of an empty price list
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(countryPrices.prices_response(startTs=START))
+    assert e.value.status_code == 503 and "Retry-After" in (e.value.headers or {})
+
+    # the trainer's first snapshot arrives while the request waits
+    monkeypatch.setattr(priceapi, "SNAPSHOT_WAIT_SECONDS", 5)
+    async def main():
+        async def write():
+            await asyncio.sleep(0.1)
+            store.write("DE", series(), SnapshotMeta(1, 0.0, 0.0))
+        response, _ = await asyncio.gather(countryPrices.prices_response(startTs=START), write())
+        return json.loads(response.body)
+    assert len(asyncio.run(main())["prices"]) > 0
+
+
+def test_trainer_writes_snapshots_off_the_event_loop(tmp_path, monkeypatch):
+
+    store = SnapshotStore(str(tmp_path))
+    monkeypatch.setattr(priceapi, "snapshotStore", store)
+    countryPrices = Prices().get(Country.DE)
+    countryPrices.trainer = True
+    threads = []
+    write = store.write
+    def slow_write(*args):
+        threads.append(threading.current_thread())
+        time.sleep(0.1)
+        write(*args)
+    monkeypatch.setattr(store, "write", slow_write)
+
+    async def main():
+        start = time.perf_counter()
+        countryPrices.publish(series(seed=1))
+        countryPrices.publish(series(seed=2))
+        assert time.perf_counter() - start < 0.05
+        assert countryPrices.snapshotWrite is not None
+        await countryPrices.snapshotWrite
+
+    asyncio.run(main())
+    assert threading.main_thread() not in threads and len(threads) == 2
+    # written in publish order: the snapshot is the last published series
+    snapshot = store.read("DE")
+    assert snapshot is not None and np.array_equal(snapshot[0].predicted, series(seed=2).predicted)
+
+
+def test_failed_update_is_logged_and_retried(monkeypatch, caplog):
+    countryPrices = Prices().get(Country.AT)
+    predictor = countryPrices.predictor
+
+    async def refreshed():
+        return True
+
+    failing = True
+
+    async def train(incremental : bool = False):
+        if failing:
+            raise RuntimeError("training failed")
+
+    async def predict_series():
+        return series()
+
+    monkeypatch.setattr(predictor, "refresh_prices", refreshed)
+    monkeypatch.setattr(predictor, "refresh_forecasts", refreshed)
+    monkeypatch.setattr(predictor, "get_last_known_price", lambda: None)
+    monkeypatch.setattr(predictor, "train", train)
+    monkeypatch.setattr(predictor, "predict_series", predict_series)
+
+    async def update():
+        task = countryPrices.start_update()
+        await asyncio.wait([task])
+
+    asyncio.run(update())
+    # the fetches succeeded, but nothing was published: retry soon instead of waiting for the next publication
+    retry = datetime.datetime.now().astimezone() + schedule.RETRY
+    assert countryPrices.cachedprices is None
+    assert countryPrices.next_refresh() <= retry
+    assert "Update for AT failed" in caplog.text and "training failed" in caplog.text
+
+    failing = False
+    asyncio.run(countryPrices.force_update())
+    assert countryPrices.cachedprices is not None
+    assert countryPrices.next_refresh() > retry
+
+
+def test_profiled_update_with_executor_stages(tmp_path, monkeypatch):
+    monkeypatch.setattr(priceapi, "PROFILE_DIR", str(tmp_path))
+    countryPrices = Prices().get(Country.SE)
+    predictor = countryPrices.predictor
+
+    def fit_model():
+        return sum(i * i for i in range(10000))
+
+    async def refreshed():
+        return True
+
+    async def train(incremental : bool = False):
+        # like the real stages: timed on the loop, run in the executor, two of them at the same time
+        with predictor._stage("fit"):
+            await asyncio.gather(predictor._run(fit_model), predictor._run(fit_model))
+
+    async def predict_series():
+        return series()
+
+    monkeypatch.setattr(predictor, "refresh_prices", refreshed)
+    monkeypatch.setattr(predictor, "refresh_forecasts", refreshed)
+    monkeypatch.setattr(predictor, "get_last_known_price", lambda: None)
+    monkeypatch.setattr(predictor, "train", train)
+    monkeypatch.setattr(predictor, "predict_series", predict_series)
+
+    summary = asyncio.run(countryPrices.profile_update())
+    assert summary is not None
+    assert countryPrices.cachedprices is not None
+    assert [span["name"] for span in summary["spans"]] == ["update", "fit"]
+    assert "fit_model" in summary["topFunctions"]
+    assert os.path.exists(summary["profileFile"])
+
+
+def test_prices_etag_and_cache_invalidation(monkeypatch):
+    handler = Prices()
+    monkeypatch.setattr(priceapi, "pricesHandler", handler)
+    countryPrices = handler.get(Country.DE)
+    countryPrices.publish(series())
+    client = TestClient(priceapi.app)
+    params = {"startTs": START.isoformat(), "hours": 48, "fixedPrice": 12.5}
+
+    first = client.get("/prices", params=params)
+    assert first.status_code == 200 and "ETag" in first.headers
+    assert len(countryPrices.responseCache) == 1
+    notModified = client.get("/prices", params=params, headers={"If-None-Match": first.headers["ETag"]})
+    assert notModified.status_code == 304 and notModified.content == b""
+    assert notModified.headers["ETag"] == first.headers["ETag"]
+
+    # a new prediction replaces the cache, so the old ETag no longer matches
+    cache = countryPrices.responseCache
+    countryPrices.publish(series(seed=2))
+    assert countryPrices.responseCache is not cache and len(countryPrices.responseCache) == 0
+    changed = client.get("/prices", params=params, headers={"If-None-Match": first.headers["ETag"]})
+    assert changed.status_code == 200 and changed.headers["ETag"] != first.headers["ETag"]
+    assert changed.json() != first.json()
+
+
+def test_prices_model_matches_encoded_response():
+    countryPrices = Prices().get(Country.DE)
+    countryPrices.publish(series())
+    model = asyncio.run(countryPrices.prices(hours=48, startTs=START, fixedPrice=10.5, taxPercent=19.0))
+    assert all(isinstance(price.startsAt, datetime.datetime) for price in model.prices)
+    encoded = countryPrices.encode_prices(countryPrices.cachedprices, 48, 10.5, 19.0, START, PriceUnit.CT_PER_KWH, False)
+    assert json.loads(model.model_dump_json()) == json.loads(encoded)
+
+
+def test_stream_sends_snapshot_then_changed_hours():
+    countryPrices = Prices().get(Country.DE)
+    now = int(datetime.datetime.now().timestamp()) // 3600 * 3600
+    timestamps = now - 24 * 3600 + 3600 * np.arange(72, dtype=np.int64)
+    predicted = np.round(np.random.default_rng(5).normal(10, 6, 72), 3)
+    known = np.where(np.arange(72) < 36, predicted + 1, np.nan)
+    countryPrices.publish(PriceSeries(timestamps, predicted, known))
+
+    def parse(event : str):
+        lines = event.strip().split("\n")
+        return lines[0].removeprefix("event: "), json.loads(lines[1].removeprefix("data: "))
+
+    # two predicted hours change, one more price is published
+    changedPredicted = predicted.copy()
+    changedPredicted[[50, 60]] += 1.0
+    changedKnown = known.copy()
+    changedKnown[36] = predicted[36]
+
+    async def main():
+        stream = countryPrices.stream(fixedPrice=10.0)
+        assert (await anext(stream)).startswith("retry:")
+        snapshot = parse(await anext(stream))
+        countryPrices.publish(PriceSeries(timestamps, changedPredicted, changedKnown))
+        update = parse(await anext(stream))
+        await stream.aclose()
+        return snapshot, update
+
+    (snapshotEvent, snapshot), (updateEvent, update) = asyncio.run(main())
+    assert snapshotEvent == "snapshot" and len(snapshot["prices"]) == 48
+    assert snapshot["prices"][0]["startsAt"] == datetime.datetime.fromtimestamp(now, pytz.timezone("Europe/Berlin")).isoformat()
+    assert updateEvent == "update"
+    assert [p["startsAt"] for p in update["prices"]] == [snapshot["prices"][i - 24]["startsAt"] for i in (50, 60)]
+    assert [p["total"] for p in update["prices"]] == [round(total, 4) for total in (changedPredicted[[50, 60]] + 10.0).tolist()]
+    assert update["knownUntil"] != snapshot["knownUntil"]
+    assert len(countryPrices.subscribers) == 0
+
+
+def test_stream_answers_503_before_starting(tmp_path, monkeypatch):
+    handler = Prices()
+    monkeypatch.setattr(priceapi, "pricesHandler", handler)
+    monkeypatch.setattr(priceapi, "snapshotStore", SnapshotStore(str(tmp_path)))
+    monkeypatch.setattr(priceapi, "SNAPSHOT_WAIT_SECONDS", 0.1)
+    handler.get(Country.DE).trainer = False
+    response = TestClient(priceapi.app).get("/prices/stream")
+    assert response.status_code == 503 and "Retry-After" in response.headers
@@ -0,0 +1,209 @@
+import asyncio
+from typing import List
+import numpy as np
+import pandas as pd
+import pytest
+
+from predictor.benchmark import synthetic
+from predictor.model.countries import Country
+from predictor.model.httpclient import HttpClient
+from predictor.model.pricepredictor import PricePredictor, TrainedModel
+from predictor.model.weather import WeatherFetcher
+
+DAYS = 30
+
+
+def prepared(predictor : PricePredictor, end : pd.Timestamp = synthetic.END, seed : int = 42) -> pd.DataFrame:
+    weather = synthetic.weather_frame(Country.DE, DAYS, predictor.resolution, 7, seed, end)
+    prices = synthetic.price_frame(weather, seed, end)
+    return predictor._prepare_frame(weather[weather.index.minute == 0], prices)
+
+
+def assert_same_as_full(predictor : PricePredictor, previous : TrainedModel, data : pd.DataFrame) -> TrainedModel:
+    """
+    Incremental training on data gives the same model as a full build of data with the previous scaling
+    """
+    model = predictor.build_model(data, incremental=True, previous=previous)
+    assert model.lastFullTrain == previous.lastFullTrain, "expected an incremental update, not a full retrain"
+
+    learnset = data[data["price"].notna()]
+    full = predictor._train_full(data, None, previous.scaling, predictor._gram(learnset))
+    np.testing.assert_allclose(model.gram, full.gram, rtol=1e-9, atol=1e-6)
+    np.testing.assert_array_equal(model.times, full.times)
+    np.testing.assert_array_equal(model.features, full.features)
+    np.testing.assert_array_equal(np.sort(model.trainTimes), np.sort(full.trainTimes))
+    np.testing.assert_allclose(model.neighborDistance, full.neighborDistance, rtol=1e-6)
+    np.testing.assert_allclose(model.predictions, full.predictions, rtol=1e-12)
+    return model
+
+
+@pytest.fixture(params=[(backend, resolution) for backend in ["sklearn", "bucketed"] for resolution in ["hour", "quarterhour"]],
+                ids=lambda p: f"{p[0]}-{p[1]}")
+def predictor(request) -> PricePredictor:
+    backend, resolution = request.param
+    predictor = PricePredictor(Country.DE, neighborBackend=backend, resolution=resolution)
+    # the synthetic data drifts by about 10% per day, only test_drift_triggers_full_rebuild wants a rebuild
+    predictor.driftThreshold = 0.5
+    return predictor
+
+
+def test_added_rows(predictor):
+    # one day later: a new day of forecast, and the prices of the first forecast day are published
+    data = prepared(predictor, synthetic.END + pd.Timedelta(days=1))
+    before = data[data.index < data.index[-1] - pd.Timedelta(days=1)].copy()
+    before.loc[before.index >= synthetic.END, "price"] = np.nan
+    previous = predictor.build_model(before)
+    assert_same_as_full(predictor, previous, data)
+
+
+def test_all_rows_changed(predictor):
+    # e.g. all weather re-downloaded with new values: nothing to take over
+    previous = predictor.build_model(prepared(predictor))
+    assert_same_as_full(predictor, previous, prepared(predictor, seed=43))
+
+
+def test_changed_rows(predictor):
+    data = prepared(predictor)
+    previous = predictor.build_model(data)
+    # the forecast of the last days was updated, and a few known prices were corrected
+    changed = data.copy()
+    forecast = changed.index >= synthetic.END + pd.Timedelta(days=4)
+    changed.loc[forecast, "wind_0"] += np.float32(3.5)
+    corrected = changed.index[changed["price"].notna()][-50:-40]
+    changed.loc[corrected, "price"] += 0.5
+    assert_same_as_full(predictor, previous, changed)
+
+
+def test_removed_rows(predictor):
+    # the learn window moved on by two days
+    data = prepared(predictor)
+    previous = predictor.build_model(data)
+    assert_same_as_full(predictor, previous, data[data.index >= data.index[0] + pd.Timedelta(days=2)])
+
+
+def test_drift_triggers_full_rebuild(predictor):
+    predictor.driftThreshold = 0.05
+    data = prepared(predictor)
+    previous = predictor.build_model(data)
+    # prices that depend on the weather the other way round: the scaling changes completely
+    inverted = data.copy()
+    inverted["price"] = 30 - inverted["price"]
+    model = predictor.build_model(inverted, incremental=True, previous=previous)
+    assert model.lastFullTrain > previous.lastFullTrain
+    full = predictor.build_model(inverted)
+    np.testing.assert_allclose(model.scaling, full.scaling)
+    np.testing.assert_allclose(model.predictions, full.predictions)
+
+
+class StubWeatherFetcher(WeatherFetcher):
+    """
+    Hourly weather from pastDays before today until forecastDays after, all values offset by the number of the download
+    """
+    downloads : List[int]
+
+    def __init__(self):
+        super().__init__(HttpClient())
+        self.downloads = []
+
+    async def fetch(self, country : Country, pastDays : int, forecastDays : int) -> pd.DataFrame:
+        self.downloads.append(pastDays)
+        today = pd.Timestamp.now(tz="UTC").floor("D")
+        return weather_rows(today - pd.Timedelta(days=pastDays), today + pd.Timedelta(days=forecastDays), 1000.0 * len(self.downloads))
+
+
+def weather_rows(start : pd.Timestamp, end : pd.Timestamp, offset : float) -> pd.DataFrame:
+    index = pd.date_range(start, end, freq="60min", inclusive="left", name="time").as_unit("us")
+    columns = PricePredictor(Country.DE)._weather_columns()
+    values = offset + np.arange(len(index), dtype=np.float32)[:, None] + np.arange(len(columns), dtype=np.float32)[None, :] / 100
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+def test_weather_refresh_downloads_only_the_overlap():
+    fetcher = StubWeatherFetcher()
+    predictor = PricePredictor(Country.DE, weatherFetcher=fetcher, learnDays=10, forecastDays=3)
+    today = pd.Timestamp.now(tz="UTC").floor("D")
+    windowStart = today - pd.Timedelta(days=10)
+
+    # first download: the whole window
+    first = asyncio.run(predictor.fetch_weather())
+    assert first is not None
+    predictor.weather = first
+    assert fetcher.downloads == [10] and first.index[0] == windowStart
+
+    # a day later, the window moved on: previous rows before the window are dropped, settled rows are kept as they are,
+    # and the downloaded overlap replaces the previous rows
+    previous = pd.concat([weather_rows(windowStart - pd.Timedelta(days=2), windowStart, -1000.0), first])
+    predictor.weather = previous
+    merged = asyncio.run(predictor.fetch_weather())
+    assert merged is not None
+    assert fetcher.downloads == [10, predictor.weatherOverlapDays]
+    overlapStart = today - pd.Timedelta(days=predictor.weatherOverlapDays)
+    assert merged.index[0] == windowStart and merged.index[-1] == today + pd.Timedelta(days=3) - pd.Timedelta(hours=1)
+    assert merged.index.is_unique and merged.index.is_monotonic_increasing
+    pd.testing.assert_frame_equal(merged[merged.index < overlapStart], first[first.index < overlapStart], check_freq=False)
+    assert (merged[merged.index >= overlapStart].to_numpy() >= 2000).all()
+    assert list(merged.columns) == list(first.columns)
+
+
+@pytest.mark.parametrize("previousStart,previousEnd", [
+    (-10, -3), # gap: the previous download ends before the overlap
+    (-8, 3), # the previous download does not cover the start of the window
+])
+def test_weather_refresh_falls_back_to_a_full_download(previousStart, previousEnd):
+    fetcher = StubWeatherFetcher()
+    predictor = PricePredictor(Country.DE, weatherFetcher=fetcher, learnDays=10, forecastDays=3)
+    today = pd.Timestamp.now(tz="UTC").floor("D")
+    predictor.weather = weather_rows(today + pd.Timedelta(days=previousStart), today + pd.Timedelta(days=previousEnd), -1000.0)
+    weather = asyncio.run(predictor.fetch_weather())
+    assert weather is not None
+    assert fetcher.downloads == [10]
+    assert (weather.to_numpy() >= 1000).all() and weather.index[0] == today - pd.Timedelta(days=10)
+
+
+def test_interpolate_to_quarter_hours_keeps_gaps():
+    index = pd.DatetimeIndex(["2025-03-01 00:00", "2025-03-01 01:00", "2025-03-01 02:00", "2025-03-01 05:00", "2025-03-01 06:00"], tz="UTC", name="time").as_unit("us")
+    weather = pd.DataFrame({"wind_0": [0.0, 4.0, 8.0, 20.0, 0.0], "temp_0": [1.0, 1.0, 2.0, 2.0, 2.0]}, index=index, dtype=np.float32)
+    interpolated = PricePredictor._interpolate(weather, pd.Timedelta(minutes=15))
+
+    expected = pd.DatetimeIndex(["2025-03-01 00:00", "2025-03-01 00:15", "2025-03-01 00:30", "2025-03-01 00:45",
+                                 "2025-03-01 01:00", "2025-03-01 01:15", "2025-03-01 01:30", "2025-03-01 01:45",
+                                 # no hour after 02:00 and 06:00: nothing to interpolate towards
+                                 "2025-03-01 02:00",
+                                 "2025-03-01 05:00", "2025-03-01 05:15", "2025-03-01 05:30", "2025-03-01 05:45",
+                                 "2025-03-01 06:00"], tz="UTC", name="time").as_unit("us")
+    pd.testing.assert_index_equal(interpolated.index, expected)
+    np.testing.assert_allclose(interpolated["wind_0"], [0, 1, 2, 3, 4, 5, 6, 7, 8, 20, 15, 10, 5, 0])
+    np.testing.assert_allclose(interpolated["temp_0"], [1, 1, 1, 1, 1, 1.25, 1.5, 1.75, 2, 2, 2, 2, 2, 2])
+    assert (interpolated.dtypes == np.float32).all()
+
+
+def prices(times : List[str], values : List[float]) -> pd.DataFrame:
+    return pd.DataFrame({"price": values}, index=pd.DatetimeIndex(times, tz="UTC", name="time").as_unit("us"))
+
+
+def test_quarter_hour_prices_averaged_to_hours():
+    predictor = PricePredictor(Country.SE, resolution="hour")
+    # hourly until 01:00, then 15 minute prices like ENTSO-E since October 2025, with one quarter missing
+    mixed = prices(["2025-09-30 23:00", "2025-10-01 00:00", "2025-10-01 01:00", "2025-10-01 01:15", "2025-10-01 01:30", "2025-10-01 01:45",
+                    "2025-10-01 02:00", "2025-10-01 02:15", "2025-10-01 02:45"],
+                   [5.0, 6.0, 1.0, 2.0, 3.0, 6.0, 4.0, 8.0, 6.0])
+    hourly = predictor._to_resolution(mixed)
+    pd.testing.assert_frame_equal(hourly, prices(["2025-09-30 23:00", "2025-10-01 00:00", "2025-10-01 01:00", "2025-10-01 02:00"], [5.0, 6.0, 3.0, 6.0]),
+                                  check_freq=False)
+
+
+def test_hourly_prices_spread_over_quarter_hours():
+    predictor = PricePredictor(Country.SE, resolution="quarterhour")
+    mixed = prices(["2025-09-30 22:00", "2025-09-30 23:00", "2025-10-01 00:00", "2025-10-01 00:15", "2025-10-01 00:30", "2025-10-01 00:45"],
+                   [5.0, 6.0, 1.0, 2.0, 3.0, 4.0])
+    quarters = predictor._to_resolution(mixed)
+    expected = pd.concat([
+        prices([f"2025-09-30 22:{m:02d}" for m in (0, 15, 30, 45)], [5.0] * 4),
+        prices([f"2025-09-30 23:{m:02d}" for m in (0, 15, 30, 45)], [6.0] * 4),
+        mixed.iloc[2:],
+    ])
+    pd.testing.assert_frame_equal(quarters, expected, check_freq=False)
+
+    # only hourly prices: the last hour applies to all of its quarters as well
+    hourOnly = predictor._to_resolution(mixed.iloc[:2])
+    assert len(hourOnly) == 8 and (hourOnly["price"].to_numpy() == [5.0] * 4 + [6.0] * 4).all()
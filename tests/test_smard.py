@@ -0,0 +1,99 @@
+import asyncio
+import json
+from typing import Dict, List, cast
+import numpy as np
+import pandas as pd
+
+from predictor.model.httpclient import HttpClient
+from predictor.model.smard import SmardClient
+
+WEEK_MS = 7 * 24 * 3600 * 1000
+CHUNKS = [1735513200000 + i * WEEK_MS for i in range(5)]
+
+
+class StubHttp:
+    """
+    Serves a SMARD index and one chunk per week with hourly prices, and records the requested URLs
+    """
+    chunks : Dict[str, List]
+    requested : List[str]
+
+    def __init__(self):
+        self.chunks = {}
+        for week, start in enumerate(CHUNKS):
+            series = [[start + h * 3600 * 1000, float(week * 1000 + h)] for h in range(7 * 24)]
+            if week == len(CHUNKS) - 1:
+                # the newest chunk is not complete yet
+                for entry in series[30:]:
+                    entry[1] = None
+            self.chunks[f"4169_DE_hour_{start}"] = series
+        self.requested = []
+
+    async def get_json(self, url : str):
+        self.requested.append(url)
+        assert url.endswith("/4169/DE/index_hour.json")
+        # unsorted, as SMARD does not promise an order
+        return {"timestamps": list(reversed(CHUNKS))}
+
+    async def get_text(self, url : str) -> str:
+        self.requested.append(url)
+        name = url.rsplit("/", 1)[1].removesuffix(".json")
+        return json.dumps({"meta_data": {}, "series": self.chunks[name]})
+
+    def chunk_requests(self) -> List[int]:
+        return sorted(int(url.rsplit("_", 1)[1].removesuffix(".json")) for url in self.requested if "index" not in url)
+
+
+def fetch(smard : SmardClient, http : StubHttp, startTs : int = 0):
+    http.requested = []
+    return asyncio.run(smard.fetch_prices(cast(HttpClient, http), "4169", "DE", "hour", startTs))
+
+
+def test_closed_chunks_are_downloaded_once(tmp_path):
+    http = StubHttp()
+    smard = SmardClient(str(tmp_path))
+    first = fetch(smard, http)
+    assert http.chunk_requests() == CHUNKS
+    # ct/kWh, hourly, without the missing prices of the newest chunk
+    assert len(first) == 4 * 7 * 24 + 30
+    index = pd.DatetimeIndex(first.index)
+    assert index.is_monotonic_increasing and str(index.tz) == "UTC"
+    assert first["price"].iloc[0] == 0.0 and first["price"].iloc[-1] == (4000 + 29) / 10
+
+    # from memory: only the index and the two newest chunks
+    again = fetch(smard, http)
+    assert len(http.requested) == 3 and http.chunk_requests() == CHUNKS[-2:]
+    assert again.equals(first)
+
+    # a new process: from the disk cache
+    restarted = SmardClient(str(tmp_path))
+    fromDisk = fetch(restarted, http)
+    assert len(http.requested) == 3 and http.chunk_requests() == CHUNKS[-2:]
+    assert fromDisk.equals(first)
+
+
+def test_only_chunks_after_start_are_fetched(tmp_path):
+    http = StubHttp()
+    smard = SmardClient(str(tmp_path))
+    # in the third week: the third chunk is needed as well, the ones before not
+    data = fetch(smard, http, CHUNKS[2] + 3 * 24 * 3600 * 1000)
+    assert http.chunk_requests() == CHUNKS[2:]
+    assert pd.DatetimeIndex(data.index)[0] == pd.Timestamp(CHUNKS[2], unit="ms", tz="UTC")
+
+
+def test_without_cache_dir(tmp_path):
+    http = StubHttp()
+    smard = SmardClient(None)
+    fetch(smard, http)
+    fetch(smard, http)
+    assert http.chunk_requests() == CHUNKS[-2:]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_unreadable_cache_file_is_downloaded_again(tmp_path):
+    http = StubHttp()
+    fetch(SmardClient(str(tmp_path)), http)
+    (tmp_path / f"4169_DE_hour_{CHUNKS[0]}.npy").write_bytes(b"garbage")
+    data = fetch(SmardClient(str(tmp_path)), http)
+    assert http.chunk_requests() == [CHUNKS[0]] + CHUNKS[-2:]
+    np.testing.assert_array_equal(data["price"].to_numpy()[:3], [0.0, 0.1, 0.2])
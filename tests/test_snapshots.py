@@ -0,0 +1,83 @@
+import os
+import numpy as np
+
+from predictor.model.priceseries import PriceSeries
+from predictor.model.snapshots import LeaderLock, SnapshotMeta, SnapshotStore
+
+
+def series(hours : int = 48, seed : int = 0) -> PriceSeries:
+    rng = np.random.default_rng(seed)
+    timestamps = 1740787200 + 3600 * np.arange(hours, dtype=np.int64)
+    known = np.where(np.arange(hours) < hours // 2, rng.normal(10, 5, hours), np.nan)
+    return PriceSeries(timestamps, rng.normal(10, 5, hours), known)
+
+
+def test_round_trip(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    assert store.read("DE") is None and store.read_meta("DE") is None
+    written = series()
+    store.write("DE", written, SnapshotMeta(1000, 1740787200.5, 1740790800.25))
+
+    snapshot = store.read("DE")
+    assert snapshot is not None
+    read, meta = snapshot
+    assert (meta.version, meta.lastPriceUpdate, meta.lastWeatherUpdate) == (1000, 1740787200.5, 1740790800.25)
+    assert len(read) == len(written)
+    for name in ("timestamps", "predicted", "known", "merged"):
+        np.testing.assert_array_equal(getattr(read, name), getattr(written, name))
+        # followers serve views into the mapped file, which must not be written to
+        assert not getattr(read, name).flags.writeable
+    np.testing.assert_array_equal(read.values(), written.values())
+    assert read.last_known_price() == written.last_known_price()
+
+
+def test_only_newer_versions_are_read(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    store.write("DE", series(seed=1), SnapshotMeta(1000, 0.0, 0.0))
+    assert store.read("DE", newerThan=1000) is None
+    store.write("DE", series(seed=2), SnapshotMeta(2000, 0.0, 0.0))
+    snapshot = store.read("DE", newerThan=1000)
+    assert snapshot is not None and snapshot[1].version == 2000
+    np.testing.assert_array_equal(snapshot[0].predicted, series(seed=2).predicted)
+    # a mapping of the previous version stays valid after it was replaced
+    store.write("DE", series(seed=3), SnapshotMeta(3000, 0.0, 0.0))
+    np.testing.assert_array_equal(snapshot[0].predicted, series(seed=2).predicted)
+    assert [f for f in os.listdir(tmp_path) if f.startswith(".")] == []
+
+
+def test_invalid_files_are_ignored(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    store.write("DE", series(), SnapshotMeta(1000, 0.0, 0.0))
+    with open(store.path("DE"), "rb") as f:
+        data = f.read()
+
+    def replace(content : bytes):
+        with open(store.path("DE"), "wb") as f:
+            f.write(content)
+
+    # truncated
+    replace(data[:-8])
+    assert store.read("DE") is None
+    # other format
+    replace(b"EPXS" + (SnapshotStore.FORMAT + 1).to_bytes(4, "little") + data[8:])
+    assert store.read("DE") is None and store.read_meta("DE") is None
+    # not a snapshot at all
+    replace(b"")
+    assert store.read("DE") is None
+
+
+def test_leader_handover(tmp_path):
+    path = str(tmp_path / "trainer.lock")
+    first, second = LeaderLock(path), LeaderLock(path)
+    assert first.try_acquire() and first.held
+    assert first.try_acquire(), "acquiring again keeps the lock"
+    assert not second.try_acquire() and not second.held
+    with open(path) as f:
+        assert f.read() == str(os.getpid())
+
+    # the trainer exits (or releases it): the next try takes over
+    first.release()
+    assert not first.held
+    assert second.try_acquire() and second.held
+    assert not first.try_acquire()
+    second.release()